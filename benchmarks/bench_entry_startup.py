@@ -0,0 +1,70 @@
+"""
+startup benchmark of `python -m rpcindaemon.entry`, the command run over ssh for
+every control operation.
+
+    python benchmarks/bench_entry_startup.py [--repeat=20]
+
+print a json report: median/min wall time of `get-pid`, of a bare `python -c pass`
+for reference, and the slowest imports of `get-pid`.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def wall_times(argv, repeat, cwd):
+    times = []
+    for _ in range(repeat):
+        st = time.perf_counter()
+        subprocess.run(argv, cwd=cwd, env=_env(), check=True, capture_output=True)
+        times.append(time.perf_counter() - st)
+    return {"median": statistics.median(times), "min": min(times)}
+
+
+def slowest_imports(argv, cwd, top=10):
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime"] + argv[1:],
+        cwd=cwd,
+        env=_env(),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    imports = []
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        imports.append((int(cumulative_us), name.strip()))
+    imports.sort(reverse=True)
+    return [{"module": name, "cumulative_us": us} for us, name in imports[:top]]
+
+
+def main(repeat=20):
+    get_pid = [sys.executable, "-m", "rpcindaemon.entry", "get-pid", "999999"]
+    with tempfile.TemporaryDirectory() as cwd:
+        report = {
+            "python": wall_times([sys.executable, "-c", "pass"], repeat, cwd),
+            "get_pid": wall_times(get_pid, repeat, cwd),
+            "get_pid_imports": slowest_imports(get_pid, cwd),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
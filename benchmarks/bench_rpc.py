@@ -0,0 +1,161 @@
+"""
+throughput and latency of `RpcServer` + `_RPCProxy` on localhost.
+
+    python benchmarks/bench_rpc.py [--concurrency=1,8] [--payload=64,65536]
+        [--codec=pickle,pickle5,msgpack] [--connections=1,4] [--duration=2]
+        [--server-workers=4] [--output=report.json] [--baseline=report.json]
+
+the server runs in a process of its own with `server-workers` threads. for every
+combination of the swept parameters, `concurrency` threads call `echo(payload)`
+for `duration` seconds through a pool of `connections` connections. print a json
+report with ops/sec and latency percentiles of each combination. with
+`--baseline`, each combination also gets its ops/sec ratio to the baseline's, so a
+regression of the rpc hot path shows up as a ratio below 1.
+
+codecs whose library is not installed are skipped.
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rpcindaemon.codec import usable
+from rpcindaemon.rpcserver import RpcServer, ServerCmd
+from rpcindaemon.task import _RPCPool
+
+PORT = 9992
+
+
+class BenchCmd(ServerCmd):
+    def echo(self, payload):
+        return payload
+
+
+def _serve(workers, ready, stop):
+    sys.stdout = open(os.devnull, "w")  # keep the report on stdout clean
+    server = RpcServer(PORT, BenchCmd, workers)
+    server.start()
+    ready.set()
+    stop.wait()
+    server.stop()
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "p50": values[len(values) // 2],
+        "p99": values[int(len(values) * 0.99)],
+        "p999": values[int(len(values) * 0.999)],
+        "max": values[-1],
+    }
+
+
+def run_one(address, concurrency, payload, codec, connections, duration):
+    pool = _RPCPool(address, codecs=[codec], max_size=connections)
+    data = b"x" * payload
+    pool.do_rpc("echo", data)  # connect and negotiate the codec
+    latencies = [[] for _ in range(concurrency)]
+    start = threading.Barrier(concurrency + 1)
+    deadline = []
+
+    def worker(out):
+        start.wait()
+        end = deadline[0]
+        while True:
+            st = time.perf_counter()
+            if st >= end:
+                return
+            pool.do_rpc("echo", data)
+            out.append(time.perf_counter() - st)
+
+    threads = [threading.Thread(target=worker, args=(out,)) for out in latencies]
+    for t in threads:
+        t.start()
+    st = time.perf_counter()
+    deadline.append(st + duration)
+    start.wait()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - st
+    pool.close()
+    merged = [v for out in latencies for v in out]
+    return {
+        "concurrency": concurrency,
+        "payload": payload,
+        "codec": codec,
+        "connections": connections,
+        "calls": len(merged),
+        "ops_per_sec": len(merged) / elapsed,
+        "mb_per_sec": 2 * payload * len(merged) / elapsed / 1e6,
+        "latency": _percentiles(merged),
+    }
+
+
+def _key(r):
+    return (r["concurrency"], r["payload"], r["codec"], r["connections"])
+
+
+def main(
+    concurrency=(1, 8),
+    payload=(64, 65536),
+    codec=("pickle", "pickle5", "msgpack"),
+    connections=(1, 4),
+    duration=2.0,
+    server_workers=4,
+    output=None,
+    baseline=None,
+):
+    # fire passes `--payload=64` as an int and `--payload=64,1024` as a tuple
+    concurrency, payload, codec, connections = (
+        v if isinstance(v, (list, tuple)) else [v]
+        for v in (concurrency, payload, codec, connections)
+    )
+    codecs = [c.name for c in usable(codec)]
+    ready, stop = multiprocessing.Event(), multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve, args=(server_workers, ready, stop))
+    server.start()
+    ready.wait()
+    address = (socket.gethostbyname(socket.gethostname()), PORT)
+    results = []
+    try:
+        for args in itertools.product(concurrency, payload, codecs, connections):
+            results.append(run_one(address, *args, duration))
+    finally:
+        stop.set()
+        server.join()
+
+    if baseline is not None:
+        with open(baseline) as f:
+            base = {_key(r): r for r in json.load(f)["results"]}
+        for r in results:
+            b = base.get(_key(r))
+            if b is not None:
+                r["vs_baseline"] = r["ops_per_sec"] / b["ops_per_sec"]
+
+    report = {
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "duration": duration,
+        "server_workers": server_workers,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output is not None:
+        with open(output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
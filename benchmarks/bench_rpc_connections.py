@@ -0,0 +1,94 @@
+"""
+benchmark of `RpcServer` with many concurrent client connections.
+
+    python benchmarks/bench_rpc_connections.py [--connections=1000] [--rounds=5]
+
+open `connections` clients, then in every round each client sends a `get_pid`
+request before all replies are read. print a json report: connect time, request
+throughput and latency percentiles, and the server's cpu time while idle.
+"""
+
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+from multiprocessing.connection import Client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rpcindaemon.rpcserver import RpcServer, ServerCmd
+
+PORT = 9990
+
+
+def _raise_nofile(n):
+    if sys.platform == "win32":
+        return  # no rlimit, the server takes 512 connections there
+    import resource
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    want = min(hard, max(soft, n))
+    if want > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (want, hard))
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return {
+        "p50": values[len(values) // 2],
+        "p99": values[int(len(values) * 0.99)],
+        "max": values[-1],
+    }
+
+
+def main(connections=1000, rounds=5):
+    # client and server sockets live in this process
+    _raise_nofile(2 * connections + 64)
+    server = RpcServer(PORT, ServerCmd)
+    server.start()
+    address = (socket.gethostbyname(socket.gethostname()), PORT)
+    try:
+        st = time.perf_counter()
+        clients = [Client(address) for _ in range(connections)]
+        connect_time = time.perf_counter() - st
+
+        latencies = []
+        st = time.perf_counter()
+        for _ in range(rounds):
+            sent = []
+            for c in clients:
+                sent.append(time.perf_counter())
+                c.send(("get_pid", (), {}))
+            for c, t in zip(clients, sent):
+                c.recv()
+                latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - st
+
+        # the server thread should sleep while nobody talks to it
+        cpu = time.process_time()
+        time.sleep(1)
+        idle_cpu = time.process_time() - cpu
+
+        for c in clients:
+            c.close()
+    finally:
+        server.stop()
+
+    report = {
+        "connections": connections,
+        "requests": connections * rounds,
+        "connect_time": connect_time,
+        "requests_per_sec": connections * rounds / elapsed,
+        "latency": _percentiles(latencies),
+        "latency_mean": statistics.mean(latencies),
+        "idle_cpu_per_sec": idle_cpu,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
@@ -0,0 +1,113 @@
+"""
+latency of rpc calls with small, variable service times.
+
+    python benchmarks/bench_rpc_latency.py [--calls=2000] [--max-service=0.002]
+
+compare the former client, reading a non-blocking socket and sleeping 0.2s on
+`BlockingIOError`, with `_RPCProxy` waiting for the reply with poll and a
+deadline. each call sleeps a random time up to `max-service` seconds on the
+server. print a json report of the latency percentiles of both.
+"""
+
+import json
+import os
+import random
+import socket
+import sys
+import time
+from multiprocessing.connection import Connection
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rpcindaemon.rpcserver import RpcServer, ServerCmd
+from rpcindaemon.task import _RPCProxy
+
+PORT = 9991
+
+
+class BenchCmd(ServerCmd):
+    def service(self, seconds):
+        time.sleep(seconds)
+
+
+class LegacyProxy:
+    """
+    the sleep/retry client this benchmark is measured against
+    """
+
+    def __init__(self, address):
+        s = socket.create_connection(address)
+        s.setblocking(False)
+        self._connection = Connection(s.detach())
+
+    def do_rpc(self, func_name, *args, **kwargs):
+        self._connection.send((func_name, args, kwargs))
+        try_count = 0
+        while True:
+            try:
+                return self._connection.recv()
+            except BlockingIOError:
+                if try_count > 10:
+                    raise
+                time.sleep(0.2)
+                try_count += 1
+
+    def close(self):
+        self._connection.close()
+
+
+def _percentiles(values):
+    values = sorted(values)
+    return {
+        "p50": values[len(values) // 2],
+        "p99": values[int(len(values) * 0.99)],
+        "p999": values[int(len(values) * 0.999)],
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+
+def _measure(client, service_times):
+    latencies = []
+    for t in service_times:
+        st = time.perf_counter()
+        client.do_rpc("service", t)
+        latencies.append(time.perf_counter() - st)
+    client.close()
+    return latencies
+
+
+def main(calls=2000, max_service=0.002):
+    server = RpcServer(PORT, BenchCmd)
+    server.start()
+    address = (socket.gethostbyname(socket.gethostname()), PORT)
+    rng = random.Random(0)
+    service_times = [rng.uniform(0, max_service) for _ in range(calls)]
+    try:
+        # the legacy client sleeps 0.2s per miss, a few hundred calls are enough
+        legacy = _measure(LegacyProxy(address), service_times[: min(calls, 200)])
+        deadline = _measure(_RPCProxy(address), service_times)
+        deadline_with_timeout = []
+        client = _RPCProxy(address)
+        for t in service_times:
+            st = time.perf_counter()
+            client.do_rpc("service", t, timeout=1)
+            deadline_with_timeout.append(time.perf_counter() - st)
+        client.close()
+    finally:
+        server.stop()
+
+    report = {
+        "calls": calls,
+        "max_service": max_service,
+        "legacy_sleep_retry": _percentiles(legacy),
+        "poll": _percentiles(deadline),
+        "poll_with_timeout": _percentiles(deadline_with_timeout),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
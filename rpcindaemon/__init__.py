@@ -1,4 +1,65 @@
-from .daemonize import F, makedaemon, nodaemon
+import importlib as _importlib
+
+from . import exceptions as _exceptions
 from .exceptions import *
-from .rpcserver import ServerCmd
-from .task import Task, batch_terminate
+
+# public names are imported from their submodule on first access, so that
+# `python -m rpcindaemon.entry` does not pay for paramiko, multiprocessing and
+# the daemonize machinery it never uses.
+_lazy_attrs = {
+    "AsyncTask": "aiotask",
+    "async_batch_get_pid": "aiotask",
+    "async_batch_get_status": "aiotask",
+    "async_batch_run": "aiotask",
+    "async_batch_terminate": "aiotask",
+    "AsyncRpcServer": "aiorpcserver",
+    "F": "daemonize",
+    "makedaemon": "daemonize",
+    "nodaemon": "daemonize",
+    "worker_context": "daemonize",
+    "RpcFuture": "task",
+    "RpcHandler": "rpcserver",
+    "rpc_method": "rpcserver",
+    "ServerCmd": "rpcserver",
+    "SSHPool": "sshpool",
+    "ssh_pool": "sshpool",
+    "Task": "task",
+    "batch_get_pid": "task",
+    "batch_get_status": "task",
+    "batch_run": "task",
+    "batch_terminate": "task",
+}
+
+_submodules = {
+    "agent",
+    "aioconnection",
+    "aiorpcserver",
+    "aiotask",
+    "codec",
+    "daemonize",
+    "entry",
+    "pubsub",
+    "rpcserver",
+    "sshpool",
+    "stats",
+    "task",
+}
+
+__all__ = [
+    name for name, value in vars(_exceptions).items() if isinstance(value, type)
+] + list(_lazy_attrs)
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return _importlib.import_module(f".{name}", __name__)
+    module = _lazy_attrs.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(_importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attrs) | _submodules)
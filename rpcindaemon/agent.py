@@ -0,0 +1,144 @@
+"""
+long-lived per-host agent serving control operations over rpc.
+
+`python -m rpcindaemon.entry agent --port=PORT` runs it in background. a `Task`
+created with `agent_port=PORT` talks to it with the same rpc framing used by
+`Task.do_rpc`, ssh is only used to start the agent when it is not reachable.
+
+the agent runs shell commands, so it only listens on 127.0.0.1 unless told
+otherwise, and every connection must prove it knows the agent's secret before
+anything it sends is unpickled. the secret is in `pidfile-agent-PORT.key`,
+readable by the user only, and printed by the command starting the agent: a
+client gets it over ssh, as the user.
+"""
+
+import os
+import secrets
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import entry
+from .daemonize import makedaemon
+from .exceptions import PidfileExistsError
+from .readiness import state_file, wait_state
+from .rpcserver import RpcServer, ServerCmd
+
+__all__ = ["AgentCmd", "run_agent"]
+
+
+class AgentCmd(ServerCmd):
+    def launch(self, cmds, timeout=60):
+        """
+        run shell commands concurrently, like ssh exec does, and return a list of
+        (stdout, stderr) aligned with `cmds`
+        """
+        with ThreadPoolExecutor(max(1, min(len(cmds), 32))) as executor:
+            return list(executor.map(lambda cmd: _shell(cmd, timeout), cmds))
+
+    def get_pids(self, task_ids, working_dir=""):
+        return entry.pid_status(task_ids, _resolve(working_dir))
+
+    def terminate(self, pids, task_ids, working_dir=""):
+        entry.terminate_proc(pids, task_ids, _resolve(working_dir))
+
+    def log_tail(self, task_id, lines=100, working_dir=""):
+        return entry.read_log_tail(task_id, lines, _resolve(working_dir))
+
+    def wait_state(self, task_id, state="ready", timeout=10, working_dir=""):
+        path = os.path.join(_resolve(working_dir), state_file(f"pidfile-{task_id}"))
+        return wait_state(path, state, timeout)
+
+    def host_stats(self):
+        return entry.get_host_stats()
+
+
+def _resolve(working_dir):
+    # same as `cd $working_dir` in the ssh session started in home dir
+    return os.path.join(os.path.expanduser("~"), os.path.expanduser(working_dir))
+
+
+def _shell(cmd, timeout):
+    bash = shutil.which("bash")
+    try:
+        p = subprocess.run(
+            [bash, "-c", cmd] if bash else cmd,
+            shell=bash is None,
+            cwd=os.path.expanduser("~"),
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as e:
+        return "", f"timeout after {e.timeout} seconds"
+    return (
+        p.stdout.decode(errors="replace"),
+        p.stderr.decode(errors="replace"),
+    )
+
+
+def _load_key(port):
+    """
+    the agent's secret, created once with permissions 0600
+    """
+    path = f"pidfile-agent-{port}.key"
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        deadline = time.monotonic() + 1
+        while True:
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            if time.monotonic() > deadline:
+                # left empty by a crash
+                os.remove(path)
+                return _load_key(port)
+            time.sleep(0.01)  # being written by another starter
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    return key
+
+
+@makedaemon()
+def _agent_daemon(task_id, f, port, host):
+    # terminate and wait_state block for seconds, don't let them stall other calls
+    server = RpcServer(port, AgentCmd, 8, host=host, authkey=_load_key(port).encode())
+    server.start()
+    print(f"agent {task_id} running on {host}:{port}", flush=True)
+    stop = False
+
+    def _sighandler():
+        nonlocal stop
+        stop = True
+
+    f.set_sighandler_single_process(_sighandler)
+    f.notify_ready()
+    try:
+        while not stop:
+            time.sleep(0.5)
+    finally:
+        server.stop()
+    print(f"agent {task_id} quit", flush=True)
+
+
+def run_agent(port: int, host: str = "127.0.0.1"):
+    """
+    print `agent-key:SECRET`, then start the agent in background unless it is
+    running. a pidfile left by an agent that died is removed first.
+    """
+    # the pidfile and log of the agent are `pidfile-agent-{port}[.log]`
+    task_id = f"agent-{port}"
+    print(f"agent-key:{_load_key(port)}", flush=True)
+    pid, alive, _ = entry.pid_status([task_id])[task_id]
+    if alive:
+        return
+    if pid:
+        os.remove(f"pidfile-{task_id}")
+    try:
+        _agent_daemon(task_id, port, host)
+    except PidfileExistsError:
+        pass  # started by another controller meanwhile
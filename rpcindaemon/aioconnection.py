@@ -0,0 +1,62 @@
+import asyncio
+import pickle
+import struct
+from multiprocessing.reduction import ForkingPickler
+
+__all__ = ["AsyncConnection", "open_connection"]
+
+
+class AsyncConnection:
+    """
+    asyncio counterpart of `multiprocessing.connection.Connection`, speaking the
+    same framing so it can talk to `RpcServer` and `_RPCProxy`: a 4-byte signed
+    big-endian length(-1 and an 8-byte length for frames over 2GiB) followed by
+    the payload, a pickled object for `send` and `recv`.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    async def recv_bytes(self):
+        (size,) = struct.unpack("!i", await self._reader.readexactly(4))
+        if size == -1:
+            (size,) = struct.unpack("!Q", await self._reader.readexactly(8))
+        return await self._reader.readexactly(size)
+
+    async def send_bytes(self, buf):
+        n = len(buf)
+        if n > 0x7FFFFFFF:
+            self._writer.write(struct.pack("!iQ", -1, n))
+            self._writer.write(buf)
+        elif n > 16384:
+            self._writer.write(struct.pack("!i", n))
+            self._writer.write(buf)
+        else:
+            self._writer.write(struct.pack("!i", n) + bytes(buf))
+        await self._writer.drain()
+
+    async def recv(self):
+        return pickle.loads(await self.recv_bytes())
+
+    async def send(self, obj):
+        await self.send_bytes(ForkingPickler.dumps(obj))
+
+    def close(self):
+        self._writer.close()
+
+    async def wait_closed(self):
+        try:
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+async def open_connection(address, timeout=None):
+    """
+    connect to `address` within `timeout` seconds and return an `AsyncConnection`
+
+    raise `asyncio.TimeoutError` if timeout
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), timeout)
+    return AsyncConnection(reader, writer)
@@ -0,0 +1,385 @@
+import asyncio
+import inspect
+import socket
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from .aioconnection import AsyncConnection
+from .codec import PICKLE, frames_size, negotiate
+from .exceptions import ParamError
+from .pubsub import Broker
+from .rpcserver import RpcHandler, ServerCmd, _Call, _Dispatcher, _pull, _Streams
+from .stats import ServerStats
+
+__all__ = ["AsyncRpcServer"]
+
+
+async def _apull(agen, n):
+    """
+    see `_pull`
+    """
+    items = []
+    try:
+        for _ in range(n):
+            items.append(await agen.__anext__())
+    except StopAsyncIteration:
+        return items, True
+    except Exception as e:
+        return items, e
+    return items, False
+
+
+async def _close_gen(gen):
+    if inspect.isasyncgen(gen):
+        await gen.aclose()
+    else:
+        gen.close()
+
+
+_SUBSCRIPTION = ("__subscribe__", "__unsubscribe__")
+
+
+class AsyncRpcServer:
+    def __init__(
+        self,
+        port: int,
+        cmd_cls: typing.Type[typing.Union[ServerCmd, RpcHandler]],
+        workers: int = 0,
+        worker_type: str = "thread",
+    ):
+        """
+        asyncio version of `RpcServer` speaking the same protocol, so `_RPCProxy` and
+        `AsyncTask` talk to it unchanged. the event loop runs on its own thread.
+
+        `async def` methods of `cmd_cls` are awaited on the loop, so thousands of
+        slow calls can be in flight without a thread each. requests of one
+        connection are still executed in order.
+
+        Params:
+            port: listening port
+            cmd_cls: `ServerCmd` or `RpcHandler` subclass executing the requests
+            workers:
+                0: run plain(not async) methods on the loop thread, blocking the
+                other connections like `RpcServer(workers=0)`
+                >0: run plain methods on a pool of `workers` threads
+            worker_type: only "thread"
+        """
+        if worker_type != "thread":
+            raise ParamError("worker_type of asyncio server must be thread")
+        self.port = port
+        self.cmd_cls = cmd_cls
+        self.workers = workers
+        self.worker_type = worker_type
+        self._dispatcher = None
+        self.loop = None
+        self._server = None
+        self._server_thread = None
+        self._socket_info = None
+        self._executor = None
+        self._handlers = set()
+        self._streams = _Streams(asyncio.Lock)
+        # subscribers are keyed by the `asyncio.Event` waking up their pusher
+        self._broker = Broker(self._wake_pusher)
+        self._busy = 0
+        self._busy_time = 0.0
+        self._completed = 0
+        self._started_at = None
+        self._stats = ServerStats()
+
+    def start(self):
+        host = socket.gethostbyname(socket.gethostname())
+        self._socket_info = (host, self.port)
+        self._dispatcher = _Dispatcher(self.cmd_cls)
+        if self.workers > 0:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="rpc-worker"
+            )
+        self.loop = asyncio.new_event_loop()
+        self._server_thread = threading.Thread(target=self.loop.run_forever)
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        self._started_at = time.perf_counter()
+        try:
+            # raise here if the port is in use
+            self._call_soon(self._listen()).result()
+        except:
+            self._close_loop()
+            raise
+        print(f"Start server[RPC] running at {host}:{self.port}")
+
+    def stop(self):
+        if self.loop is not None:
+            self._call_soon(self._shutdown()).result()
+            self._close_loop()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+            self._dispatcher = None
+        if self._stats:
+            print(f"server[RPC] stats(ms):\n{self._stats.format()}")
+        print("Close server[RPC]")
+
+    def publish(self, topic, payload):
+        """
+        see `RpcServer.publish`, thread safe
+        """
+        self._broker.publish(topic, payload)
+
+    def _wake_pusher(self, wakeup):
+        try:
+            self.loop.call_soon_threadsafe(wakeup.set)
+        except (AttributeError, RuntimeError):  # stopped
+            pass
+
+    def pool_stats(self):
+        """
+        see `RpcServer.pool_stats`. busy is the number of requests in flight
+        """
+        uptime = time.perf_counter() - self._started_at
+        return {
+            "workers": self.workers,
+            "worker_type": "asyncio",
+            "queued": 0,
+            "busy": self._busy,
+            "completed": self._completed,
+            "utilisation": self._busy_time / (max(1, self.workers) * uptime),
+        }
+
+    def stats(self):
+        """
+        see `RpcServer.stats`
+        """
+        return {"pool": self.pool_stats(), "methods": self._stats.snapshot()}
+
+    def _call_soon(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _close_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._server_thread.join()
+        self._server_thread = None
+        self.loop.close()
+        self.loop = None
+
+    async def _listen(self):
+        self._server = await asyncio.start_server(
+            self._handle,
+            *self._socket_info,
+            reuse_address=True,
+            backlog=socket.SOMAXCONN,
+        )
+
+    async def _shutdown(self):
+        self._server.close()
+        for task in list(self._handlers):
+            task.cancel()
+        if self._handlers:
+            await asyncio.wait(self._handlers)
+        for stream in self._streams.pop_all():
+            if stream.gen is not None:
+                await _close_gen(stream.gen)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        c = AsyncConnection(reader, writer)
+        codec = PICKLE  # till the client negotiates another one
+        send_lock = asyncio.Lock()
+        tagged = set()
+        wakeup = asyncio.Event()
+        pusher = None
+        try:
+            while True:
+                try:
+                    frames = await codec.async_recv_frames(c)
+                    call = _Call(time.perf_counter(), frames_size(frames))
+                    request = codec.decode(frames)
+                except Exception:  # closed(IncompleteReadError) or garbage
+                    break
+                if len(request) == 3 and request[0] == "__hello__":
+                    new_codec = negotiate(*request[1], **request[2])
+                    try:
+                        await self._reply(c, codec, new_codec.name)
+                    except (EOFError, OSError):
+                        break  # closed by client
+                    codec = new_codec
+                    continue
+                if len(request) == 4 and request[1] in _SUBSCRIPTION:
+                    req_id, func_name, args, kwargs = request
+                    if func_name == "__subscribe__":
+                        if pusher is None:
+                            pusher = asyncio.create_task(
+                                self._push_forever(c, codec, send_lock, wakeup)
+                            )
+                        self._broker.subscribe(wakeup, *args, **kwargs)
+                    else:
+                        self._broker.unsubscribe(wakeup, *args, **kwargs)
+                    try:
+                        async with send_lock:
+                            await self._reply(c, codec, None, req_id)
+                    except (EOFError, OSError):
+                        break  # closed by client
+                    continue
+                if len(request) == 4:
+                    # tagged requests run concurrently and are answered as they complete
+                    t = asyncio.create_task(
+                        self._serve_tagged(c, codec, send_lock, request, call)
+                    )
+                    tagged.add(t)
+                    t.add_done_callback(tagged.discard)
+                    continue
+                r = await self._execute(request, call)
+                try:
+                    async with send_lock:
+                        await self._reply(c, codec, r, call=call)
+                except (EOFError, OSError):
+                    break  # closed by client
+        except asyncio.CancelledError:
+            pass  # by `stop()`, end quietly
+        finally:
+            self._broker.unsubscribe(wakeup)
+            if pusher is not None:
+                pusher.cancel()
+            for t in tagged:
+                t.cancel()
+            self._handlers.discard(task)
+            c.close()
+
+    async def _push_forever(self, c, codec, send_lock, wakeup):
+        # a slow consumer only holds back its own pusher, events are conflated meanwhile
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            events = self._broker.take(wakeup)
+            if not events:
+                continue
+            try:
+                frames = codec.encode((None, events))
+            except Exception as e:  # cannot encode
+                print(f"cannot push events {[topic for topic, _ in events]}: {e}")
+                continue
+            try:
+                async with send_lock:
+                    for frame in frames:
+                        await c.send_bytes(frame)
+            except (EOFError, OSError):
+                return  # closed by client
+
+    async def _serve_tagged(self, c, codec, send_lock, request, call):
+        req_id, *request = request
+        r = await self._execute(request, call)
+        try:
+            async with send_lock:
+                await self._reply(c, codec, r, req_id, call)
+        except (EOFError, OSError):
+            pass  # closed by client
+
+    async def _execute(self, request, call=None):
+        func_name, args, kwargs = request
+        self._busy += 1
+        st = time.perf_counter()
+        try:
+            if func_name == "__batch__":
+                return await self._execute_batch(*args, **kwargs)
+            return await self._call(func_name, args, kwargs)
+        except Exception as e:
+            return e
+        finally:
+            elapsed = time.perf_counter() - st
+            if call is not None:
+                call.func_name = func_name
+                call.elapsed = elapsed
+            self._busy -= 1
+            self._completed += 1
+            self._busy_time += elapsed
+
+    async def _call(self, func_name, args, kwargs):
+        if func_name == "__pool_stats__":
+            return self.pool_stats()
+        if func_name == "__stats__":
+            return self.stats()
+        if func_name == "__stream_next__":
+            return await self._stream_next(*args, **kwargs)
+        if func_name == "__stream_close__":
+            return await self._stream_close(*args, **kwargs)
+        execute = self._dispatcher.execute
+        method = self._dispatcher.method(func_name)
+        if self._executor is not None and not inspect.iscoroutinefunction(method):
+            r = await self.loop.run_in_executor(
+                self._executor, execute, func_name, args, kwargs
+            )
+        else:
+            r = execute(func_name, args, kwargs)
+        if inspect.isawaitable(r):
+            r = await r
+        if inspect.isgenerator(r) or inspect.isasyncgen(r):
+            return self._streams.open(r)
+        return r
+
+    async def _stream_next(self, stream_id, n):
+        """
+        see `RpcServer._stream_next`
+        """
+        stream = self._streams.get(stream_id)
+        async with stream.lock:
+            index = stream.next_index
+            stream.next_index += 1
+            if stream.gen is None:
+                return index, [], True
+            if inspect.isasyncgen(stream.gen):
+                items, done = await _apull(stream.gen, n)
+            elif self._executor is not None:
+                items, done = await self.loop.run_in_executor(
+                    self._executor, _pull, stream.gen, n
+                )
+            else:
+                items, done = _pull(stream.gen, n)
+            if done:
+                stream.gen = None
+            return index, items, done
+
+    async def _stream_close(self, stream_id):
+        stream = self._streams.pop(stream_id)
+        if stream is not None and stream.gen is not None:
+            async with stream.lock:
+                await _close_gen(stream.gen)
+
+    async def _execute_batch(self, calls, parallel=False):
+        """
+        see `RpcServer._execute_batch`. `parallel` awaits the calls concurrently
+        """
+        if parallel:
+            return await asyncio.gather(*(self._execute_one(call) for call in calls))
+        return [await self._execute_one(call) for call in calls]
+
+    async def _execute_one(self, call):
+        try:
+            return await self._call(*call)
+        except Exception as e:
+            return e
+
+    async def _reply(self, c, codec, r, req_id=None, call=None):
+        error = isinstance(r, Exception)
+        try:
+            frames = codec.encode(r if req_id is None else (req_id, r))
+        except Exception as e:  # cannot encode
+            error = True
+            frames = codec.encode(e if req_id is None else (req_id, e))
+        for frame in frames:
+            await c.send_bytes(frame)
+        if call is not None:
+            queue = time.perf_counter() - call.received - call.elapsed
+            self._stats.record(
+                call.func_name,
+                call.elapsed,
+                queue,
+                error,
+                call.bytes_in,
+                frames_size(frames),
+            )
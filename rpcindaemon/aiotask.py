@@ -0,0 +1,409 @@
+import asyncio
+import functools
+import socket
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from .aioconnection import open_connection
+from .codec import PICKLE, get_codec, usable
+from .exceptions import *
+from .rpcserver import StreamHandle
+from .sshpool import ssh_pool
+from .task import (
+    Task,
+    _batch_call,
+    batch_get_pid,
+    batch_get_status,
+    batch_run,
+    batch_terminate,
+)
+
+__all__ = [
+    "AsyncTask",
+    "async_batch_run",
+    "async_batch_get_pid",
+    "async_batch_get_status",
+    "async_batch_terminate",
+]
+
+
+class _AsyncRPCProxy:
+    def __init__(self, address, codecs=None, connect_timeout=0.1):
+        self.address = address
+        self.codecs = codecs
+        self.connect_timeout = connect_timeout
+        self._connection = None
+        self._codec = PICKLE
+        self._lock = None
+
+    async def do_rpc(self, func_name: str, *args, timeout=None, **kwargs):
+        call = self._do_rpc(func_name, args, kwargs)
+        if timeout is None:
+            return await call
+        try:
+            # a cancelled call closes the connection, a late reply is never read
+            return await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            raise NetworkTimeoutError(f"rpc {func_name} timeout")
+
+    async def _do_rpc(self, func_name, args, kwargs):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # one call at a time on the connection, the server answers in order
+        async with self._lock:
+            if self._connection is None:
+                await self._connect()
+            try:
+                await self._codec.async_send(
+                    self._connection, (func_name, args, kwargs)
+                )
+                result = await self._codec.async_recv(self._connection)
+            except:
+                self.close()
+                raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def do_rpc_stream(self, func_name: str, *args, chunk_size=100, **kwargs):
+        handle = await self.do_rpc(func_name, *args, **kwargs)
+        if not isinstance(handle, StreamHandle):
+            return _aiter(handle)  # not a generator, already whole
+        return self._iter_stream(handle.stream_id, chunk_size)
+
+    async def _iter_stream(self, stream_id, chunk_size):
+        try:
+            while True:
+                _, items, done = await self.do_rpc(
+                    "__stream_next__", stream_id, chunk_size
+                )
+                for item in items:
+                    yield item
+                if isinstance(done, Exception):
+                    raise done
+                if done:
+                    return
+        finally:
+            if self._connection is not None:
+                await self.do_rpc("__stream_close__", stream_id)
+
+    async def _connect(self):
+        self._connection = await open_connection(self.address, self.connect_timeout)
+        self._codec = PICKLE
+        # only what this side can decode
+        offer = [codec.name for codec in usable(self.codecs or ())]
+        if offer:
+            try:
+                await PICKLE.async_send(self._connection, ("__hello__", (offer,), {}))
+                name = await PICKLE.async_recv(self._connection)
+            except:
+                self.close()
+                raise
+            if isinstance(name, MethodNotFound):
+                return  # server without codecs
+            if isinstance(name, Exception):
+                self.close()
+                raise name
+            self._codec = get_codec(name)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = None
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+# {event loop: {hostname: ThreadPoolExecutor}}
+_host_executors = weakref.WeakKeyDictionary()
+
+
+def _host_executor(hostname, limit):
+    executors = _host_executors.setdefault(asyncio.get_running_loop(), {})
+    executor = executors.get(hostname)
+    if executor is None:
+        # threads are started as needed, and end with the loop
+        executor = executors[hostname] = ThreadPoolExecutor(
+            limit, thread_name_prefix=f"ssh-{hostname}"
+        )
+    return executor
+
+
+async def _on_host(hostname, limit, func, *args, **kwargs):
+    """
+    run the blocking ssh operation `func` on the executor of `hostname`, `limit`
+    threads at most, sized by the first caller. the loop's default executor is not
+    used: its cap would bound all the hosts together
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _host_executor(hostname, limit), functools.partial(func, *args, **kwargs)
+    )
+
+
+class AsyncTask:
+    """
+    asyncio version of `Task` with the same semantics, so one event loop can drive
+    a whole fleet of tasks.
+
+    rpc calls(`do_rpc` and `get_pid` of tcp tasks) are native asyncio. ssh operations
+    block(paramiko), each takes a thread of an executor of its host: at most
+    `host_concurrency` run at a time per host for all `AsyncTask`s of the loop, and
+    hosts * `host_concurrency` threads in all. the `async_batch_*` functions take
+    one thread per host, whose commands run on `ssh_pool.max_channels` channels.
+
+    Params:
+        same as `Task`
+        host_concurrency: max concurrent ssh operations per host, default to
+            `ssh_pool.max_channels`
+    """
+
+    def __init__(self, *args, host_concurrency: int = None, **kwargs):
+        self.task = Task(*args, **kwargs)
+        self.host_concurrency = host_concurrency or ssh_pool.max_channels
+        self._client = None
+        if self.task.port > 0:
+            self._client = _AsyncRPCProxy(
+                (self.task.hostname, self.task.port), self.task.codecs
+            )
+
+    @classmethod
+    def from_task(cls, task: Task, host_concurrency: int = None):
+        obj = cls.__new__(cls)
+        obj.task = task
+        obj.host_concurrency = host_concurrency or ssh_pool.max_channels
+        obj._client = None
+        if task.port > 0:
+            obj._client = _AsyncRPCProxy((task.hostname, task.port), task.codecs)
+        return obj
+
+    @classmethod
+    def restore_from_file(cls, dir: str, task_id: int, host_concurrency: int = None):
+        return cls.from_task(Task.restore_from_file(dir, task_id), host_concurrency)
+
+    @property
+    def task_id(self):
+        return self.task.task_id
+
+    @property
+    def hostname(self):
+        return self.task.hostname
+
+    @property
+    def port(self):
+        return self.task.port
+
+    @property
+    def running(self):
+        return self.task.running
+
+    @running.setter
+    def running(self, running):
+        self.task.running = running
+
+    def save(self, dir: str):
+        self.task.save(dir)
+
+    def reset_client(self):
+        if self._client is not None:
+            self._client.close()
+        self.task.reset_client()
+
+    async def _ssh(self, func, *args, **kwargs):
+        return await _on_host(
+            self.task.hostname, self.host_concurrency, func, *args, **kwargs
+        )
+
+    async def run(self, ssh_exec_timeout=60):
+        """
+        see `Task.run`
+        """
+        await self._ssh(self.task.run, ssh_exec_timeout)
+        self.reset_client()
+
+    async def get_pid(self):
+        """
+        see `Task.get_pid`
+        """
+        if not self.task.running:
+            return 0
+        if self._client is not None:
+            try:
+                pid_or_none = await self._client.do_rpc("get_pid")
+                return pid_or_none if pid_or_none else 0
+            except (
+                socket.timeout,
+                asyncio.TimeoutError,
+                NetworkTimeoutError,
+                ConnectionError,
+                EOFError,
+            ):
+                return 0
+        return await self._ssh(self.task.get_pid)
+
+    async def is_alive(self):
+        return await self.get_pid() > 0
+
+    async def wait_alive(self, timeout, interval=0.1):
+        """
+        wait till remote process is alive, checking every `interval` seconds
+
+        raise `TaskStartTimeout` if timeout. timeout must be great than 0
+        """
+        try:
+            await asyncio.wait_for(self._wait_for(True, interval), timeout)
+        except asyncio.TimeoutError:
+            raise TaskStartTimeout("wait task alive timeout")
+
+    async def wait_dead(self, timeout=0, interval=0.1):
+        """
+        wait till remote process is dead, checking every `interval` seconds
+
+        raise `TaskDeadTimeout` if timeout
+
+        if timeout == 0: block wait
+        """
+        try:
+            await asyncio.wait_for(self._wait_for(False, interval), timeout or None)
+        except asyncio.TimeoutError:
+            raise TaskDeadTimeout("wait task dead timeout")
+
+    async def wait_ready(self, timeout=10, state="ready"):
+        """
+        see `Task.wait_ready`
+        """
+        return await self._ssh(self.task.wait_ready, timeout, state)
+
+    async def _wait_for(self, alive, interval):
+        while True:
+            await asyncio.sleep(interval)
+            if await self.is_alive() == alive:
+                return
+
+    async def do_rpc(self, func_name, *args, timeout=None, **kwargs):
+        """
+        see `Task.do_rpc`
+        """
+        if self._client is not None:
+            return await self._client.do_rpc(
+                func_name, *args, timeout=timeout, **kwargs
+            )
+        return None
+
+    async def do_rpc_many(self, calls, parallel=False):
+        """
+        see `Task.do_rpc_many`
+        """
+        if self._client is not None:
+            return await self._client.do_rpc(
+                "__batch__", [_batch_call(c) for c in calls], parallel
+            )
+        return None
+
+    async def do_rpc_stream(self, func_name, *args, chunk_size=100, **kwargs):
+        """
+        see `Task.do_rpc_stream`, return an async iterator pulling one chunk at a time
+
+            async for record in await t.do_rpc_stream("records"):
+                ...
+        """
+        if self._client is not None:
+            return await self._client.do_rpc_stream(
+                func_name, *args, chunk_size=chunk_size, **kwargs
+            )
+        return None
+
+    async def terminate(self, timeout=12):
+        """
+        see `Task.terminate`
+        """
+        self.reset_client()
+        await self._ssh(self.task.terminate, timeout)
+
+    async def log_tail(self, lines=100, log_dir=".", ssh_exec_timeout=10):
+        return await self._ssh(self.task.log_tail, lines, log_dir, ssh_exec_timeout)
+
+    async def host_stats(self, ssh_exec_timeout=10):
+        return await self._ssh(self.task.host_stats, ssh_exec_timeout)
+
+
+async def _per_host(func, tasks, *args):
+    """
+    run the batch function `func` on the tasks of every host concurrently, each on
+    its host's executor. return `[(indexes, result)]`, a host's result is for
+    `tasks[i] for i in indexes`
+    """
+    hosts = defaultdict(list)
+    for i, t in enumerate(tasks):
+        hosts[t.hostname].append(i)
+    results = await asyncio.gather(
+        *(
+            _on_host(
+                hostname,
+                _host_concurrency(tasks[indexes[0]]),
+                func,
+                [_task(tasks[i]) for i in indexes],
+                *args,
+            )
+            for hostname, indexes in hosts.items()
+        )
+    )
+    return list(zip(hosts.values(), results))
+
+
+def _aligned(tasks, per_host):
+    results = [None] * len(tasks)
+    for indexes, host_results in per_host:
+        for i, r in zip(indexes, host_results):
+            results[i] = r
+    return results
+
+
+def _task(t):
+    return t.task if isinstance(t, AsyncTask) else t
+
+
+def _host_concurrency(t):
+    if isinstance(t, AsyncTask):
+        return t.host_concurrency
+    return ssh_pool.max_channels
+
+
+async def async_batch_run(tasks: List[AsyncTask], ssh_exec_timeout=60):
+    """
+    see `batch_run`, the hosts run concurrently
+    """
+    errors = _aligned(tasks, await _per_host(batch_run, tasks, ssh_exec_timeout))
+    for t in tasks:
+        if isinstance(t, AsyncTask):
+            t.reset_client()
+    return errors
+
+
+async def async_batch_get_status(tasks: List[AsyncTask], ssh_exec_timeout=10):
+    """
+    see `batch_get_status`, the hosts are probed concurrently
+    """
+    return _aligned(tasks, await _per_host(batch_get_status, tasks, ssh_exec_timeout))
+
+
+async def async_batch_get_pid(tasks: List[AsyncTask], ssh_exec_timeout=10):
+    """
+    see `batch_get_pid`, the hosts are probed concurrently
+    """
+    return _aligned(tasks, await _per_host(batch_get_pid, tasks, ssh_exec_timeout))
+
+
+async def async_batch_terminate(tasks: List[AsyncTask], ssh_exec_timeout=12):
+    """
+    see `batch_terminate`, the hosts are terminated concurrently
+    """
+    for t in tasks:
+        if isinstance(t, AsyncTask):
+            t.reset_client()
+    await _per_host(batch_terminate, tasks, ssh_exec_timeout)
@@ -0,0 +1,230 @@
+"""
+serialization of rpc requests and replies.
+
+a message is one or more frames of the `multiprocessing.connection` framing. the
+codec of a connection is negotiated by the client's first request
+`("__hello__", (codec names in order of preference,), {})`, sent and answered with
+pickle. servers without codecs answer `MethodNotFound` and both sides keep pickle.
+"""
+
+import io
+import pickle
+import struct
+from multiprocessing.reduction import ForkingPickler
+
+from .exceptions import ParamError
+
+__all__ = [
+    "Codec",
+    "PickleCodec",
+    "Pickle5Codec",
+    "MsgpackCodec",
+    "register_codec",
+    "get_codec",
+    "usable",
+    "negotiate",
+    "frames_size",
+]
+
+
+class Codec:
+    """
+    encode an object to frames and decode it back. subclass and `register_codec`
+    to plug in another serialization
+    """
+
+    name = None
+
+    def encode(self, obj) -> list:
+        """return a list of bytes-like frames"""
+        raise NotImplementedError
+
+    def decode(self, frames: list):
+        raise NotImplementedError
+
+    def extra_frames(self, first) -> int:
+        """number of frames following the `first` one"""
+        return 0
+
+    def send(self, conn, obj) -> int:
+        """return the number of bytes sent"""
+        # encode everything first, an object that cannot be encoded sends nothing
+        frames = self.encode(obj)
+        for frame in frames:
+            conn.send_bytes(frame)
+        return frames_size(frames)
+
+    def recv(self, conn):
+        return self.decode(self.recv_frames(conn))
+
+    def recv_frames(self, conn) -> list:
+        frames = [conn.recv_bytes()]
+        for _ in range(self.extra_frames(frames[0])):
+            frames.append(conn.recv_bytes())
+        return frames
+
+    async def async_send(self, conn, obj) -> int:
+        frames = self.encode(obj)
+        for frame in frames:
+            await conn.send_bytes(frame)
+        return frames_size(frames)
+
+    async def async_recv(self, conn):
+        return self.decode(await self.async_recv_frames(conn))
+
+    async def async_recv_frames(self, conn) -> list:
+        frames = [await conn.recv_bytes()]
+        for _ in range(self.extra_frames(frames[0])):
+            frames.append(await conn.recv_bytes())
+        return frames
+
+
+def frames_size(frames) -> int:
+    return sum(memoryview(frame).nbytes for frame in frames)
+
+
+class PickleCodec(Codec):
+    """
+    one pickled frame, what `Connection.send` and `Connection.recv` do
+    """
+
+    name = "pickle"
+
+    def encode(self, obj):
+        return [ForkingPickler.dumps(obj)]
+
+    def decode(self, frames):
+        return pickle.loads(frames[0])
+
+
+class Pickle5Codec(Codec):
+    """
+    pickle protocol 5 with out-of-band buffers: the memory of `PickleBuffer`s(eg.
+    contiguous numpy arrays) is sent as frames of its own straight from the
+    object, not copied into the pickle. the first frame is the buffer count and
+    the pickle.
+
+    arrays decoded this way share memory with the received frames and are read
+    only, copy them to modify.
+    """
+
+    name = "pickle5"
+
+    def encode(self, obj):
+        buffers = []
+        f = io.BytesIO()
+        f.write(struct.pack("!I", 0))
+        # ForkingPickler takes positional arguments only: file, protocol, fix_imports,
+        # buffer_callback
+        ForkingPickler(f, 5, True, buffers.append).dump(obj)
+        first = f.getbuffer()
+        struct.pack_into("!I", first, 0, len(buffers))
+        return [first] + [b.raw() for b in buffers]
+
+    def extra_frames(self, first):
+        return struct.unpack_from("!I", first)[0]
+
+    def decode(self, frames):
+        return pickle.loads(memoryview(frames[0])[4:], buffers=frames[1:])
+
+
+_EXT_TUPLE = 1
+_EXT_PICKLE = 2
+
+
+class MsgpackCodec(Codec):
+    """
+    msgpack, compact and fast for small control calls. needs `msgpack` installed.
+
+    tuples stay tuples, anything msgpack cannot encode(exceptions, sets, custom
+    classes...) is pickled into an extension type.
+    """
+
+    name = "msgpack"
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def encode(self, obj):
+        return [self._packb(obj)]
+
+    def decode(self, frames):
+        return self._unpackb(frames[0])
+
+    def _packb(self, obj):
+        return self._msgpack.packb(
+            obj, default=self._default, strict_types=True, use_bin_type=True
+        )
+
+    def _unpackb(self, data):
+        return self._msgpack.unpackb(
+            data, ext_hook=self._ext_hook, raw=False, strict_map_key=False
+        )
+
+    def _default(self, obj):
+        if type(obj) is tuple:
+            return self._msgpack.ExtType(_EXT_TUPLE, self._packb(list(obj)))
+        return self._msgpack.ExtType(_EXT_PICKLE, bytes(ForkingPickler.dumps(obj)))
+
+    def _ext_hook(self, code, data):
+        if code == _EXT_TUPLE:
+            return tuple(self._unpackb(data))
+        if code == _EXT_PICKLE:
+            return pickle.loads(data)
+        return self._msgpack.ExtType(code, data)
+
+
+_codec_classes = {}
+_codecs = {}
+
+
+def register_codec(codec_cls):
+    """
+    make `codec_cls` available for negotiation under `codec_cls.name`, on both the
+    client and server side
+    """
+    _codec_classes[codec_cls.name] = codec_cls
+    _codecs.pop(codec_cls.name, None)
+    return codec_cls
+
+
+def get_codec(name) -> Codec:
+    """
+    raise `ParamError` if unknown, `ImportError` if its library is not installed
+    """
+    codec = _codecs.get(name)
+    if codec is None:
+        codec_cls = _codec_classes.get(name)
+        if codec_cls is None:
+            raise ParamError(f"unknown codec {name}")
+        codec = _codecs[name] = codec_cls()
+    return codec
+
+
+def usable(names):
+    """
+    return the codecs of `names` usable in this process
+    """
+    codecs = []
+    for name in names:
+        try:
+            codecs.append(get_codec(name))
+        except (ParamError, ImportError):
+            continue
+    return codecs
+
+
+def negotiate(names):
+    """
+    server side of `__hello__`: return the first codec of `names` usable here
+    """
+    codecs = usable(names)
+    return codecs[0] if codecs else get_codec(PickleCodec.name)
+
+
+for _cls in (PickleCodec, Pickle5Codec, MsgpackCodec):
+    register_codec(_cls)
+
+PICKLE = get_codec(PickleCodec.name)
@@ -1,16 +1,34 @@
 import atexit
 import errno
+import math
 import multiprocessing
 import os
+import queue
 import signal
+import statistics
 import sys
+import time
+import typing
+from collections import deque
 from ctypes import c_bool
 from functools import partial
+from itertools import islice
+from multiprocessing.pool import ExceptionWithTraceback
+from multiprocessing.reduction import ForkingPickler
 from queue import Empty
 
 import filelock
 
 from .exceptions import *
+from .readiness import (
+    EXITING,
+    READY,
+    RPC_LISTENING,
+    STARTING,
+    remove_state,
+    state_file,
+    write_state,
+)
 from .rpcserver import RpcServer, ServerCmd
 
 
@@ -21,11 +39,36 @@ def nodaemon(func):
     return _wrapper
 
 
-def makedaemon(log_dir=".", server_cmd=ServerCmd):
+def _make_server(server, port, server_cmd, workers, worker_type):
+    if server == "asyncio":
+        from .aiorpcserver import AsyncRpcServer
+
+        return AsyncRpcServer(port, server_cmd, workers, worker_type)
+    return RpcServer(port, server_cmd, workers, worker_type)
+
+
+def makedaemon(
+    log_dir=".",
+    server_cmd=ServerCmd,
+    server_workers=0,
+    server_worker_type="thread",
+    server="sync",
+):
     """
     Params:
         log_dir: daemon process write log to
+        server_cmd: `ServerCmd` subclass executing rpc requests, or `RpcHandler`
+            subclass serving them with one long-lived instance
+        server_workers: size of the rpc server's worker pool, 0 to execute requests
+            one by one. see `RpcServer`
+        server_worker_type: "thread" or "process"
+        server:
+            "sync": `RpcServer`
+            "asyncio": `AsyncRpcServer`, awaits `async def` methods of `server_cmd`
     """
+    if server not in ("sync", "asyncio"):
+        raise ParamError("server must be sync or asyncio")
+    server_type = server  # `server` is the server instance in the wrappers
     if sys.platform == "win32":
 
         # Windows下没有SIGINT, SIGTERM底层调用process.terminate()直接杀死进程，
@@ -42,6 +85,8 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
                             raise PidfileExistsError(
                                 f"{pidfile} exists(task may be running), cannot overwrite it. something is wriong."
                             )
+                        # 删除上次运行留下的状态，等待者才不会读到旧状态
+                        remove_state(state_file(pidfile))
 
                     cwd = os.getcwd()
                     stdout_file = os.path.join(log_dir, f"pidfile-{task_id}.log")
@@ -68,15 +113,21 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
                 win32_sighandler = SignalHandler1(f"pidfile-{_task_id}")
                 win32_sighandler.start()
                 server = None
+                statefile = state_file(f"pidfile-{_task_id}")
+                write_state(statefile, STARTING)
 
                 def _release():
                     nonlocal server
+                    nonlocal statefile
+                    if statefile is not None:
+                        write_state(statefile, EXITING)
+                        statefile = None
                     if server is not None:
                         server.stop()
                         server = None
 
                 atexit.register(_release)  # 可以注册多次
-                f = F(win32_sighandler, True)
+                f = F(win32_sighandler, True, statefile)
 
                 # 必须设置信号处理函数，否者会报
                 # `rpcindaemon.daemoniker.exceptions.SIGINT`来结束进程
@@ -92,8 +143,16 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
                 try:
                     if _port:
                         # setup a tcp server
-                        server = RpcServer(_port, server_cmd)
+                        server = _make_server(
+                            server_type,
+                            _port,
+                            server_cmd,
+                            server_workers,
+                            server_worker_type,
+                        )
                         server.start()
+                        write_state(statefile, RPC_LISTENING)
+                        f._server = server
                     func(_task_id, f, *_args, **_kwargs)
                 except:
                     raise
@@ -115,6 +174,9 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
                     raise PidfileExistsError(
                         f"{pidfile} exists(task may be running), cannot overwrite it. something is wriong."
                     )
+                # 删除上次运行留下的状态，等待者才不会读到旧状态
+                statefile = state_file(pidfile)
+                remove_state(statefile)
                 with daemon.DaemonContext(
                     working_directory=cwd, stdout=stdout_file, stderr=stdout_file
                 ):  # fork. parent process has exited.
@@ -122,11 +184,16 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
                     with filelock.FileLock(pidfile_lockfile, blocking=False):
                         with open(pidfile, "w") as f:
                             f.write(str(os.getpid()) + "\n")
+                        write_state(statefile, STARTING)
                         server = None
 
                         def _release():
                             nonlocal server
                             nonlocal pidfile
+                            nonlocal statefile
+                            if statefile is not None:
+                                write_state(statefile, EXITING)
+                                statefile = None
                             try:
                                 os.remove(pidfile)
                             except OSError:
@@ -139,9 +206,17 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
                         try:
                             if port:
                                 # setup a tcp server
-                                server = RpcServer(port, server_cmd)
+                                server = _make_server(
+                                    server_type,
+                                    port,
+                                    server_cmd,
+                                    server_workers,
+                                    server_worker_type,
+                                )
                                 server.start()
-                            func(task_id, F(None, True), *args, **kwargs)
+                                write_state(statefile, RPC_LISTENING)
+                            f = F(None, True, statefile, server)
+                            func(task_id, f, *args, **kwargs)
                         except:
                             raise
                         finally:
@@ -152,88 +227,679 @@ def makedaemon(log_dir=".", server_cmd=ServerCmd):
     return decorate_func
 
 
-def _init_pool_processe(a, b, c):
+# what `worker_init` returned in a child process of `F.run_parallel`
+_worker_context = None
+_worker_init_error = None
+
+
+def worker_context():
+    """
+    return what `worker_init` of `F.run_parallel` returned in this child process,
+    None in other processes
+    """
+    return _worker_context
+
+
+def _init_pool_processe(a, b, c, worker_init=None, worker_init_args=()):
     global lock
     global message_queue
     global signal_stop
+    global _worker_context
+    global _worker_init_error
     lock = a
     message_queue = b
     signal_stop = c
+    if worker_init is not None:
+        try:
+            _worker_context = worker_init(*worker_init_args)
+        except Exception as e:
+            # failed every arg in `_call_chunk`: a pool respawns processes failing
+            # here forever
+            _worker_init_error = e
+
+
+def _check_message_params(message_queue, message_handler):
+    if (message_queue is not None and message_handler is None) or (
+        message_queue is None and message_handler is not None
+    ):
+        raise ParamError(
+            "message_queue and message_handler have to be None or not None at the same time"
+        )
 
 
-class F:
-    __slot__ = ("_win32_sighandler", "_is_daemon")
+def _check_bounds(max_pending, chunksize, max_cpus):
+    if max_pending is None:
+        max_pending = 2 * (max_cpus or os.cpu_count())
+    if max_pending < 1 or (chunksize != "auto" and chunksize < 1):
+        raise ParamError(
+            'max_pending(prefetch) and chunksize must be great than 0, or chunksize="auto"'
+        )
+    return max_pending
 
-    def __init__(self, _win32_sighandler, _is_daemon) -> None:
+
+def _call_chunk(func, chunk, is_daemon):
+    """
+    run in a pool process, return `(True, result)` or `(False, exception)` per arg:
+    an arg raising does not stop the others of its chunk
+    """
+    if _worker_init_error is not None:
+        return [_failed(_worker_init_error)] * len(chunk)
+    results = []
+    for arg in chunk:
+        try:
+            results.append((True, func(arg, is_daemon)))
+        except Exception as e:
+            results.append(_failed(e))
+    return results
+
+
+def _failed(e):
+    # keeps the child's traceback as `__cause__`, as a pool does for a raising task
+    return False, ExceptionWithTraceback(e, e.__traceback__)
+
+
+def _handle_messages(message_queue, message_handler):
+    """
+    handle the messages of child processes till none comes for 0.1s
+    """
+    try:
+        while True:
+            # raise Empty exception when empty
+            msg = message_queue.get(timeout=0.1)
+            # Linux下，当daemon运行时收到SIGINT时，msg会收到None
+            if msg is not None:
+                message_handler(msg)
+            message_queue.task_done()
+    except Empty:
+        pass
+    except IOError as e:
+        # 当在系统调用时，收到sigint，会报该错误，但是实际并不是错误，直接忽略
+        if e.errno != errno.EINTR:
+            raise
+
+
+def _imap_bounded(
+    pool,
+    func,
+    args,
+    is_daemon,
+    signal_stop,
+    ordered,
+    max_pending,
+    chunksize,
+    message_queue,
+    message_handler,
+    raise_errors=True,
+):
+    """
+    yield `(arg, func(arg, is_daemon))` for arg in `args`, with at most `max_pending`
+    chunks submitted to `pool` and not yielded yet. `args` is consumed lazily, no
+    more is submitted once `signal_stop` is set. the exception of an arg is raised,
+    or printed and the arg skipped if not `raise_errors`. the other args of its
+    chunk still run.
+
+    `chunksize` is an int or a `_ChunkTuner`.
+    """
+    tuner = chunksize if isinstance(chunksize, _ChunkTuner) else None
+    args = iter(args)
+    # (chunk, sample, AsyncResult) in submission order, if ordered
+    pending = deque()
+    # (chunk, sample, results, error) as completed, if not
+    done = queue.SimpleQueue()
+    inflight = 0
+    exhausted = False
+    while True:
+        while not exhausted and not signal_stop.value:
+            if tuner is None:
+                if inflight >= max_pending:
+                    break
+                chunk = list(islice(args, chunksize))
+            else:
+                if not tuner.can_submit(inflight, max_pending):
+                    break
+                chunk = list(islice(args, tuner.chunksize))
+            if not chunk:
+                exhausted = True
+                break
+            sample = tuner.submit() if tuner is not None else None
+            call = _call_chunk if sample is None else _call_chunk_sampled
+            if ordered:
+                r = pool.apply_async(
+                    call,
+                    (func, chunk, is_daemon),
+                    callback=None if sample is None else partial(_received, sample),
+                )
+                pending.append((chunk, sample, r))
+            else:
+                pool.apply_async(
+                    call,
+                    (func, chunk, is_daemon),
+                    callback=partial(_put_done, done, chunk, sample, False),
+                    error_callback=partial(_put_done, done, chunk, sample, True),
+                )
+            inflight += 1
+        if not inflight:
+            return
+        if ordered:
+            chunk, sample, r = pending.popleft()
+            while not r.ready():
+                if message_queue is not None:
+                    _handle_messages(message_queue, message_handler)
+                else:
+                    r.wait(0.1)
+            try:
+                results, error = r.get(), False
+            except Exception as e:  # raised by `func`
+                results, error = e, True
+        else:
+            while True:
+                try:
+                    chunk, sample, results, error = done.get(
+                        timeout=0.1 if message_queue is None else 0
+                    )
+                    break
+                except Empty:
+                    if message_queue is not None:
+                        _handle_messages(message_queue, message_handler)
+        inflight -= 1
+        if sample is not None:
+            results = tuner.done(sample, results, error)
+        if error:  # the whole chunk, eg. a result that could not be pickled
+            if raise_errors:
+                raise results
+            print(f"{func.__name__}{tuple(chunk)} failed: {results!r}", flush=True)
+            continue
+        for arg, (ok, result) in zip(chunk, results):
+            if ok:
+                yield arg, result
+            elif raise_errors:
+                raise result
+            else:
+                print(f"{func.__name__}{(arg,)} failed: {result!r}", flush=True)
+
+
+def _put_done(done, chunk, sample, error, results):
+    if sample is not None:
+        _received(sample, results)
+    done.put((chunk, sample, results, error))
+
+
+def _memory():
+    """
+    return `(rss, peak rss)` of this process in bytes, None if unknown(not linux)
+    """
+    try:
+        with open("/proc/self/status") as f:
+            status = dict(line.split(":", 1) for line in f)
+        return (
+            int(status["VmRSS"].split()[0]) * 1024,
+            int(status["VmHWM"].split()[0]) * 1024,
+        )
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _available_memory():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _call_chunk_sampled(func, chunk, is_daemon):
+    # `_call_chunk` measuring itself for chunksize="auto"
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")  # reset the peak rss
+    except OSError:
+        pass
+    rss, _ = _memory()
+    # wall clock, compared with the parent's
+    started = time.time()
+    st = time.perf_counter()
+    results = _call_chunk(func, chunk, is_daemon)
+    elapsed = time.perf_counter() - st
+    _, peak = _memory()
+    nbytes = len(ForkingPickler.dumps(results))
+    growth = peak - rss if rss is not None else 0
+    n = len(chunk)
+    return results, (
+        elapsed / n,
+        nbytes / n,
+        max(0, growth),
+        started,
+        time.time(),
+        os.getpid(),
+    )
+
+
+class _ChunkTuner:
+    """
+    chunksize="auto": the first args are sent one by one and timed, then the
+    chunksize is chosen so that the round trip of a chunk costs ~2% of running it,
+    and the busy processes are limited so that the memory the args take fits in
+    the available memory.
+
+    the round trip is the time from sending an arg, or from the process being
+    done with its previous one, to the process starting it, plus from the process
+    finishing it to the parent receiving the result. the first arg of each process
+    waited for the process to start and run `worker_init`, it is not counted.
+    """
+
+    # round trip / run time of a chunk
+    TARGET_OVERHEAD = 0.02
+    # a longer chunk balances the processes worse and delays stop signals
+    MAX_CHUNK_SECONDS = 1.0
+    MAX_CHUNK_BYTES = 16 << 20
+
+    def __init__(self, processes, total=None):
+        """
+        Params:
+            total: number of args if known, a chunk is at most an equal share of
+                what remains after sampling
+        """
+        self.processes = processes
+        self.total = total
+        self.n_samples = 2 * processes
+        self.sent = 0
+        self.received = 0
+        # (pid, sent, started, finished, received, elapsed, nbytes, growth) per arg
+        self.samples = []
+        self.chunksize = 1
+        self.workers = processes
+        self.tuned = False
+
+    def can_submit(self, inflight, max_pending):
+        if not self.tuned:
+            # one per process so that the round trips are not queued
+            return self.sent < self.n_samples and inflight < self.processes
+        return inflight < (
+            max_pending if self.workers >= self.processes else self.workers
+        )
+
+    def submit(self):
+        """return the sample of the next chunk, None if not sampled"""
+        if self.tuned:
+            return None
+        self.sent += 1
+        return _Sample()
+
+    def done(self, sample, results, error):
+        """return the results of a sampled chunk"""
+        self.received += 1
+        if not error:
+            results, (elapsed, nbytes, growth, started, finished, pid) = results
+            self.samples.append(
+                (
+                    pid,
+                    sample.sent,
+                    started,
+                    finished,
+                    sample.received,
+                    elapsed,
+                    nbytes,
+                    growth,
+                )
+            )
+        if self.received == self.n_samples:
+            self._tune()
+        return results
+
+    def _round_trips(self):
+        by_pid = {}
+        for sample in sorted(self.samples, key=lambda s: s[2]):
+            by_pid.setdefault(sample[0], []).append(sample)
+        for samples in by_pid.values():
+            # the first one waited for the process to start
+            for prev, (_, sent, started, finished, received, *_) in zip(
+                samples, samples[1:]
+            ):
+                yield max(0.0, started - max(sent, prev[3])) + max(
+                    0.0, received - finished
+                )
+
+    def _tune(self):
+        self.tuned = True
+        overheads = list(self._round_trips())
+        if not overheads:
+            # no process ran two samples, eg. they failed to send their results
+            print(
+                f"run_parallel chunksize=auto: chunksize={self.chunksize}, "
+                f"workers={self.workers}/{self.processes} (no round trip measured)",
+                flush=True,
+            )
+            return
+        overhead = statistics.median(overheads)
+        elapsed, nbytes = (
+            statistics.median(s[i] for s in self.samples) for i in (5, 6)
+        )
+        growth = max(s[7] for s in self.samples)
+        elapsed = max(elapsed, 1e-7)
+        available = _available_memory()
+        if available is not None and growth > 0:
+            # each busy process holds what its current arg takes
+            self.workers = max(1, min(self.processes, int(0.8 * available / growth)))
+        limits = [
+            math.ceil(overhead / self.TARGET_OVERHEAD / elapsed),
+            int(self.MAX_CHUNK_SECONDS / elapsed),
+            int(self.MAX_CHUNK_BYTES / max(nbytes, 1)),
+        ]
+        if self.total is not None:
+            # every process gets a share of what remains
+            limits.append(math.ceil((self.total - self.sent) / self.workers))
+        self.chunksize = max(1, min(limits))
+        print(
+            f"run_parallel chunksize=auto: chunksize={self.chunksize}, "
+            f"workers={self.workers}/{self.processes} (per arg: {elapsed * 1e3:.3f}ms, "
+            f"result {nbytes:.0f}B, memory {growth}B; round trip {overhead * 1e3:.3f}ms)",
+            flush=True,
+        )
+
+
+class _Sample:
+    __slots__ = ("sent", "received")
+
+    def __init__(self):
+        # wall clock, compared with the child's
+        self.sent = time.time()
+        self.received = None
+
+
+def _received(sample, _):
+    sample.received = time.time()
+
+
+class F:
+    __slot__ = (
+        "_win32_sighandler",
+        "_is_daemon",
+        "_state_file",
+        "_server",
+        "_signal_stop",
+        "_pool",
+        "_pool_args",
+    )
+
+    def __init__(
+        self, _win32_sighandler, _is_daemon, _state_file=None, _server=None
+    ) -> None:
         self._win32_sighandler = _win32_sighandler
         self._is_daemon = _is_daemon
+        self._state_file = _state_file
+        self._server = _server
+        self._signal_stop = None
+        self._pool = None
+        self._pool_args = None
+
+    @property
+    def stopping(self):
+        """
+        a stop signal was received by the parallel processes' signal handlers(see
+        `run_parallel`), check it between calls to return
+        """
+        return self._signal_stop is not None and self._signal_stop.value
+
+    def publish(self, topic: str, payload):
+        """
+        push `payload` to the rpc clients subscribed to `topic`(see `Task.subscribe`).
+        cheap and never blocks on slow clients, their pending events are conflated.
+        does nothing if the task has no rpc server.
+        """
+        if self._server is not None:
+            self._server.publish(topic, payload)
+
+    def notify_ready(self):
+        """
+        tell the controller that the task finished initialising, `Task.wait_ready`
+        returns once this is called. does nothing if not running in daemon.
+        """
+        if self._state_file is not None:
+            write_state(self._state_file, READY)
 
     def run_parallel(
         self,
         func,
-        args: list,
+        args: typing.Iterable,
         max_cpus: int = None,
         lock=None,
         message_queue=None,
         message_handler=None,
+        prefetch: int = None,
+        chunksize: typing.Union[int, str] = 1,
+        worker_init=None,
+        worker_init_args: tuple = None,
     ):
         """
         Params:
             func: function that run in multiple processes.
                 eg. `func(arg, is_daemon): pass`
-            args: run subprocess `func(arg, is_daemon) for arg in args`.
+            args: run subprocess `func(arg, is_daemon) for arg in args`. any iterable,
+                eg. a generator reading a big file: it is consumed lazily and the
+                first args start running at once.
             max_cpus: max cpu cores to use or all the cores if None.
             locker: `multiprocessing.Lock()` using semaphore that can be shared among processes.
                 if you need to access a same file or other resources by multiple processes.
             message_queue: `multiprocessing.JoinableQueue()` using Pipe to communicate.
             message_handler: handler msg send from child process, and handle it in parent process.
                 `message_queue` and `message_handler` have to be both None or not None.
+            prefetch: max chunks of args taken ahead of the child processes, default
+                to twice the number of processes. memory stays flat however many
+                args there are.
+            chunksize: args sent to a child process at a time, or "auto": time the
+                first args one by one, then pick the chunksize keeping the round
+                trip of a chunk small against its run time, and the busy processes
+                fitting in the available memory. the choice is printed to the
+                daemon log.
+            worker_init: `worker_init(*worker_init_args)` runs once in every child
+                process before its first arg, eg. to load a model. what it returns
+                is `rpcindaemon.worker_context()` in that process. if it
+                raises, every arg of the process raises the same exception.
+            worker_init_args: tuple, must be picklable
+
+        the return values of `func` are dropped, see `map_parallel`. an exception of
+        `func` is printed and the other args still run.
+
+        the processes are started and stopped by every call, unless `start_pool`
+        was called.
+        """
+        pool_args = self._pool_args_for(
+            max_cpus, lock, message_queue, worker_init, worker_init_args
+        )
+        _check_message_params(pool_args[2], message_handler)
+        prefetch = _check_bounds(prefetch, chunksize, pool_args[0])
+        results = self._map_parallel(
+            func,
+            args,
+            pool_args,
+            False,
+            prefetch,
+            chunksize,
+            message_handler,
+            raise_errors=False,
+        )
+        try:
+            for _ in results:
+                pass
+        except EOFError:  # 当手动Kill子进程会导致该异常
+            pass
+
+    def map_parallel(
+        self,
+        func,
+        args,
+        max_cpus: int = None,
+        ordered: bool = True,
+        max_pending: int = None,
+        chunksize: typing.Union[int, str] = 1,
+        lock=None,
+        message_queue=None,
+        message_handler=None,
+        worker_init=None,
+        worker_init_args: tuple = None,
+    ):
+        """
+        like `run_parallel`, but return an iterator of `(arg, func(arg, is_daemon))`
+        yielded as the child processes finish them. an exception of `func` is raised
+        by the iterator.
 
+            for arg, result in f.map_parallel(func, args, ordered=False):
+                ...
+
+        Params:
+            args: any iterable, consumed lazily
+            ordered: yield in the order of `args`, or as soon as a result is ready
+            max_pending: max chunks submitted and not yielded yet, default to twice
+                the number of processes. bounds the results held in memory.
+            chunksize: args sent to a child process at a time, or "auto"
+            others: see `run_parallel`
         """
-        if (message_queue is not None and message_handler is None) or (
-            message_queue is None and message_handler is not None
-        ):
-            raise ParamError(
-                "message_queue and message_handler have to be None or not None at the same time"
-            )
+        pool_args = self._pool_args_for(
+            max_cpus, lock, message_queue, worker_init, worker_init_args
+        )
+        _check_message_params(pool_args[2], message_handler)
+        max_pending = _check_bounds(max_pending, chunksize, pool_args[0])
+        return self._map_parallel(
+            func, args, pool_args, ordered, max_pending, chunksize, message_handler
+        )
+
+    def _map_parallel(
+        self,
+        func,
+        args,
+        pool_args,
+        ordered,
+        max_pending,
+        chunksize,
+        message_handler,
+        raise_errors=True,
+    ):
+        message_queue = pool_args[2]
+        if chunksize == "auto":
+            total = len(args) if hasattr(args, "__len__") else None
+            chunksize = _ChunkTuner(pool_args[0] or os.cpu_count(), total)
+        own_pool = self._pool is None
+        pool = self._new_pool(*pool_args) if own_pool else self._pool
+        results = _imap_bounded(
+            pool,
+            func,
+            args,
+            self._is_daemon,
+            self._signal_stop,
+            ordered,
+            max_pending,
+            chunksize,
+            message_queue,
+            message_handler,
+            raise_errors,
+        )
+        if own_pool:
+            # leaving early(break, exception) terminates the pool
+            with pool:
+                yield from results
+                pool.close()
+                pool.join()
+        else:
+            yield from results
+        if message_queue is not None:
+            # sent by the children after their last result
+            _handle_messages(message_queue, message_handler)
+
+    def start_pool(
+        self,
+        max_cpus: int = None,
+        lock=None,
+        message_queue=None,
+        worker_init=None,
+        worker_init_args: tuple = None,
+    ):
+        """
+        keep a pool of processes for the daemon's lifetime: `run_parallel` and
+        `map_parallel` run on it instead of starting processes on every call, so
+        the workers start, import and run `worker_init` once. the pool is closed at
+        exit, or by `close_pool`.
+
+        calling it again resizes the pool(its processes are restarted), do it
+        between calls. the calls must pass `max_cpus`, `lock`, `message_queue` and
+        `worker_init` None or the same as here.
+
+        Params:
+            see `run_parallel`
+        """
+        args = (
+            max_cpus or os.cpu_count(),
+            lock,
+            message_queue,
+            worker_init,
+            worker_init_args,
+        )
+        if self._pool is not None:
+            if all(a is b or a == b for a, b in zip(args, self._pool_args)):
+                return
+            self.close_pool()
+        else:
+            atexit.register(self.close_pool)
+        self._pool = self._new_pool(*args)
+        self._pool_args = args
+
+    def resize_pool(self, max_cpus: int):
+        """
+        see `start_pool`
+        """
+        if self._pool is None:
+            raise ParamError("start_pool first")
+        self.start_pool(max_cpus, *self._pool_args[1:])
+
+    def close_pool(self):
+        """
+        wait for the running args and stop the processes of `start_pool`, they are
+        killed if a stop signal was received
+        """
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        if self.stopping:
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
+
+    def _pool_args_for(self, *args):
+        if self._pool is None:
+            return args
+        for given, own in zip(args, self._pool_args):
+            if given is not None and given is not own and given != own:
+                raise ParamError(
+                    "max_cpus, lock, message_queue and worker_init must be None or "
+                    "the ones of start_pool"
+                )
+        return self._pool_args
+
+    def _new_pool(self, max_cpus, lock, message_queue, worker_init, worker_init_args):
         if sys.platform == "win32":
             # 在Linux下用spawn会卡死
             multiprocessing.set_start_method("spawn", force=True)
-        # RawValue 底层使用共享内存，控制子进程退出
-        signal_stop = multiprocessing.RawValue(c_bool, False)
-        self._set_sighandler_multi_process(signal_stop)
+        if self._signal_stop is None:
+            # RawValue 底层使用共享内存，控制子进程退出
+            # one for all the pools: the signal handlers are only installed once
+            self._signal_stop = multiprocessing.RawValue(c_bool, False)
+        self._set_sighandler_multi_process(self._signal_stop)
         # lock message_queue signal_stop 可以传入Process，但是不能通过pool.map 参数传入
         # _init_pool_processe 和三个参数一起传入Process，并在子进程中执行_init_pool_processes函数
-        with multiprocessing.Pool(
-            max_cpus, _init_pool_processe, (lock, message_queue, signal_stop)
-        ) as pool:
-            mapresult = pool.starmap_async(
-                func, [(arg, self._is_daemon) for arg in args]
-            )
-            while not mapresult.ready():
-                try:
-                    if message_queue is not None:
-                        while True:
-                            # raise Empty exception when empty
-                            msg = message_queue.get(timeout=0.1)
-                            # Linux下，当daemon运行时收到SIGINT时，msg会收到None
-                            if msg is not None:
-                                message_handler(msg)
-                            message_queue.task_done()
-                    else:
-                        mapresult.wait(0.1)
-                except Empty:
-                    pass
-                except EOFError:  # 当手动Kill子进程会导致该异常
-                    break
-                except IOError as e:
-                    # 当在系统调用时，收到sigint，会报该错误，但是实际并不是错误，直接忽略
-                    if e.errno == errno.EINTR:
-                        pass
-                    else:
-                        raise
-            pool.close()
-            pool.join()
+        return multiprocessing.Pool(
+            max_cpus,
+            _init_pool_processe,
+            (
+                lock,
+                message_queue,
+                self._signal_stop,
+                worker_init,
+                worker_init_args or (),
+            ),
+        )
 
     def set_sighandler_single_process(self, handler):
         """
@@ -1,20 +1,30 @@
+"""
+remote side of the control operations, run as `python -m rpcindaemon.entry CMD`.
+
+this runs thousands of times a day and most of its wall time used to be imports,
+so heavy modules(fire, psutil) are imported where they are needed and the hot
+commands are parsed without fire. see `benchmarks/bench_entry_startup.py`.
+"""
+
+import json
+import os
 import signal
 import sys
 from typing import List
 
-import fire
-import psutil
-
 from .exceptions import ParamError
 
 
-def terminate_proc(pids: List[int] = [], task_ids: List[int] = []):
+def terminate_proc(
+    pids: List[int] = [], task_ids: List[int] = [], working_dir: str = ""
+):
     """
     terminate processes by pids or task-ids
 
     params:
         pids: list of process ids to terminate, using on Linux.
         task_ids: list of task ids to terminate task, using on Windows.
+        working_dir: where the pidfiles of `task_ids` are, using on Windows.
     """
     if sys.platform == "win32":
         if not task_ids:
@@ -25,12 +35,14 @@ def terminate_proc(pids: List[int] = [], task_ids: List[int] = []):
 
         for tid in task_ids:
             # Send a SIGINT to a process denoted by a PID file
-            send(f"pidfile-{tid}", SIGINT)
+            send(os.path.join(working_dir, f"pidfile-{tid}"), SIGINT)
     else:
         if not pids:
             raise ParamError(
                 "terminate_proc on linux need --task-ids=[pid,...] options"
             )
+        import psutil
+
         wait_procs = []
         for pid in pids:
             p = psutil.Process(pid)
@@ -47,7 +59,7 @@ def get_pid(task_id: int):
     try:
         with open(f"pidfile-{task_id}", "r") as f:
             pid = int(f.read().strip())
-        if psutil.pid_exists(pid):
+        if _pid_exists(pid):
             print(pid)
         else:
             print(0)
@@ -55,10 +67,182 @@ def get_pid(task_id: int):
         print(0)
 
 
+def get_pids(task_ids: List[int]):
+    """
+    print status of many tasks as one json line `{task_id: [pid, alive, mtime]}`
+
+    pid is read from pidfile, alive is True if the pid exists and mtime is the
+    modification time of the pidfile. `[0, false, null]` if there is no pidfile.
+    """
+    print(json.dumps(pid_status(task_ids), separators=(",", ":")))
+
+
+def pid_status(task_ids: List[int], working_dir: str = ""):
+    status = {}
+    for tid in task_ids:
+        pidfile = os.path.join(working_dir, f"pidfile-{tid}")
+        try:
+            mtime = os.path.getmtime(pidfile)
+            with open(pidfile, "r") as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            status[tid] = (0, False, None)
+        else:
+            status[tid] = (pid, _pid_exists(pid), mtime)
+    return status
+
+
+def _pid_exists(pid):
+    if pid <= 0:
+        return False
+    if os.name != "posix":
+        import psutil
+
+        return psutil.pid_exists(pid)
+    # same as `psutil.pid_exists` on posix, without importing psutil
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def log_tail(task_id: int, lines: int = 100, log_dir: str = "."):
+    """print the last lines of the task's log"""
+    print(read_log_tail(task_id, lines, log_dir), end="")
+
+
+def read_log_tail(task_id, lines=100, log_dir="."):
+    try:
+        with open(os.path.join(log_dir, f"pidfile-{task_id}.log"), "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            # read backward block by block until enough lines
+            pos = end
+            data = b""
+            while pos > 0 and data.count(b"\n") <= lines:
+                step = min(8192, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+    except OSError:
+        return ""
+    return "".join(data.decode(errors="replace").splitlines(keepends=True)[-lines:])
+
+
+def host_stats():
+    """print cpu, memory, disk and load of this host as one json line"""
+    print(json.dumps(get_host_stats(), separators=(",", ":")))
+
+
+def get_host_stats():
+    import psutil
+
+    mem = psutil.virtual_memory()
+    disk = psutil.disk_usage(os.path.abspath(os.sep))
+    try:
+        load = os.getloadavg()
+    except (AttributeError, OSError):  # windows
+        load = None
+    return {
+        "cpu_count": psutil.cpu_count(),
+        "cpu_percent": psutil.cpu_percent(interval=0.1),
+        "loadavg": load,
+        "mem_total": mem.total,
+        "mem_available": mem.available,
+        "disk_total": disk.total,
+        "disk_free": disk.free,
+        "boot_time": psutil.boot_time(),
+        "process_count": len(psutil.pids()),
+    }
+
+
+def wait_state(task_id: int, state: str = "ready", timeout: float = 10):
+    """
+    wait till the task reaches `state`(starting, rpc-listening, ready, exiting) and
+    print its readiness record as one json line, see `rpcindaemon.readiness`
+    """
+    from .readiness import state_file
+    from .readiness import wait_state as _wait_state
+
+    record = _wait_state(state_file(f"pidfile-{task_id}"), state, timeout)
+    print(json.dumps(record, separators=(",", ":")))
+
+
+def agent(port: int, host: str = "127.0.0.1"):
+    """
+    run the per-host agent in background if not running, serving control
+    operations over rpc on `host:port`, and print its secret. see `rpcindaemon.agent`
+    """
+    from .agent import run_agent
+
+    run_agent(port, host)
+
+
+def _int_list(s):
+    """parse fire style list `[1,2]` or `1,2` or `1`"""
+    s = s.strip()
+    if s.startswith("[") and s.endswith("]"):
+        s = s[1:-1]
+    return [int(i) for i in s.split(",") if i.strip()]
+
+
+_terminate_options = {
+    "-p": "pids",
+    "--pids": "pids",
+    "-t": "task_ids",
+    "--task_ids": "task_ids",
+    "--task-ids": "task_ids",
+    "-w": "working_dir",
+    "--working_dir": "working_dir",
+    "--working-dir": "working_dir",
+}
+
+
+def _fast_main(argv):
+    """
+    run the hot commands without importing fire, which costs more than the
+    commands themselves. return False if `argv` is not understood here.
+    """
+    if not argv:
+        return False
+    cmd, args = argv[0].replace("-", "_"), argv[1:]
+    # only parsing may fall back to fire, a failing command must not run twice
+    try:
+        if cmd == "get_pid" and len(args) == 1:
+            func, kwargs = get_pid, {"task_id": int(args[0])}
+        elif cmd == "get_pids" and len(args) == 1:
+            func, kwargs = get_pids, {"task_ids": _int_list(args[0])}
+        elif cmd == "terminate_proc":
+            func, kwargs = terminate_proc, {}
+            while args:
+                option, _, value = args.pop(0).partition("=")
+                if not value:
+                    value = args.pop(0)
+                name = _terminate_options[option]
+                kwargs[name] = value if name == "working_dir" else _int_list(value)
+        else:
+            return False
+    except (ValueError, KeyError, IndexError):
+        return False
+    func(**kwargs)
+    return True
+
+
 if __name__ == "__main__":
-    fire.Fire(
-        {
-            "terminate_proc": terminate_proc,
-            "get_pid": get_pid,
-        }
-    )
+    if not _fast_main(sys.argv[1:]):
+        import fire
+
+        fire.Fire(
+            {
+                "terminate_proc": terminate_proc,
+                "get_pid": get_pid,
+                "get_pids": get_pids,
+                "log_tail": log_tail,
+                "host_stats": host_stats,
+                "wait_state": wait_state,
+                "agent": agent,
+            }
+        )
@@ -32,3 +32,7 @@ class TaskStartTimeout(RPCInDaemonError):
 
 class TaskDeadTimeout(RPCInDaemonError):
     pass
+
+
+class TaskExitedError(RPCInDaemonError):
+    pass
@@ -0,0 +1,156 @@
+"""
+publish/subscribe between a daemon task and its rpc clients.
+
+the task function publishes with `F.publish(topic, payload)`, clients subscribe
+with `Task.subscribe` and the rpc server pushes `(None, [(topic, payload), ...])`
+frames on their connections. pending events are conflated: a subscriber holds
+at most the last payload of each topic, and at most `max_pending` topics, so a
+slow consumer costs bounded memory. the last payloads sent to new subscribers are
+kept for the `max_topics` most recently published topics.
+"""
+
+import threading
+from collections import OrderedDict
+
+__all__ = ["Broker", "EventBuffer"]
+
+ALL_TOPICS = "*"
+
+
+class EventBuffer:
+    """
+    the last payload of each topic, oldest topic first
+    """
+
+    __slots__ = ("max_pending", "pending", "conflated", "dropped")
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.conflated = 0
+        self.dropped = 0
+
+    def put(self, topic, payload):
+        if topic in self.pending:
+            self.conflated += 1
+            self.pending.move_to_end(topic)
+        elif len(self.pending) >= self.max_pending:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[topic] = payload
+
+    def pop(self):
+        """return the oldest (topic, payload)"""
+        return self.pending.popitem(last=False)
+
+    def take(self):
+        events = list(self.pending.items())
+        self.pending.clear()
+        return events
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class _Subscriber:
+    __slots__ = ("topics", "buffer")
+
+    def __init__(self, max_pending):
+        self.topics = set()
+        self.buffer = EventBuffer(max_pending)
+
+
+class Broker:
+    """
+    thread safe. subscribers are identified by any hashable key, eg. their
+    connection. `on_pending(key)` is called when a subscriber's buffer turns
+    non-empty, without the broker's lock held.
+
+    Params:
+        max_pending: max topics buffered per subscriber, the oldest is dropped
+        max_topics: max topics whose last payload is kept for new subscribers, the
+            least recently published is dropped
+    """
+
+    def __init__(self, on_pending, max_pending=1000, max_topics=10000):
+        self.on_pending = on_pending
+        self.max_pending = max_pending
+        self.max_topics = max_topics
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        # last payload of recently published topics, sent to new subscribers
+        self._last = OrderedDict()
+        self.published = 0
+
+    def subscribe(self, key, topics):
+        """
+        subscribe `key` to `topics`("*" for all), the last payload of each topic
+        published so far is pushed at once
+        """
+        with self._lock:
+            sub = self._subscribers.get(key)
+            if sub is None:
+                sub = self._subscribers[key] = _Subscriber(self.max_pending)
+            was_empty = not sub.buffer
+            sub.topics.update(topics)
+            for topic, payload in self._last.items():
+                if topic in topics or ALL_TOPICS in topics:
+                    sub.buffer.put(topic, payload)
+            notify = was_empty and sub.buffer
+        if notify:
+            self.on_pending(key)
+
+    def unsubscribe(self, key, topics=None):
+        """
+        unsubscribe `key` from `topics`, or from all topics if None
+        """
+        with self._lock:
+            sub = self._subscribers.get(key)
+            if sub is None:
+                return
+            if topics is None:
+                del self._subscribers[key]
+            else:
+                sub.topics.difference_update(topics)
+
+    def publish(self, topic, payload):
+        notify = []
+        with self._lock:
+            self.published += 1
+            if topic in self._last:
+                self._last.move_to_end(topic)
+            elif len(self._last) >= self.max_topics:
+                self._last.popitem(last=False)
+            self._last[topic] = payload
+            for key, sub in self._subscribers.items():
+                if topic in sub.topics or ALL_TOPICS in sub.topics:
+                    if not sub.buffer:
+                        notify.append(key)
+                    sub.buffer.put(topic, payload)
+        for key in notify:
+            self.on_pending(key)
+
+    def take(self, key):
+        """
+        return and clear the pending `[(topic, payload)]` of `key`
+        """
+        with self._lock:
+            sub = self._subscribers.get(key)
+            return sub.buffer.take() if sub is not None else []
+
+    def pending_keys(self):
+        with self._lock:
+            return [key for key, sub in self._subscribers.items() if sub.buffer]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "published": self.published,
+                "topics": len(self._last),
+                "subscribers": len(self._subscribers),
+                "pending": sum(len(s.buffer) for s in self._subscribers.values()),
+                "conflated": sum(
+                    s.buffer.conflated for s in self._subscribers.values()
+                ),
+                "dropped": sum(s.buffer.dropped for s in self._subscribers.values()),
+            }
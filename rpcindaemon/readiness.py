@@ -0,0 +1,86 @@
+"""
+readiness state of a daemon task, like sd_notify.
+
+`makedaemon` writes the state of task to `pidfile-{task_id}.state` as it goes
+through `STATES`, the task function reports it finished initialising with
+`F.notify_ready()`. `wait_state` blocks on the remote host until a state is
+reached, so the controller pays one remote call instead of polling `get_pid`.
+"""
+
+import json
+import os
+import time
+
+__all__ = ["STATES", "state_file", "write_state", "read_state", "wait_state"]
+
+STARTING = "starting"
+RPC_LISTENING = "rpc-listening"
+READY = "ready"
+EXITING = "exiting"
+
+STATES = (STARTING, RPC_LISTENING, READY, EXITING)
+
+
+def state_file(pidfile):
+    return f"{pidfile}.state"
+
+
+def write_state(path, state):
+    """
+    record `state` with the time it is reached, replacing the file atomically so a
+    reader never sees it half written
+    """
+    record = read_state(path)
+    if record is None or record["pid"] != os.getpid():
+        record = {"pid": os.getpid(), "state": state, "times": {}}
+    record["state"] = state
+    record["times"][state] = time.time()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp, path)
+
+
+def read_state(path):
+    """
+    return `{"pid": pid, "state": state, "times": {state: timestamp}}` or None
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_state(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def wait_state(path, state=READY, timeout=10, interval=0.02):
+    """
+    wait till the task reaches `state`(or a later one) and return its record.
+
+    return early if the task is exiting or its process is gone(state is then
+    `exiting`), and with the current record(None if the task has not started)
+    after `timeout` seconds.
+    """
+    from .entry import _pid_exists
+
+    wanted = STATES.index(state)
+    deadline = time.monotonic() + timeout
+    while True:
+        record = read_state(path)
+        if record is not None:
+            if STATES.index(record["state"]) >= wanted:
+                return record
+            if not _pid_exists(record["pid"]):
+                # killed before it could record `exiting`
+                record["state"] = EXITING
+                return record
+        if time.monotonic() > deadline:
+            return record
+        # a local file check, cheap compared to a remote round trip per poll
+        time.sleep(interval)
@@ -1,13 +1,26 @@
 import datetime
+import inspect
 import os
+import selectors
 import socket
 import threading
+import time
 import typing
-from multiprocessing.connection import Client, Listener, wait
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
 
-from .exceptions import MethodNotFound
+from .codec import PICKLE, frames_size, negotiate
+from .exceptions import MethodNotFound, ParamError
+from .pubsub import Broker
+from .stats import ServerStats
 
-__all__ = ["RpcServer"]
+__all__ = ["RpcServer", "RpcHandler", "rpc_method", "StreamHandle"]
+
+# seconds a stream may stay unpulled before it is closed
+STREAM_IDLE_TIMEOUT = 300
 
 
 class ServerCmd:
@@ -29,71 +42,795 @@ class ServerCmd:
         return os.getpid()
 
 
+def rpc_method(func=None, *, name=None):
+    """
+    expose a method of a `RpcHandler` as the rpc `name`, default to its own name
+
+        class Handler(rpcindaemon.RpcHandler):
+            @rpcindaemon.rpc_method
+            def add(self, a, b):
+                return a + b
+    """
+
+    def decorate(func):
+        func._rpc_name = name or func.__name__
+        return func
+
+    return decorate if func is None else decorate(func)
+
+
+def _collect_rpc_methods(cls):
+    # {rpc name: attribute name}, subclasses override the methods of their bases
+    methods = {}
+    for klass in reversed(cls.__mro__):
+        for attr, value in vars(klass).items():
+            rpc_name = getattr(value, "_rpc_name", None)
+            if rpc_name is not None:
+                methods[rpc_name] = attr
+    return methods
+
+
+class RpcHandler:
+    """
+    the alternative to `ServerCmd`: one instance is created by the server at
+    `start()` and serves every request, so it can keep state(caches, db
+    connections...). only methods decorated with `rpc_method` are exposed, resolved
+    with a table built once, not with `getattr` per request.
+
+    with `workers > 0` the instance is shared by concurrent requests, protect its
+    state. with worker_type="process" every worker process has its own instance.
+    """
+
+    _rpc_methods = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._rpc_methods = _collect_rpc_methods(cls)
+
+    @rpc_method
+    def get_pid(self):
+        return os.getpid()
+
+    @rpc_method
+    def list_methods(self):
+        """names of the exposed methods"""
+        return sorted(self._rpc_methods)
+
+    def close(self):
+        """called once when the server stops, not exposed"""
+
+
+RpcHandler._rpc_methods = _collect_rpc_methods(RpcHandler)
+
+
+class _Dispatcher:
+    """
+    executes requests with a `ServerCmd` per request, or with the persistent
+    instance and dispatch table of a `RpcHandler`
+    """
+
+    __slots__ = ("cmd_cls", "handler", "table")
+
+    def __init__(self, cmd_cls):
+        self.cmd_cls = cmd_cls
+        self.handler = None
+        self.table = None
+        if issubclass(cmd_cls, RpcHandler):
+            self.handler = cmd_cls()
+            self.table = {
+                name: getattr(self.handler, attr)
+                for name, attr in cmd_cls._rpc_methods.items()
+            }
+
+    def method(self, func_name):
+        if self.table is None:
+            return getattr(self.cmd_cls, func_name, None)
+        return self.table.get(func_name)
+
+    def execute(self, func_name, args, kwargs):
+        if self.table is None:
+            return self.cmd_cls(func_name, args, kwargs).execute()
+        method = self.table.get(func_name)
+        if method is None:
+            raise MethodNotFound(f"method {func_name} not found.")
+        return method(*args, **kwargs)
+
+    def close(self):
+        if self.handler is not None:
+            self.handler.close()
+
+
+# dispatcher of each `cmd_cls` in a worker process, created on its first request
+_process_dispatchers = {}
+
+
+def _execute_in_process(cmd_cls, func_name, args, kwargs):
+    # run in a worker process of `RpcServer(worker_type="process")`
+    st = time.perf_counter()
+    try:
+        dispatcher = _process_dispatchers.get(cmd_cls)
+        if dispatcher is None:
+            dispatcher = _process_dispatchers[cmd_cls] = _Dispatcher(cmd_cls)
+        r = dispatcher.execute(func_name, args, kwargs)
+        if inspect.isgenerator(r) or inspect.isasyncgen(r):
+            # generator functions are run by the server process, see `_is_local`
+            if inspect.isgenerator(r):
+                r.close()
+            raise ParamError(
+                f"{func_name} returned a generator, it cannot leave a worker process."
+                " make it a generator function to stream it"
+            )
+    except Exception as e:
+        r = e
+    return r, time.perf_counter() - st
+
+
+class StreamHandle:
+    """
+    returned instead of the generator of a generator method. the client pulls its
+    items with `__stream_next__`, see `Task.do_rpc_stream`
+    """
+
+    __slots__ = ("stream_id",)
+
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+
+    def __repr__(self):
+        return f"StreamHandle({self.stream_id})"
+
+
+class _Stream:
+    __slots__ = ("gen", "lock", "next_index", "last_used")
+
+    def __init__(self, gen, lock):
+        self.gen = gen  # None once exhausted
+        self.lock = lock
+        self.next_index = 0
+        self.last_used = time.monotonic()
+
+
+class _Streams:
+    """
+    generators of the streams being pulled, by stream id
+    """
+
+    def __init__(self, lock_cls):
+        self._lock_cls = lock_cls
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._last_id = 0
+
+    def open(self, gen):
+        self.expire()
+        with self._lock:
+            self._last_id += 1
+            self._streams[self._last_id] = _Stream(gen, self._lock_cls())
+            return StreamHandle(self._last_id)
+
+    def get(self, stream_id):
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None:
+            raise ParamError(f"stream {stream_id} not found(closed or expired)")
+        stream.last_used = time.monotonic()
+        return stream
+
+    def pop(self, stream_id):
+        with self._lock:
+            return self._streams.pop(stream_id, None)
+
+    def pop_all(self):
+        with self._lock:
+            streams = list(self._streams.values())
+            self._streams.clear()
+        return streams
+
+    def expire(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                stream_id
+                for stream_id, stream in self._streams.items()
+                if now - stream.last_used > STREAM_IDLE_TIMEOUT
+            ]
+            streams = [self._streams.pop(stream_id) for stream_id in idle]
+        for stream in streams:
+            if inspect.isgenerator(stream.gen):
+                stream.gen.close()
+
+
+def _pull(gen, n):
+    """
+    return up to `n` items of `gen` and True if exhausted, the exception if raised
+    """
+    items = []
+    try:
+        for _ in range(n):
+            items.append(next(gen))
+    except StopIteration:
+        return items, True
+    except Exception as e:
+        return items, e
+    return items, False
+
+
+# seconds for a client to authenticate
+_AUTH_TIMEOUT = 5
+
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:  # closed or detached meanwhile
+        pass
+
+
+# `select()`, the selector of windows, takes at most 512 sockets: the listening and
+# wakeup sockets, and the connections
+_SELECT_MAX_SOCKETS = 512
+
+
+def _listen(address):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if os.name == "posix":
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        s.bind(address)
+        s.listen(socket.SOMAXCONN)
+    except:
+        s.close()
+        raise
+    s.setblocking(False)
+    return s
+
+
+class _Call:
+    """a request being served, for `ServerStats`"""
+
+    __slots__ = ("func_name", "received", "bytes_in", "elapsed")
+
+    def __init__(self, received, bytes_in):
+        self.func_name = None
+        self.received = received
+        self.bytes_in = bytes_in
+        self.elapsed = 0.0
+
+
+class _Peer:
+    """
+    a client connection and its requests waiting to be executed. untagged requests
+    of one connection are executed one after another, so replies keep their order.
+    """
+
+    __slots__ = ("conn", "codec", "pending", "lock", "send_lock")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.codec = PICKLE  # till the client negotiates another one
+        self.pending = deque()
+        self.lock = threading.Lock()
+        # replies of tagged requests are sent by several workers
+        self.send_lock = threading.Lock()
+
+
 class RpcServer:
-    def __init__(self, port: int, cmd_cls: typing.Type[ServerCmd]):
+    def __init__(
+        self,
+        port: int,
+        cmd_cls: typing.Type[typing.Union[ServerCmd, RpcHandler]],
+        workers: int = 0,
+        worker_type: str = "thread",
+        host: str = None,
+        authkey: bytes = None,
+    ):
+        """
+        Params:
+            port: listening port
+            cmd_cls: `ServerCmd` subclass executing the requests, or `RpcHandler`
+                subclass instantiated once at `start()`
+            workers:
+                0: execute requests one by one on the receiving thread
+                >0: execute requests on a pool of `workers` threads or processes.
+                requests of one connection are still executed in order, requests
+                of different connections concurrently.
+            worker_type: "thread" or "process". with processes `cmd_cls` and the
+                arguments must be picklable, and `get_pid` and generator methods
+                are still executed by threads of the server process.
+            host: address to listen on, default to the address of the hostname
+            authkey: if not None, a client must prove it knows it before anything it
+                sends is unpickled, like `multiprocessing.connection.Listener`. the
+                client proves it with `_RPCProxy(authkey=...)`.
+        """
+        if worker_type not in ("thread", "process"):
+            raise ParamError("worker_type must be thread or process")
         self.port = port
         self.cmd_cls = cmd_cls
+        self.workers = workers
+        self.worker_type = worker_type
+        self.host = host
+        self.authkey = authkey
+        self._dispatcher = None
         self._server = None
+        self._server_thread = None
+        self._selector = None
+        self._peers = 0
+        self._max_peers = None
+        # authenticated connections to register, None for the failed ones
+        self._admitted = deque()
+        self._wakeup_r = None
+        self._wakeup_w = None
         self._stop = False
         self._socket_info = None
+        self._executor = None
+        self._local_executor = None
+        self._batch_executor = None
+        self._streams = _Streams(threading.Lock)
+        self._push_event = threading.Event()
+        self._broker = Broker(lambda peer: self._push_event.set())
+        self._push_thread = None
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._busy = 0
+        # submitted to worker processes, not done yet
+        self._in_process = 0
+        self._busy_time = 0.0
+        self._completed = 0
+        self._started_at = None
+        self._stats = ServerStats()
 
     def start(self):
-        host = socket.gethostbyname(socket.gethostname())
+        host = self.host or socket.gethostbyname(socket.gethostname())
         self._socket_info = (host, self.port)
-        self._server = Listener(self._socket_info)
-        self._all_connections = []
+        self._dispatcher = _Dispatcher(self.cmd_cls)
+        self._server = _listen(self._socket_info)
+        # written by `stop()` to wake up the selector
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._peers = 0
+        self._max_peers = None
+        if isinstance(self._selector, selectors.SelectSelector):
+            self._max_peers = _SELECT_MAX_SOCKETS - 2
+        self._selector.register(self._server, selectors.EVENT_READ, self._server)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+        if self.workers > 0:
+            if self.worker_type == "process":
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._local_executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="rpc-local"
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="rpc-worker"
+                )
+            # parallel `__batch__` calls wait here, not on a worker they may need
+            self._batch_executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="rpc-batch"
+            )
+        self._started_at = time.perf_counter()
         self._server_thread = threading.Thread(target=self.serve_forever)
         self._server_thread.daemon = True
         self._server_thread.start()
-        self._connection_thread = threading.Thread(target=self._do_recv)
-        self._connection_thread.daemon = True
-        self._connection_thread.start()
+        self._push_thread = threading.Thread(target=self._push_forever)
+        self._push_thread.daemon = True
+        self._push_thread.start()
         print(f"Start server[RPC] running at {host}:{self.port}")
 
     def serve_forever(self):
-        while True:
-            try:
-                conn = self._server.accept()
-                self._all_connections.append(conn)
-                if self._stop:
-                    break
-            except Exception as e:  # accept error
-                print(e)
+        """
+        accept connections and receive requests on one thread. the selector(epoll
+        on linux) registers connections in O(1) and only wakes up on real I/O. on
+        windows it is `select()`, connections past 510 are refused.
+        """
+        while not self._stop:
+            for key, _ in self._selector.select():
+                if key.data is None:  # woken up by `stop()` or `_authenticate`
+                    self._register_admitted()
+                    continue
+                if key.data is self._server:
+                    self._accept()
+                else:
+                    self._recv(key.data)
 
     def stop(self):
         self._stop = True
         try:
-            Client(self._socket_info)  # to unblock accept()
-        except:
+            self._wakeup_w.send(b"\0")
+        except OSError:
             pass
+        self._push_event.set()
         if self._server_thread is not None:
             self._server_thread.join()
             self._server_thread = None
-        if self._connection_thread is not None:
-            self._connection_thread.join()
-            self._connection_thread = None
-        for c in self._all_connections:
-            c.close()
-        if self._server is not None:
-            self._server.close()
-            self._server = None
+        if self._push_thread is not None:
+            self._push_thread.join()
+            self._push_thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._local_executor is not None:
+            self._local_executor.shutdown(wait=True)
+            self._local_executor = None
+        if self._batch_executor is not None:
+            self._batch_executor.shutdown(wait=True)
+            self._batch_executor = None
+        for stream in self._streams.pop_all():
+            if stream.gen is not None:
+                stream.gen.close()
+        while self._admitted:
+            conn = self._admitted.popleft()
+            if conn is not None:
+                conn.close()
+        if self._selector is not None:
+            for key in list(self._selector.get_map().values()):
+                if isinstance(key.data, _Peer):
+                    key.data.conn.close()
+            self._selector.close()
+            self._selector = None
+        for s in (self._server, self._wakeup_r, self._wakeup_w):
+            if s is not None:
+                s.close()
+        if self._dispatcher is not None:
+            self._dispatcher.close()
+            self._dispatcher = None
+        self._server = self._wakeup_r = self._wakeup_w = None
+        if self._stats:
+            print(f"server[RPC] stats(ms):\n{self._stats.format()}")
         print("Close server[RPC]")
 
-    def _do_recv(self):
-        while True:
-            if self._stop:
-                break
-            # FIXME: 在Windows下wait会导致其他线程的IO操作阻塞，严重影响性能
-            for c in wait(self._all_connections, timeout=0.1):
-                try:
-                    # Receive a message
-                    func_name, args, kwargs = c.recv()
-                except (EOFError, OSError):  # oserror if conn is closed by server side
-                    self._all_connections.remove(c)
+    def publish(self, topic, payload):
+        """
+        push `payload` to the clients subscribed to `topic`, see `rpcindaemon.pubsub`
+        """
+        self._broker.publish(topic, payload)
+
+    def pool_stats(self):
+        """
+        return worker pool statistics:
+            workers: size of the pool, 0 if requests run on the receiving thread
+            queued: requests received but not executing yet
+            busy: requests executing
+                with worker_type="process" a request submitted to the pool counts
+                as executing once a worker process is free to take it: the pool runs
+                them in order, one per process
+            completed: requests executed
+            utilisation: busy time / (workers * uptime)
+        """
+        with self._stats_lock:
+            uptime = time.perf_counter() - self._started_at
+            in_process = min(self._in_process, self.workers)
+            return {
+                "workers": self.workers,
+                "worker_type": self.worker_type,
+                "queued": self._queued + self._in_process - in_process,
+                "busy": self._busy + in_process,
+                "completed": self._completed,
+                "utilisation": self._busy_time / (max(1, self.workers) * uptime),
+            }
+
+    def stats(self):
+        """
+        return `{"pool": pool_stats(), "methods": per-method stats}`, see
+        `ServerStats.snapshot`. answered by the reserved `__stats__` rpc
+        """
+        return {"pool": self.pool_stats(), "methods": self._stats.snapshot()}
+
+    def _accept(self):
+        try:
+            sock, _ = self._server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:  # accept error
+            print(e)
+            return
+        if self._max_peers is not None and self._peers >= self._max_peers:
+            # past the limit `select()` would raise and stop the server, refuse
+            print(f"server[RPC] refuse connection: {self._peers} connections already")
+            sock.close()
+            return
+        sock.setblocking(True)
+        self._peers += 1
+        if self.authkey is not None:
+            # a client that does not answer must not stall the other connections
+            threading.Thread(
+                target=self._authenticate, args=(sock,), daemon=True
+            ).start()
+            return
+        peer = _Peer(Connection(sock.detach()))
+        self._selector.register(peer.conn, selectors.EVENT_READ, peer)
+
+    def _authenticate(self, sock):
+        conn = Connection(sock.fileno())
+        # cut off a client not done in time, its pending read returns EOF
+        timer = threading.Timer(_AUTH_TIMEOUT, _shutdown, (sock,))
+        timer.start()
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            authenticated = True
+        except (AuthenticationError, EOFError, OSError) as e:
+            print(f"server[RPC] authentication failed: {e!r}")
+            authenticated = False
+        finally:
+            timer.cancel()
+        sock.detach()  # owned by `conn`
+        if not authenticated:
+            conn.close()
+            conn = None
+        self._admitted.append(conn)
+        try:
+            self._wakeup_w.send(b"\0")
+        except (AttributeError, OSError):  # stopped meanwhile
+            if conn is not None:
+                conn.close()
+
+    def _register_admitted(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._admitted:
+            conn = self._admitted.popleft()
+            if conn is None:
+                self._peers -= 1
+                continue
+            peer = _Peer(conn)
+            self._selector.register(peer.conn, selectors.EVENT_READ, peer)
+
+    def _recv(self, peer):
+        try:
+            # Receive a message
+            frames = peer.codec.recv_frames(peer.conn)
+            call = _Call(time.perf_counter(), frames_size(frames))
+            request = peer.codec.decode(frames)
+        except Exception:  # closed(oserror if closed by server side) or garbage
+            self._selector.unregister(peer.conn)
+            self._peers -= 1
+            self._broker.unsubscribe(peer)
+            peer.conn.close()
+            return
+        if len(request) == 3 and request[0] == "__hello__":
+            self._hello(peer, *request[1], **request[2])
+        else:
+            self._dispatch(peer, request, call)
+
+    def _hello(self, peer, codecs=()):
+        # answered on the receiving thread, the next request is read with the new codec
+        codec = negotiate(codecs)
+        self._reply(peer, codec.name)
+        peer.codec = codec
+
+    def _dispatch(self, peer, request, call):
+        req_id = None
+        if len(request) == 4:
+            # tagged: (req_id, func_name, args, kwargs), answered with (req_id, result)
+            # as soon as it completes, in any order
+            req_id, *request = request
+        if request[0] in ("__subscribe__", "__unsubscribe__"):
+            self._reply(peer, self._subscription(peer, req_id, *request), req_id)
+            return
+        call.func_name = request[0]
+        with self._stats_lock:
+            self._queued += 1
+        if self._executor is None:
+            self._reply(peer, self._execute(request, call), req_id, call)
+            return
+        if req_id is None:
+            with peer.lock:
+                peer.pending.append((request, call))
+                if len(peer.pending) > 1:
+                    return  # the previous request of this connection will submit it
+        self._submit(peer, request, call, req_id)
+
+    def _subscription(self, peer, req_id, func_name, args, kwargs):
+        if req_id is None:
+            # pushed events and untagged replies cannot be told apart
+            return ParamError("subscribe with tagged requests")
+        if func_name == "__subscribe__":
+            self._broker.subscribe(peer, *args, **kwargs)
+        else:
+            self._broker.unsubscribe(peer, *args, **kwargs)
+
+    def _push_forever(self):
+        """
+        push pending events to subscribers whose connection is writable, a slow
+        consumer does not hold back the others, its events are conflated meanwhile
+        """
+        while not self._stop:
+            self._push_event.wait()
+            self._push_event.clear()
+            peers = []
+            for peer in self._broker.pending_keys():
+                if peer.conn.closed:
+                    self._broker.unsubscribe(peer)
                 else:
-                    try:
-                        # Run the RPC and send a response
-                        r = self.cmd_cls(func_name, args, kwargs).execute()
-                        c.send(r)
-                    except Exception as e:
-                        c.send(e)
+                    peers.append(peer)
+            if not peers:
+                continue
+            writable = []
+            try:
+                with selectors.DefaultSelector() as selector:
+                    for peer in peers:
+                        selector.register(peer.conn, selectors.EVENT_WRITE, peer)
+                    writable = [key.data for key, _ in selector.select(0.05)]
+            except (OSError, ValueError):  # closed meanwhile
+                pass
+            for peer in writable:
+                self._push(peer, self._broker.take(peer))
+            if len(writable) < len(peers):
+                self._push_event.set()  # try the others again
+
+    def _push(self, peer, events):
+        with peer.send_lock:
+            try:
+                peer.codec.send(peer.conn, (None, events))
+            except (EOFError, OSError):
+                self._broker.unsubscribe(peer)
+            except Exception as e:  # cannot encode
+                print(f"cannot push events {[topic for topic, _ in events]}: {e}")
+
+    def _submit(self, peer, request, call, req_id=None):
+        func_name, args, kwargs = request
+        if self.worker_type == "process" and not self._is_local(func_name):
+            with self._stats_lock:
+                self._queued -= 1
+                self._in_process += 1
+            future = self._executor.submit(
+                _execute_in_process, self.cmd_cls, func_name, args, kwargs
+            )
+            future.add_done_callback(partial(self._on_done, peer, True, call, req_id))
+        else:
+            executor = self._executor
+            if self.worker_type == "process":
+                # answered by the server process, not a worker process
+                executor = self._local_executor
+            future = executor.submit(self._execute, request, call)
+            future.add_done_callback(partial(self._on_done, peer, False, call, req_id))
+
+    def _on_done(self, peer, in_process, call, req_id, future):
+        try:
+            r = future.result()
+        except Exception as e:  # BrokenProcessPool...
+            r = e
+        if in_process:
+            elapsed = 0.0
+            if not isinstance(r, Exception):
+                r, elapsed = r
+            call.elapsed = elapsed
+            with self._stats_lock:
+                self._in_process -= 1
+                self._completed += 1
+                self._busy_time += elapsed
+        self._reply(peer, r, req_id, call)
+        if req_id is not None:
+            return
+        with peer.lock:
+            peer.pending.popleft()
+            if not peer.pending:
+                return
+            request, call = peer.pending[0]
+        self._submit(peer, request, call)
+
+    def _is_local(self, func_name):
+        """
+        requests answered by the server process itself. generators cannot be sent
+        back by a worker process, generator methods are streamed from here
+        """
+        if func_name in (
+            "get_pid",
+            "__pool_stats__",
+            "__stats__",
+            "__batch__",
+            "__stream_next__",
+            "__stream_close__",
+        ):
+            return True
+        method = self._dispatcher.method(func_name)
+        return inspect.isgeneratorfunction(method) or inspect.isasyncgenfunction(method)
+
+    def _execute(self, request, call=None):
+        func_name, args, kwargs = request
+        with self._stats_lock:
+            self._queued -= 1
+            self._busy += 1
+        st = time.perf_counter()
+        try:
+            if func_name == "__batch__":
+                return self._execute_batch(*args, **kwargs)
+            return self._call(func_name, args, kwargs)
+        except Exception as e:
+            return e
+        finally:
+            elapsed = time.perf_counter() - st
+            if call is not None:
+                call.elapsed = elapsed
+            with self._stats_lock:
+                self._busy -= 1
+                self._completed += 1
+                self._busy_time += elapsed
+
+    def _call(self, func_name, args, kwargs):
+        if func_name == "__pool_stats__":
+            return self.pool_stats()
+        if func_name == "__stats__":
+            return self.stats()
+        if func_name == "__stream_next__":
+            return self._stream_next(*args, **kwargs)
+        if func_name == "__stream_close__":
+            return self._stream_close(*args, **kwargs)
+        r = self._dispatcher.execute(func_name, args, kwargs)
+        if inspect.isgenerator(r):
+            return self._streams.open(r)
+        if inspect.isasyncgen(r):
+            raise ParamError(
+                f'{func_name} is an async generator, it needs makedaemon(server="asyncio")'
+            )
+        return r
+
+    def _stream_next(self, stream_id, n):
+        """
+        return `(index, items, done)` of the next up to `n` items. done is True if the
+        generator is exhausted or the exception it raised. pulls may run concurrently,
+        the client orders the chunks by index
+        """
+        stream = self._streams.get(stream_id)
+        with stream.lock:
+            index = stream.next_index
+            stream.next_index += 1
+            if stream.gen is None:
+                return index, [], True
+            items, done = _pull(stream.gen, n)
+            if done:
+                stream.gen = None
+            return index, items, done
+
+    def _stream_close(self, stream_id):
+        stream = self._streams.pop(stream_id)
+        if stream is not None and stream.gen is not None:
+            with stream.lock:
+                stream.gen.close()
+
+    def _execute_batch(self, calls, parallel=False):
+        """
+        execute `[(func_name, args, kwargs)]` one by one, or concurrently on
+        `workers` threads if `parallel`. return the results and exceptions in order
+        """
+        if parallel and self._batch_executor is not None:
+            return list(self._batch_executor.map(self._execute_one, calls))
+        return [self._execute_one(call) for call in calls]
+
+    def _execute_one(self, call):
+        func_name, args, kwargs = call
+        try:
+            in_process = isinstance(self._executor, ProcessPoolExecutor)
+            if in_process and not self._is_local(func_name):
+                r, _ = self._executor.submit(
+                    _execute_in_process, self.cmd_cls, func_name, args, kwargs
+                ).result()
+                return r
+            return self._call(func_name, args, kwargs)
+        except Exception as e:
+            return e
+
+    def _reply(self, peer, r, req_id=None, call=None):
+        error = isinstance(r, Exception)
+        if req_id is not None:
+            r = (req_id, r)
+        nbytes = 0
+        with peer.send_lock:
+            try:
+                nbytes = peer.codec.send(peer.conn, r)
+            except (EOFError, OSError):
+                pass  # closed by client
+            except Exception as e:  # cannot encode
+                error = True
+                nbytes = peer.codec.send(
+                    peer.conn, e if req_id is None else (req_id, e)
+                )
+        if call is not None:
+            queue = time.perf_counter() - call.received - call.elapsed
+            self._stats.record(
+                call.func_name, call.elapsed, queue, error, call.bytes_in, nbytes
+            )
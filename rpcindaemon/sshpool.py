@@ -0,0 +1,302 @@
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paramiko
+
+__all__ = ["SSHPool", "ssh_pool"]
+
+
+class _PooledTransport:
+    __slots__ = ("client", "password", "last_used", "in_use")
+
+    def __init__(self, client, password):
+        self.client = client
+        self.password = password
+        self.last_used = time.monotonic()
+        # commands running on it, it is not evicted meanwhile
+        self.in_use = 0
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            self.client.close()
+        except:
+            pass
+
+
+class SSHPool:
+    """
+    process-wide cache of authenticated ssh transports keyed by (hostname, username).
+
+    every `open_session` hands out a fresh channel on the cached transport, so
+    the tcp handshake, key exchange and password auth are paid once per host
+    instead of once per command. dead transports are reconnected transparently
+    and transports unused for `max_idle` seconds are closed by a background thread,
+    started with the first transport.
+
+    Params:
+        max_idle: seconds a transport may stay unused before it is evicted
+        connect_timeout: tcp connect timeout passed to `SSHClient.connect`
+        keepalive: seconds between ssh keepalive packets, 0 to disable
+        max_channels: max concurrent exec channels per host. openssh refuses more
+            than `MaxSessions`(10 by default) sessions on one connection.
+    """
+
+    def __init__(self, max_idle=300, connect_timeout=1, keepalive=30, max_channels=8):
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self.keepalive = keepalive
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._transports = {}
+        self._key_locks = {}
+        self._channel_sems = {}
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+        self.handshake_time = 0.0
+        self._reaper = None
+
+    def open_session(self, hostname, username, password, timeout=None):
+        """
+        open a new channel to `username@hostname`, connecting if needed.
+
+        raise `socket.timeout` if connect timeout, paramiko exceptions if auth fails.
+        """
+        return self._open((hostname, username), password, timeout)[1]
+
+    def _open(self, key, password, timeout):
+        with self._key_lock(key):
+            entry = self._checkout(key, password)
+        # opening a channel waits for the server's reply, do it outside the lock so
+        # concurrent callers open their channels in parallel
+        try:
+            return entry, entry.client.get_transport().open_session(timeout=timeout)
+        except (paramiko.SSHException, EOFError, OSError):
+            # transport died between the liveness check and now
+            with self._key_lock(key):
+                entry.close()
+                entry = self._checkout(key, password)
+            return entry, entry.client.get_transport().open_session(timeout=timeout)
+
+    def exec_command(self, hostname, username, password, cmd, timeout=None):
+        """
+        execute `cmd` on a channel of the shared transport and return (stdout, stderr)
+        as str. stdout and stderr are read together, so a chatty stream cannot
+        block the other one.
+
+        raise `socket.timeout` if the command does not finish within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        key = (hostname, username)
+        with self._channel_sem(key):
+            entry, chan = self._open(key, password, timeout)
+            with self._lock:
+                entry.in_use += 1
+            try:
+                with chan:
+                    chan.settimeout(timeout)
+                    chan.exec_command(cmd)
+                    out, err = _drain_channel(chan, deadline)
+            finally:
+                with self._lock:
+                    entry.in_use -= 1
+                    entry.last_used = time.monotonic()
+        return out.decode(errors="replace"), err.decode(errors="replace")
+
+    def exec_many(self, hostname, username, password, cmds, timeout=None):
+        """
+        execute `cmds` concurrently, each on its own channel of one shared transport,
+        at most `max_channels` at a time.
+
+        return a list aligned with `cmds` of (stdout, stderr) or the raised exception.
+        """
+        if not cmds:
+            return []
+        # connect once up front so the workers don't race to authenticate
+        self.get_transport(hostname, username, password)
+
+        def _exec(cmd):
+            try:
+                return self.exec_command(hostname, username, password, cmd, timeout)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(min(len(cmds), self.max_channels)) as executor:
+            return list(executor.map(_exec, cmds))
+
+    def get_transport(self, hostname, username, password) -> paramiko.Transport:
+        key = (hostname, username)
+        with self._key_lock(key):
+            return self._checkout(key, password).client.get_transport()
+
+    def stats(self):
+        """
+        return hit/miss counters and handshake time spent and (estimated) saved
+        """
+        with self._lock:
+            handshakes = self.misses + self.reconnects
+            avg = self.handshake_time / handshakes if handshakes else 0.0
+            return {
+                "connections": len(self._transports),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reconnects": self.reconnects,
+                "evictions": self.evictions,
+                "handshake_time": self.handshake_time,
+                "avg_handshake_time": avg,
+                "saved_handshake_time": avg * self.hits,
+            }
+
+    def evict_idle(self):
+        """
+        close the transports unused for `max_idle` seconds, run every
+        `max_idle / 2` seconds(at most 60) by the background thread
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                (key, entry)
+                for key, entry in self._transports.items()
+                if not entry.in_use and now - entry.last_used > self.max_idle
+            ]
+            for key, _ in idle:
+                del self._transports[key]
+            self.evictions += len(idle)
+        for _, entry in idle:
+            entry.close()
+
+    def _start_reaper(self):
+        # with `_lock` held. threads do not survive a fork, check it is alive
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(
+                target=self._reap_forever, name="ssh-pool-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap_forever(self):
+        interval = min(max(self.max_idle / 2, 0.05), 60)
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+            with self._lock:
+                if not self._transports:
+                    self._reaper = None
+                    return
+
+    def close(self, hostname=None, username=None):
+        """
+        close cached transports of `username@hostname`, or all of them if hostname is None
+        """
+        with self._lock:
+            keys = [
+                key
+                for key in self._transports
+                if hostname is None or key == (hostname, username)
+            ]
+            entries = [self._transports.pop(key) for key in keys]
+        for entry in entries:
+            entry.close()
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _channel_sem(self, key):
+        with self._lock:
+            sem = self._channel_sems.get(key)
+            if sem is None:
+                sem = self._channel_sems[key] = threading.BoundedSemaphore(
+                    self.max_channels
+                )
+            return sem
+
+    def _checkout(self, key, password):
+        with self._lock:
+            entry = self._transports.get(key)
+        if entry is not None and entry.password == password:
+            if entry.is_active():
+                with self._lock:
+                    self.hits += 1
+                    entry.last_used = time.monotonic()
+                return entry
+            self._discard(key, entry)
+            with self._lock:
+                self.reconnects += 1
+        else:
+            # never seen or different password, a wrong password must not
+            # reuse a transport authenticated with the right one
+            with self._lock:
+                self.misses += 1
+        new_entry = _PooledTransport(self._connect(key, password), password)
+        with self._lock:
+            old = self._transports.get(key)
+            self._transports[key] = new_entry
+            self._start_reaper()
+        if old is not None and old is not new_entry:
+            old.close()
+        return new_entry
+
+    def _discard(self, key, entry):
+        with self._lock:
+            if self._transports.get(key) is entry:
+                del self._transports[key]
+        entry.close()
+
+    def _connect(self, key, password):
+        hostname, username = key
+        st = time.perf_counter()
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            ssh.connect(
+                hostname,
+                username=username,
+                password=password,
+                timeout=self.connect_timeout,
+            )
+        except:
+            ssh.close()
+            raise
+        finally:
+            elapsed = time.perf_counter() - st
+            with self._lock:
+                self.handshake_time += elapsed
+        if self.keepalive:
+            ssh.get_transport().set_keepalive(self.keepalive)
+        return ssh
+
+
+def _drain_channel(chan, deadline):
+    out = []
+    err = []
+    while True:
+        if chan.recv_ready():
+            out.append(chan.recv(32768))
+        elif chan.recv_stderr_ready():
+            err.append(chan.recv_stderr(32768))
+        elif chan.eof_received or chan.closed:
+            break
+        else:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise socket.timeout()
+            # the channel's fileno is signalled on stdout, stderr data and eof
+            select.select([chan], [], [], timeout)
+    return b"".join(out), b"".join(err)
+
+
+# shared by every `Task` and `batch_*` function in this process
+ssh_pool = SSHPool()
@@ -0,0 +1,149 @@
+"""
+per-method statistics of an rpc server: calls, errors, bytes in and out, and
+log-bucketed histograms of the execution and queueing time.
+
+recording a call is a few arithmetic operations and one lock, percentiles are only
+computed when the stats are read. they are answered by the reserved `__stats__`
+rpc and printed to the daemon log when the server stops.
+"""
+
+import math
+import threading
+
+__all__ = ["LatencyHistogram", "ServerStats"]
+
+# 4 buckets per power of 2 from 1µs, a percentile is at most 25% above the truth
+_SUB = 4
+_BUCKETS = 40 * _SUB  # up to 2**40µs, ~12 days
+
+
+def _bucket(seconds):
+    us = seconds * 1e6
+    if us < 1:
+        return 0
+    m, e = math.frexp(us)  # us = m * 2**e, 0.5 <= m < 1
+    return min((e - 1) * _SUB + int((m - 0.5) * 2 * _SUB), _BUCKETS - 1)
+
+
+def _upper(i):
+    """upper bound of bucket `i` in seconds"""
+    e, sub = divmod(i, _SUB)
+    return 2.0**e * (1 + (sub + 1) / _SUB) / 1e6
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[_bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        Params:
+            p: 0 ~ 1
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(p * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(_upper(i), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class _MethodStats:
+    __slots__ = ("calls", "errors", "bytes_in", "bytes_out", "execute", "queue")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.execute = LatencyHistogram()
+        self.queue = LatencyHistogram()
+
+
+class ServerStats:
+    """
+    thread safe
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def record(self, func_name, execute, queue, error, bytes_in, bytes_out):
+        """
+        Params:
+            execute: seconds executing the method
+            queue: seconds from receiving the request to sending the reply, minus
+                `execute`: waiting for a worker or for the previous requests of the
+                connection
+            error: the method raised
+        """
+        with self._lock:
+            stats = self._methods.get(func_name)
+            if stats is None:
+                stats = self._methods[func_name] = _MethodStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.execute.add(execute)
+            stats.queue.add(max(0.0, queue))
+
+    def snapshot(self):
+        """
+        return `{func_name: {"calls", "errors", "bytes_in", "bytes_out", "execute",
+        "queue"}}`, execute and queue are `{"mean", "p50", "p99", "max"}` in seconds
+        """
+        with self._lock:
+            return {
+                name: {
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "bytes_in": s.bytes_in,
+                    "bytes_out": s.bytes_out,
+                    "execute": s.execute.summary(),
+                    "queue": s.queue.summary(),
+                }
+                for name, s in self._methods.items()
+            }
+
+    def format(self):
+        """a table of the snapshot, one method per line, times in ms"""
+        lines = [
+            f"{'method':<24}{'calls':>9}{'errors':>8}{'in':>11}{'out':>11}"
+            f"{'exec p50':>10}{'p99':>9}{'max':>9}{'queue p99':>11}"
+        ]
+        for name, s in sorted(self.snapshot().items()):
+            e, q = s["execute"], s["queue"]
+            lines.append(
+                f"{name:<24}{s['calls']:>9}{s['errors']:>8}{s['bytes_in']:>11}"
+                f"{s['bytes_out']:>11}{e['p50'] * 1e3:>10.3f}{e['p99'] * 1e3:>9.3f}"
+                f"{e['max'] * 1e3:>9.3f}{q['p99'] * 1e3:>11.3f}"
+            )
+        return "\n".join(lines)
+
+    def __bool__(self):
+        return bool(self._methods)
@@ -3,60 +3,727 @@ import json
 import os
 import random
 import socket
+import threading
 import time
-from collections import defaultdict
-from multiprocessing.connection import Connection
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
 from typing import List
 
-import paramiko
-
+from .codec import PICKLE, get_codec, usable
 from .exceptions import *
+from .pubsub import EventBuffer
+from .readiness import EXITING, STATES
+from .rpcserver import StreamHandle
+from .sshpool import ssh_pool
 
 
 def ClientWithTimeout(address, timeout):
-
+    """
+    raise `NetworkTimeoutError` if not connected in `timeout` seconds
+    """
+    if timeout is not None and timeout <= 0:
+        # settimeout(0) would make a non-blocking connect
+        raise NetworkTimeoutError(f"connect {address} timeout")
     with socket.socket() as s:
         s.setblocking(True)
         s.settimeout(timeout)
-        s.connect(address)
+        try:
+            s.connect(address)
+        except socket.timeout as e:
+            raise NetworkTimeoutError(f"connect {address} timeout") from e
         s.settimeout(None)
         return Connection(s.detach())
 
 
+def _remaining(deadline):
+    return None if deadline is None else max(0, deadline - time.monotonic())
+
+
+class RpcFuture:
+    """
+    pending result of a call sent by `_RPCProxy.submit`
+    """
+
+    __slots__ = ("_proxy", "req_id", "_timed_out")
+
+    def __init__(self, proxy, req_id):
+        self._proxy = proxy
+        self.req_id = req_id
+        self._timed_out = False
+
+    def done(self):
+        proxy = self._proxy
+        return self.req_id in proxy._results or self.req_id <= proxy._closed_at
+
+    def result(self, timeout=None):
+        """
+        wait for the result, raise the exception raised by the remote method
+
+        raise `NetworkTimeoutError` if no result in `timeout` seconds, the result is
+        dropped whenever it arrives and the next calls raise it again
+        """
+        if self._timed_out:
+            raise NetworkTimeoutError(f"rpc {self.req_id} timed out")
+        try:
+            return self._proxy._wait(self.req_id, timeout)
+        except NetworkTimeoutError:
+            self._timed_out = True
+            raise
+
+
 class _RPCProxy:
-    def __init__(self, address):
+    def __init__(self, address, codecs=None, connect_timeout=0.1, authkey=None):
+        """
+        Params:
+            codecs: names of codecs in order of preference(see `rpcindaemon.codec`),
+                negotiated with the server on connect. None to use pickle
+                without negotiation
+            connect_timeout: seconds to connect if the call has no timeout
+            authkey: the `authkey` of the server, raise
+                `multiprocessing.AuthenticationError` on connect if it differs
+        """
         self.address = address
+        self.codecs = codecs
+        self.connect_timeout = connect_timeout
+        self.authkey = authkey
         self._connection = None
+        self._codec = PICKLE
+        self._last_id = 0
+        # calls up to this one were sent on a closed connection
+        self._closed_at = 0
+        self._inflight = 0
+        # {req_id: result} received before anyone asked for them, kept on close
+        self._results = {}
+        self._forgotten = set()
+        # subscribed topics and events pushed but not got yet
+        self._topics = set()
+        self._subscribed = False
+        self._events = EventBuffer()
+        self._send_lock = threading.Lock()
+        self._recv_lock = threading.Lock()
 
-    def do_rpc(self, func_name: str, *args, **kwargs):
+    def do_rpc(self, func_name: str, *args, timeout=None, **kwargs):
+        """
+        see `Task.do_rpc`
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self._inflight or self._subscribed:
+            # replies of tagged and untagged requests, and pushed events cannot be
+            # told apart
+            future = self._submit(func_name, args, kwargs, deadline)
+            return future.result(_remaining(deadline))
         if self._connection is None:
-            self._connection = ClientWithTimeout(self.address, 0.1)
-        self._connection.send((func_name, args, kwargs))
-        _try_count = 0
-        while True:
-            # 第一次调用recv时会报  [Errno 11] Resource temporarily unavailable
-            # socket 异步模式下，recv没有取到值会抛该异常
-            # 多次尝试
+            self._connect(deadline)
+        try:
+            self._codec.send(self._connection, (func_name, args, kwargs))
+            result = self._recv(deadline)
+        except:
+            # broken, a half read reply, or one the codec could not read
+            self.close()
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def do_rpc_many(self, calls, parallel=False):
+        """
+        execute `calls` in one round trip, see `Task.do_rpc_many`
+        """
+        return self.do_rpc("__batch__", [_batch_call(c) for c in calls], parallel)
+
+    def do_rpc_stream(
+        self, func_name: str, *args, chunk_size=100, prefetch=2, **kwargs
+    ):
+        """
+        call a generator method and return an iterator of its items, see
+        `Task.do_rpc_stream`
+        """
+        handle = self.do_rpc(func_name, *args, **kwargs)
+        if not isinstance(handle, StreamHandle):
+            return iter(handle)  # not a generator, already whole
+        return self._iter_stream(handle.stream_id, chunk_size, max(1, prefetch))
+
+    def _iter_stream(self, stream_id, chunk_size, prefetch):
+        pulls = deque(
+            self.submit("__stream_next__", stream_id, chunk_size)
+            for _ in range(prefetch)
+        )
+        # chunks arrived before the ones pulled earlier, by index
+        chunks = {}
+        expected = 0
+        try:
+            while True:
+                while expected not in chunks:
+                    index, items, done = pulls.popleft().result()
+                    chunks[index] = (items, done)
+                    if done is False:
+                        pulls.append(
+                            self.submit("__stream_next__", stream_id, chunk_size)
+                        )
+                items, done = chunks.pop(expected)
+                expected += 1
+                yield from items
+                if isinstance(done, Exception):
+                    raise done
+                if done:
+                    return
+        finally:
+            for f in pulls:
+                self._forget(f.req_id)
+            if self._connection is not None:
+                self._forget(self.submit("__stream_close__", stream_id).req_id)
+
+    def submit(self, func_name: str, *args, **kwargs) -> RpcFuture:
+        """
+        send a call without waiting for its result, so many calls can be in flight on
+        one connection. the server answers them as they complete, in any order.
+        """
+        return self._submit(func_name, args, kwargs)
+
+    def _submit(self, func_name, args, kwargs, deadline=None):
+        with self._send_lock:
+            if self._connection is None:
+                self._connect(deadline)
+            self._last_id += 1
+            req_id = self._last_id
+            self._inflight += 1
             try:
-                result = self._connection.recv()
-            except BlockingIOError as e:
-                if e.errno == 11:
-                    if _try_count > 10:
-                        raise e
-                    time.sleep(0.2)
-                    _try_count += 1
-                    continue
-                else:
-                    raise e
-            break
+                self._codec.send(self._connection, (req_id, func_name, args, kwargs))
+            except:
+                self._inflight -= 1
+                raise
+        return RpcFuture(self, req_id)
+
+    def _forget(self, req_id):
+        """
+        drop the result of `req_id` whenever it arrives
+        """
+        with self._recv_lock:
+            if req_id in self._results:
+                del self._results[req_id]
+            elif req_id > self._closed_at:
+                self._forgotten.add(req_id)
+
+    def _wait(self, req_id, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._recv_lock:
+                if req_id in self._results:
+                    result = self._results.pop(req_id)
+                    break
+                if req_id <= self._closed_at:
+                    raise ConnectionError(
+                        f"connection to {self.address} closed before the reply of"
+                        f" rpc {req_id}"
+                    )
+                if deadline is not None:
+                    if not self._connection.poll(_remaining(deadline)):
+                        # a late result is not kept forever
+                        self._forgotten.add(req_id)
+                        raise NetworkTimeoutError(f"rpc {req_id} timeout")
+                self._recv_one()
         if isinstance(result, Exception):
             raise result
         return result
 
+    def _recv_one(self):
+        # with `_recv_lock` held
+        if self._connection is None:
+            raise ConnectionError(f"connection to {self.address} closed")
+        try:
+            _req_id, r = self._recv()
+        except:
+            self.close()
+            raise
+        if _req_id is None:  # pushed events
+            for topic, payload in r:
+                self._events.put(topic, payload)
+            return
+        self._inflight -= 1
+        if _req_id in self._forgotten:
+            self._forgotten.discard(_req_id)
+        else:
+            self._results[_req_id] = r
+
+    def subscribe(self, topics):
+        """
+        see `Task.subscribe`
+        """
+        self._subscribed = True
+        self.submit("__subscribe__", list(topics)).result()
+        # after the first connect, it would subscribe them again
+        self._topics.update(topics)
+
+    def unsubscribe(self, topics=None):
+        if topics is None:
+            self._topics.clear()
+        else:
+            self._topics.difference_update(topics)
+        self.submit(
+            "__unsubscribe__", None if topics is None else list(topics)
+        ).result()
+
+    def get_event(self, timeout=None):
+        """
+        see `Task.get_event`
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._recv_lock:
+                if self._events:
+                    return self._events.pop()
+                if self._connection is None:
+                    self._connect()
+                if deadline is not None:
+                    if not self._connection.poll(max(0, deadline - time.monotonic())):
+                        return None
+                self._recv_one()
+
+    def _recv(self, deadline=None):
+        if deadline is not None:
+            if not self._connection.poll(_remaining(deadline)):
+                # a late reply would be taken as the next call's
+                self.close()
+                raise NetworkTimeoutError(f"rpc to {self.address} timeout")
+        return self._codec.recv(self._connection)
+
+    def healthy(self):
+        """
+        an idle connection with something to read was closed by the server
+        """
+        if self._connection is None:
+            return True  # connects on next call
+        try:
+            return self._inflight > 0 or not self._connection.poll(0)
+        except OSError:
+            return False
+
+    def _connect(self, deadline=None):
+        timeout = self.connect_timeout if deadline is None else _remaining(deadline)
+        self._connection = ClientWithTimeout(self.address, timeout)
+        self._codec = PICKLE
+        if self.authkey is not None:
+            try:
+                # the server sends its challenge first
+                if not self._connection.poll(timeout):
+                    raise NetworkTimeoutError(f"authenticate to {self.address} timeout")
+                answer_challenge(self._connection, self.authkey)
+                deliver_challenge(self._connection, self.authkey)
+            except:
+                self.close()
+                raise
+        # only what this side can decode
+        offer = [codec.name for codec in usable(self.codecs or ())]
+        if offer:
+            self._codec.send(self._connection, ("__hello__", (offer,), {}))
+            name = self._recv(deadline)
+            if isinstance(name, Exception) and not isinstance(name, MethodNotFound):
+                self.close()
+                raise name
+            if not isinstance(name, MethodNotFound):  # or server without codecs
+                self._codec = get_codec(name)
+        if self._topics:
+            # subscriptions of the previous connection, nobody waits for the reply
+            self._inflight += 1
+            self._last_id += 1
+            self._forgotten.add(self._last_id)
+            self._codec.send(
+                self._connection,
+                (self._last_id, "__subscribe__", (list(self._topics),), {}),
+            )
+
     def close(self):
+        """
+        close the connection. the calls waiting for a reply raise `ConnectionError`,
+        the replies already received are kept for their `RpcFuture`
+        """
         if self._connection is not None:
             self._connection.close()
         self._connection = None
+        self._closed_at = self._last_id
+        self._inflight = 0
+        # they will not arrive
+        self._forgotten = set()
+        self._events = EventBuffer()
+
+
+class _RPCPool:
+    """
+    thread safe pool of `_RPCProxy` connections to one daemon, so calls from many
+    threads run in parallel, each on a connection of its own.
+
+    a connection is checked before reuse(an idle connection turning readable was
+    closed by the server), connections idle for `max_idle` seconds are closed
+    except `min_size` of them, and a connection failing during a call is dropped. an
+    exception raised by the remote method does not cost the connection.
+    `submit`, `subscribe` and `get_event` share one more connection, pipelined
+    calls and events are bound to it.
+
+    Params:
+        min_size: connections kept open however idle
+        max_size: max connections checked out at the same time, more callers wait
+        max_idle: seconds before an idle connection is closed
+        checkout_timeout: seconds to wait for a free connection, raise
+            `NetworkTimeoutError` then
+        authkey: see `_RPCProxy`
+    """
+
+    def __init__(
+        self,
+        address,
+        codecs=None,
+        min_size=0,
+        max_size=4,
+        max_idle=60,
+        checkout_timeout=None,
+        authkey=None,
+    ):
+        if max_size < 1 or min_size > max_size:
+            raise ParamError("0 < max_size and min_size <= max_size")
+        self.address = address
+        self.codecs = codecs
+        self.authkey = authkey
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.checkout_timeout = checkout_timeout
+        self._cond = threading.Condition()
+        # [(proxy, last used)], most recently used last
+        self._idle = []
+        self._in_use = 0
+        self._shared = None
+
+    @contextmanager
+    def connection(self, timeout=None) -> "_RPCProxy":
+        proxy = self._checkout(timeout)
+        try:
+            yield proxy
+        except:
+            self._checkin_failed(proxy)
+            raise
+        self._checkin(proxy)
+
+    def _checkin_failed(self, proxy):
+        # a proxy closes itself when its connection breaks or a reply cannot be
+        # read, an exception raised by the remote method leaves it reusable
+        self._checkin(None if proxy._connection is None else proxy)
+
+    def do_rpc(self, func_name: str, *args, timeout=None, **kwargs):
+        st = time.monotonic()
+        with self.connection(timeout) as proxy:
+            if timeout is not None:
+                timeout = max(0, timeout - (time.monotonic() - st))
+            return proxy.do_rpc(func_name, *args, timeout=timeout, **kwargs)
+
+    def do_rpc_many(self, calls, parallel=False):
+        with self.connection() as proxy:
+            return proxy.do_rpc_many(calls, parallel)
+
+    def do_rpc_stream(
+        self, func_name: str, *args, chunk_size=100, prefetch=2, **kwargs
+    ):
+        proxy = self._checkout()
+        try:
+            handle = proxy.do_rpc(func_name, *args, **kwargs)
+        except:
+            self._checkin_failed(proxy)
+            raise
+        if not isinstance(handle, StreamHandle):
+            self._checkin(proxy)
+            return iter(handle)  # not a generator, already whole
+        it = proxy._iter_stream(handle.stream_id, chunk_size, max(1, prefetch))
+        return _PooledStream(self, proxy, it)
+
+    def submit(self, func_name: str, *args, **kwargs) -> RpcFuture:
+        return self._shared_proxy().submit(func_name, *args, **kwargs)
+
+    def subscribe(self, topics):
+        self._shared_proxy().subscribe(topics)
+
+    def unsubscribe(self, topics=None):
+        self._shared_proxy().unsubscribe(topics)
+
+    def get_event(self, timeout=None):
+        return self._shared_proxy().get_event(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "max_size": self.max_size,
+            }
+
+    def close(self):
+        with self._cond:
+            idle = [proxy for proxy, _ in self._idle]
+            self._idle.clear()
+            shared = self._shared
+        for proxy in idle:
+            proxy.close()
+        if shared is not None:
+            # keeps its subscriptions, they are renewed on the next connect
+            shared.close()
+
+    def _shared_proxy(self):
+        with self._cond:
+            if self._shared is None:
+                self._shared = _RPCProxy(
+                    self.address, self.codecs, authkey=self.authkey
+                )
+            return self._shared
+
+    def _checkout(self, timeout=None):
+        if timeout is None or (
+            self.checkout_timeout is not None and self.checkout_timeout < timeout
+        ):
+            timeout = self.checkout_timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.max_size:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        raise NetworkTimeoutError("no free rpc connection")
+                self._cond.wait(timeout)
+            self._in_use += 1
+            self._evict_idle()
+            while self._idle:
+                proxy, _ = self._idle.pop()
+                if proxy.healthy():
+                    return proxy
+                proxy.close()
+        return _RPCProxy(self.address, self.codecs, authkey=self.authkey)
+
+    def _checkin(self, proxy):
+        with self._cond:
+            self._in_use -= 1
+            if proxy is not None and proxy._connection is not None:
+                self._idle.append((proxy, time.monotonic()))
+            self._evict_idle()
+            self._cond.notify()
+
+    def _evict_idle(self):
+        # with `_cond` held. the least recently used are first
+        now = time.monotonic()
+        keep = max(0, self.min_size - self._in_use)
+        while len(self._idle) > keep and now - self._idle[0][1] > self.max_idle:
+            proxy, _ = self._idle.pop(0)
+            proxy.close()
+
+
+class _PooledStream:
+    """
+    iterator of a stream of `_RPCPool`, its connection is checked out till the
+    stream ends, is closed, or the iterator is dropped
+    """
+
+    def __init__(self, pool, proxy, it):
+        self._pool = pool
+        self._proxy = proxy
+        self._it = it
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._proxy is None:
+            raise StopIteration
+        try:
+            return next(self._it)
+        except StopIteration:
+            self._release(self._pool._checkin)
+            raise
+        except:
+            self._release(self._pool._checkin_failed)
+            raise
+
+    def close(self):
+        if self._proxy is None:
+            return
+        try:
+            # the replies of its pulls are skipped by the next call
+            self._it.close()
+        except:
+            self._release(self._pool._checkin_failed)
+            raise
+        self._release(self._pool._checkin)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _release(self, checkin):
+        proxy, self._proxy = self._proxy, None
+        checkin(proxy)
+
+
+def _batch_call(call):
+    if isinstance(call, str):
+        return (call, (), {})
+    func_name, *rest = call
+    args = tuple(rest[0]) if rest else ()
+    kwargs = rest[1] if len(rest) > 1 else {}
+    return (func_name, args, kwargs)
+
+
+# the calls sent again after the connection broke while waiting for the reply: they
+# may have run already. `launch` could start its commands twice and `terminate`
+# signal a pid reused meanwhile, they are not
+_IDEMPOTENT_AGENT_CALLS = {
+    "get_pid",
+    "get_pids",
+    "log_tail",
+    "wait_state",
+    "host_stats",
+}
+
+
+class _AgentConnectionError(Exception):
+    """the agent's connection failed, before the call was sent if not `sent`"""
+
+    def __init__(self, error, sent):
+        super().__init__(error)
+        self.error = error
+        self.sent = sent
+
+
+class _AgentClient:
+    """
+    rpc client of the agent running on one host, shared by all tasks of the host.
+    calls run in parallel, each on a pooled connection authenticated with the
+    agent's secret, read over ssh when the agent is first used.
+    """
+
+    def __init__(self, hostname, port, bind="127.0.0.1"):
+        self.hostname = hostname
+        self.port = port
+        self.bind = bind
+        self._pool = None
+        # held to start the agent and swap the pool only, not during calls
+        self._lock = threading.Lock()
+
+    def call(self, task, func_name, *args, **kwargs):
+        """
+        call the agent, start it over ssh with `task`'s credentials if it is not
+        reachable. a call whose connection broke after it was sent is sent again
+        only if it is idempotent
+        """
+        pool = self._pool
+        if pool is None:
+            pool = self._start(task, None)
+        try:
+            return self._call(pool, func_name, args, kwargs)
+        except _AgentConnectionError as e:
+            if not e.sent:
+                # not running anymore, or restarted
+                pool = self._start(task, pool)
+            elif func_name not in _IDEMPOTENT_AGENT_CALLS:
+                raise e.error
+        try:
+            return self._call(pool, func_name, args, kwargs)
+        except _AgentConnectionError as e:
+            raise e.error
+
+    @staticmethod
+    def _call(pool, func_name, args, kwargs):
+        with pool.connection() as proxy:
+            if proxy._connection is None:
+                try:
+                    proxy._connect()
+                except (
+                    OSError,
+                    EOFError,
+                    NetworkTimeoutError,
+                    AuthenticationError,
+                ) as e:
+                    raise _AgentConnectionError(e, False) from e
+            try:
+                return proxy.do_rpc(func_name, *args, **kwargs)
+            except Exception as e:
+                if proxy._connection is None:  # closed by a transport error
+                    raise _AgentConnectionError(e, True) from e
+                raise
+
+    def _start(self, task, stale):
+        with self._lock:
+            if self._pool is not stale:
+                return self._pool  # by another thread meanwhile
+            if stale is not None:
+                stale.close()
+                self._pool = None
+            pool = _RPCPool(
+                (self.hostname, self.port), max_size=8, authkey=self._bootstrap(task)
+            )
+            self._wait_reachable(pool)
+            self._pool = pool
+            return pool
+
+    def _bootstrap(self, task, timeout=10):
+        """
+        start the agent unless it is running, return its secret
+        """
+        cmd = (
+            f"{task.py_env_activate} python -m rpcindaemon.entry agent"
+            f" --port={self.port} --host={self.bind}"
+        )
+        try:
+            out, err = ssh_pool.exec_command(
+                self.hostname, task.username, task.password, cmd, timeout
+            )
+        except socket.timeout:
+            raise NetworkTimeoutError(
+                f"ssh_execute connect to {task.username}@{self.hostname} timeout"
+            )
+        for line in out.splitlines():
+            if line.startswith("agent-key:"):
+                return line[len("agent-key:") :].strip().encode()
+        raise SSHExecutionError(f"ssh_execute [{cmd}] error: {err}")
+
+    def _wait_reachable(self, pool, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                pool.do_rpc("get_pid")
+                return
+            except (OSError, EOFError, NetworkTimeoutError, AuthenticationError) as e:
+                if time.monotonic() > deadline:
+                    pool.close()
+                    raise NetworkTimeoutError(
+                        f"agent on {self.hostname}:{self.port} not reachable, it"
+                        f" listens on {self.bind}:{self.port}(see `agent_bind`): {e!r}"
+                    )
+                time.sleep(0.1)
+
+
+_agents = {}
+_agents_lock = threading.Lock()
+
+
+def _get_agent(hostname, username, port, bind="127.0.0.1"):
+    # an agent runs as the ssh user starting it, with its secret
+    key = (hostname, username, port, bind)
+    with _agents_lock:
+        agent = _agents.get(key)
+        if agent is None:
+            agent = _agents[key] = _AgentClient(hostname, port, bind)
+        return agent
+
+
+def _agent_terminate(agent, task, pids, task_ids):
+    try:
+        agent.call(task, "terminate", pids, task_ids, task.working_dir)
+    except (NetworkTimeoutError, SSHExecutionError):
+        raise
+    except Exception as e:
+        raise SSHExecutionError(
+            f"agent terminate {pids} on {task.hostname} error: {e!r}"
+        ) from e
 
 
 class Task:
@@ -71,11 +738,15 @@ class Task:
         username: str = None,
         password: str = None,
         port: int = -1,
+        agent_port: int = -1,
+        agent_bind: str = "127.0.0.1",
+        codecs: List[str] = None,
+        rpc_connections: int = 4,
     ):
         """
-        remote task over ssh running in remote background. not thread safe so you
-        should use different task id. same task id is not allowed running at the same
-        time.
+        remote task over ssh running in remote background. rpc calls(`do_rpc`...) are
+        thread safe, the others are not. same task id is not allowed running at the
+        same time.
 
         Params:
             task_id: unique task id
@@ -89,6 +760,19 @@ class Task:
             -1: no tcp connect to remote process
             0: connect to remote process using random port
             >0: connect to remote process using certain port
+            agent_port:
+            -1: run control operations(run, get_pid, terminate...) over ssh
+            >0: run control operations through the host's agent listening on this
+                port(`python -m rpcindaemon.entry agent`), the agent is started
+                over ssh if it is not running
+            agent_bind: address the agent listens on when this task starts it. it
+                only accepts local connections by default, use eg. "0.0.0.0" to
+                control a remote host. connections are authenticated with a secret
+                read over ssh.
+            codecs: rpc codecs in order of preference, eg. `["pickle5", "pickle"]` for
+                large numpy arrays or `["msgpack"]` for small calls. see `rpcindaemon.codec`
+            rpc_connections: max connections to the remote process, `do_rpc` from
+                more threads waits for a free one. see `_RPCPool`
         """
         if not hostname:
             raise ParamError("hostname cannot be empty")
@@ -112,12 +796,16 @@ class Task:
         if port == 0:
             port = get_available_port(hostname)
         self.port = port
+        self.codecs = codecs
+        self.rpc_connections = rpc_connections
         if port > 0:
-            self._client = _RPCProxy((hostname, port))
+            self._client = _RPCPool((hostname, port), codecs, max_size=rpc_connections)
             self._port_option = f"--port={port}"
         else:
             self._client = None
             self._port_option = ""
+        self.agent_port = agent_port
+        self.agent_bind = agent_bind
         self.running = False
 
     def reset_client(self):
@@ -155,13 +843,20 @@ class Task:
         pid = self.get_pid()
         if pid:
             raise TaskIsRunningError("cannot run a running task")
-        _ssh_execute(
-            f"{self.py_env_activate} {self._working_dir} {self.cmd} --task-id={self.task_id} {self._port_option}",
-            self.hostname,
-            self.username,
-            self.password,
-            ssh_exec_timeout,
-        )
+        agent = self._agent()
+        if agent is not None:
+            cmd = self._run_cmd()
+            _, err = agent.call(self, "launch", [cmd], ssh_exec_timeout)[0]
+            if err:
+                raise SSHExecutionError(f"agent launch [{cmd}] error: {err}")
+        else:
+            _ssh_execute(
+                self._run_cmd(),
+                self.hostname,
+                self.username,
+                self.password,
+                ssh_exec_timeout,
+            )
         self.reset_client()
         self.running = True
 
@@ -181,6 +876,39 @@ class Task:
             if t > timeout:
                 raise TaskStartTimeout("wait task alive timeout")
 
+    def wait_ready(self, timeout=10, state="ready"):
+        """
+        block till the remote task reaches `state` with one remote call, instead of
+        polling like `wait_alive`. states in order:
+
+        - starting: pidfile written
+        - rpc-listening: rpc server started(only tasks with port)
+        - ready: the task function called `F.notify_ready()`
+        - exiting: the task is quitting
+
+        return the readiness record `{"pid": pid, "state": state, "times": {state: timestamp}}`,
+        eg. `times["ready"] - times["starting"]` is the start-up latency.
+
+        raise `TaskStartTimeout` if timeout, `TaskExitedError` if the task exits before.
+        """
+        if state not in STATES:
+            raise ParamError(f"state must be one of {STATES}")
+        agent = self._agent()
+        if agent is not None:
+            record = agent.call(
+                self, "wait_state", self.task_id, state, timeout, self.working_dir
+            )
+        else:
+            cmd = f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry wait_state {self.task_id} --state={state} --timeout={timeout}"
+            record = json.loads(
+                _ssh_get(cmd, self.hostname, self.username, self.password, timeout + 10)
+            )
+        if record is not None and record["state"] == EXITING and state != EXITING:
+            raise TaskExitedError(f"task exited before {state}")
+        if record is None or STATES.index(record["state"]) < STATES.index(state):
+            raise TaskStartTimeout(f"wait task {state} timeout")
+        return record
+
     def wait_dead(self, timeout=0):
         """
         wait till remote process is dead
@@ -218,20 +946,118 @@ class Task:
             try:
                 pid_or_none = self._client.do_rpc("get_pid")
                 return pid_or_none if pid_or_none else 0
-            except (socket.timeout, ConnectionError, EOFError):
+            except (socket.timeout, NetworkTimeoutError, ConnectionError, EOFError):
                 # 无法连接到目标服务器，可能说明进程不存在，也有可能是网络错误
                 return 0
+        agent = self._agent()
+        if agent is not None:
+            status = agent.call(self, "get_pids", [self.task_id], self.working_dir)
+            pid, alive, _ = status[self.task_id]
+            return pid if alive else 0
         else:
             # 通过ssh读取pidfile文件获取进程ID
-            cmd = f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry get-pid {self.task_id}"
-            return int(_ssh_get(cmd, self.hostname, self.username, self.password, 10))
+            return int(
+                _ssh_get(
+                    self._get_pid_cmd(),
+                    self.hostname,
+                    self.username,
+                    self.password,
+                    10,
+                )
+            )
 
-    def do_rpc(self, func_name, *args, **kwargs):
+    def do_rpc(self, func_name, *args, timeout=None, **kwargs):
         """
         与远程进程通信(TCP socket)
+
+        Params:
+            timeout: seconds for the whole call(waiting for a free connection,
+                connecting and waiting for the reply), None to wait forever. it is
+                not passed to the method, pass a `timeout` of the method positionally
+
+        raise `NetworkTimeoutError` if timeout
+        """
+        if self._client is not None:
+            return self._client.do_rpc(func_name, *args, timeout=timeout, **kwargs)
+        return None
+
+    def do_rpc_many(self, calls, parallel=False):
+        """
+        execute a list of calls in one round trip
+
+        Params:
+            calls: `[(func_name, args, kwargs)]`, args and kwargs may be omitted, eg.
+                `["progress", ("counter", ("jobs",)), ("config", (), {"key": "a"})]`
+            parallel: execute the calls concurrently on the server's workers,
+                one by one if False or the server has no workers
+
+        return a list aligned with `calls` of results or the raised exceptions
+        """
+        if self._client is not None:
+            return self._client.do_rpc_many(calls, parallel)
+        return None
+
+    def do_rpc_stream(self, func_name, *args, chunk_size=100, prefetch=2, **kwargs):
+        """
+        call a generator(or async generator, with `makedaemon(server="asyncio")`)
+        method and return an iterator of the items it yields. the items are pulled
+        `chunk_size` at a time with `prefetch` pulls in flight, so both ends hold a
+        few chunks however long the stream is
+
+            for record in t.do_rpc_stream("records", "2023-01-01", chunk_size=1000):
+                ...
+
+        the remote generator is closed when the iterator is exhausted or closed, and
+        after `STREAM_IDLE_TIMEOUT` seconds without a pull. `chunk_size` and
+        `prefetch` are not passed to the method
+        """
+        if self._client is not None:
+            return self._client.do_rpc_stream(
+                func_name, *args, chunk_size=chunk_size, prefetch=prefetch, **kwargs
+            )
+        return None
+
+    def subscribe(self, topics: List[str]):
+        """
+        receive the events the task publishes on `topics`("*" for all) with
+        `F.publish`, read them with `get_event`. the last event of each topic is
+        pushed at once. subscriptions survive reconnects.
+
+        events not read yet are conflated: only the last payload of a topic is kept
+        """
+        if self._client is not None:
+            self._client.subscribe(topics)
+
+    def unsubscribe(self, topics: List[str] = None):
+        """
+        unsubscribe from `topics`, or from all if None
+        """
+        if self._client is not None:
+            self._client.unsubscribe(topics)
+
+    def get_event(self, timeout=None):
+        """
+        return the oldest pushed event `(topic, payload)`, or None if there is none
+        in `timeout` seconds
+
+            t.subscribe(["progress"])
+            while True:
+                topic, payload = t.get_event()
+        """
+        if self._client is not None:
+            return self._client.get_event(timeout)
+        return None
+
+    def submit_rpc(self, func_name, *args, **kwargs) -> RpcFuture:
+        """
+        pipelined `do_rpc`: send the call and return a `RpcFuture` at once, calls
+        submitted together share one round trip on high latency links
+
+            futures = [t.submit_rpc("add", i, 1) for i in range(100)]
+            results = [f.result() for f in futures]
         """
         if self._client is not None:
-            return self._client.do_rpc(func_name, *args, **kwargs)
+            return self._client.submit(func_name, *args, **kwargs)
         return None
 
     def terminate(self, timeout=12):
@@ -248,63 +1074,102 @@ class Task:
         pid = self.get_pid()
         self.reset_client()
         if pid:
-            cmd = f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry terminate_proc -p [{pid}] -t [{self.task_id}]"
-            _ssh_execute(cmd, self.hostname, self.username, self.password, timeout)
+            agent = self._agent()
+            if agent is not None:
+                _agent_terminate(agent, self, [pid], [self.task_id])
+            else:
+                cmd = self._terminate_cmd([pid], [self.task_id])
+                _ssh_execute(cmd, self.hostname, self.username, self.password, timeout)
         self.running = False
 
+    def log_tail(self, lines=100, log_dir=".", ssh_exec_timeout=10):
+        """
+        return the last `lines` lines of the task's log `pidfile-{task_id}.log`
+        """
+        agent = self._agent()
+        if agent is not None:
+            return agent.call(
+                self,
+                "log_tail",
+                self.task_id,
+                lines,
+                os.path.join(self.working_dir, log_dir),
+            )
+        cmd = f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry log_tail {self.task_id} --lines={lines} --log_dir={log_dir}"
+        return _ssh_output(
+            cmd, self.hostname, self.username, self.password, ssh_exec_timeout
+        )
+
+    def host_stats(self, ssh_exec_timeout=10):
+        """
+        return cpu, memory, disk and load of the task's host as dict
+        """
+        agent = self._agent()
+        if agent is not None:
+            return agent.call(self, "host_stats")
+        cmd = f"{self.py_env_activate} python -m rpcindaemon.entry host_stats"
+        return json.loads(
+            _ssh_get(cmd, self.hostname, self.username, self.password, ssh_exec_timeout)
+        )
+
+    def _agent(self):
+        if self.agent_port > 0:
+            return _get_agent(
+                self.hostname, self.username, self.agent_port, self.agent_bind
+            )
+        return None
+
+    def _run_cmd(self):
+        return f"{self.py_env_activate} {self._working_dir} {self.cmd} --task-id={self.task_id} {self._port_option}"
+
+    def _get_pid_cmd(self):
+        return f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry get-pid {self.task_id}"
+
+    def _get_pids_cmd(self, tids):
+        list_tids_repr = ",".join(map(str, tids))
+        return f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry get-pids '[{list_tids_repr}]'"
+
+    def _terminate_cmd(self, pids, tids):
+        list_pids_repr = ",".join(map(str, pids))
+        list_tids_repr = ",".join(map(str, tids))
+        return f"{self.py_env_activate} {self._working_dir} python -m rpcindaemon.entry terminate_proc -p [{list_pids_repr}] -t [{list_tids_repr}]"
+
 
 def _ssh_execute(cmd, hostname, username, pwd, timeout):
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            hostname,
-            username=username,
-            password=pwd,
-            timeout=1,
-        )
-        _, _, stderr = ssh.exec_command(cmd, timeout=timeout)
-        err = stderr.read()
-        if err:
-            raise SSHExecutionError(f"ssh_execute [{cmd}] error: {err}")
+        _, err = ssh_pool.exec_command(hostname, username, pwd, cmd, timeout)
     except socket.timeout:
         raise NetworkTimeoutError(
             f"ssh_execute connect to {username}@{hostname} timeout"
         )
-    except:
-        raise
-    finally:
-        try:
-            ssh.close()
-        except:
-            pass
+    if err:
+        raise SSHExecutionError(f"ssh_execute [{cmd}] error: {err}")
 
 
 def _ssh_get(cmd, hostname, username, pwd, timeout):
     try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh.connect(
-            hostname,
-            username=username,
-            password=pwd,
-            timeout=1,
-        )
-        _, stdout, stderr = ssh.exec_command(cmd, timeout=timeout)
-        data = stdout.readlines()
-        if data:
-            return data[-1].strip()
-        else:
-            raise SSHExecutionError(f"ssh_get [{cmd}] error: {stderr.read()}")
+        out, err = ssh_pool.exec_command(hostname, username, pwd, cmd, timeout)
     except socket.timeout:
         raise NetworkTimeoutError(f"ssh_get connect to {username}@{hostname} timeout")
-    except:
-        raise
-    finally:
-        try:
-            ssh.close()
-        except:
-            pass
+    return _last_line(cmd, out, err)
+
+
+def _ssh_output(cmd, hostname, username, pwd, timeout):
+    try:
+        out, err = ssh_pool.exec_command(hostname, username, pwd, cmd, timeout)
+    except socket.timeout:
+        raise NetworkTimeoutError(f"ssh_get connect to {username}@{hostname} timeout")
+    if err:
+        raise SSHExecutionError(f"ssh_get [{cmd}] error: {err}")
+    return out
+
+
+def _last_line(cmd, out, err):
+    data = out.splitlines()
+    if data:
+        return data[-1].strip()
+    else:
+        raise SSHExecutionError(f"ssh_get [{cmd}] error: {err}")
 
 
 def get_available_port(hostname: str):
@@ -331,21 +1196,164 @@ def batch_terminate(tasks: List[Task], ssh_exec_timeout=12):
     """
     machines = defaultdict(list)
     for t in tasks:
-        machines[t.hostname].append(t)
-    for hostname, _tasks in machines.items():
+        machines[(t.hostname, t.username, t.agent_port)].append(t)
+    for (hostname, _, _), _tasks in machines.items():
         pids = []
         tids = []
-        for t in _tasks:
+        for t, pid in zip(_tasks, batch_get_pid(_tasks)):
             if not t.running:
                 continue
-            pid = t.get_pid()
             t.reset_client()
             if pid:
                 pids.append(pid)
                 tids.append(t.task_id)
         if tids and pids:
             t = _tasks[0]
-            list_pids_repr = ",".join(map(str, pids))
-            list_tids_repr = ",".join(map(str, tids))
-            cmd = f"{t.py_env_activate} {t._working_dir} python -m rpcindaemon.entry terminate_proc -p [{list_pids_repr}] -t [{list_tids_repr}]"
-            _ssh_execute(cmd, hostname, t.username, t.password, ssh_exec_timeout)
+            agent = t._agent()
+            if agent is not None:
+                _agent_terminate(agent, t, pids, tids)
+            else:
+                cmd = t._terminate_cmd(pids, tids)
+                _ssh_execute(cmd, hostname, t.username, t.password, ssh_exec_timeout)
+
+
+def batch_get_status(tasks: List[Task], ssh_exec_timeout=10):
+    """
+    probe many tasks with one remote call per host (and working dir), instead of
+    one ssh session and python start per task.
+
+    return a list aligned with `tasks` of dict:
+        pid: pid written in the pidfile, 0 if there is no pidfile
+        alive: True if the pid exists
+        mtime: modification time of the pidfile(the start time of the task), None
+            if there is no pidfile
+
+    tasks that are not running (`Task.running` is False) are not probed.
+    """
+    status = [{"pid": 0, "alive": False, "mtime": None} for _ in tasks]
+    machines = defaultdict(list)
+    for i, t in enumerate(tasks):
+        if t.running:
+            machines[(t.hostname, t.username)].append(i)
+    for (hostname, username), indexes in machines.items():
+        for i, s in _host_status(tasks, indexes, ssh_exec_timeout).items():
+            status[i] = s
+    return status
+
+
+def batch_get_pid(tasks: List[Task], ssh_exec_timeout=10):
+    """
+    same as `[t.get_pid() for t in tasks]` but one remote call per host.
+    """
+    return [
+        s["pid"] if s["alive"] else 0 for s in batch_get_status(tasks, ssh_exec_timeout)
+    ]
+
+
+def _host_status(tasks, indexes, timeout):
+    """
+    status of `tasks[i] for i in indexes`, all on the same host, as {i: status}
+    """
+    t = tasks[indexes[0]]
+    hostname, username, password = t.hostname, t.username, t.password
+    # pidfiles are relative to the working dir, one probe per dir
+    groups = defaultdict(list)
+    for i in indexes:
+        t = tasks[i]
+        groups[(t.py_env_activate, t._working_dir, t.agent_port)].append(i)
+    ssh_groups = []
+    probes = []
+    for g in groups.values():
+        t = tasks[g[0]]
+        agent = t._agent()
+        if agent is not None:
+            tids = [tasks[i].task_id for i in g]
+            probe = agent.call(t, "get_pids", tids, t.working_dir)
+            probes.append((g, {str(tid): s for tid, s in probe.items()}))
+        else:
+            ssh_groups.append(g)
+    cmds = [
+        tasks[g[0]]._get_pids_cmd([tasks[i].task_id for i in g]) for g in ssh_groups
+    ]
+    results = ssh_pool.exec_many(hostname, username, password, cmds, timeout)
+    for g, cmd, r in zip(ssh_groups, cmds, results):
+        probes.append((g, json.loads(_ssh_result(cmd, r, hostname, username))))
+    status = {}
+    for g, probe in probes:
+        for i in g:
+            pid, alive, mtime = probe[str(tasks[i].task_id)]
+            status[i] = {"pid": pid, "alive": alive, "mtime": mtime}
+    return status
+
+
+def batch_run(tasks: List[Task], ssh_exec_timeout=60):
+    """
+    run many tasks at once. on every host the launches run concurrently, each task
+    on its own channel of the host's shared ssh transport, so launching N tasks on
+    one host costs about one round trip instead of N.
+
+    return a list aligned with `tasks`: None if the task was started, otherwise
+    the exception `Task.run` would have raised.
+    """
+    errors = [None] * len(tasks)
+    machines = defaultdict(list)
+    for i, t in enumerate(tasks):
+        machines[(t.hostname, t.username, t.agent_port)].append(i)
+    for (hostname, username, _), indexes in machines.items():
+        password = tasks[indexes[0]].password
+        agent = tasks[indexes[0]]._agent()
+        # 1. make sure none of them is running
+        running = [i for i in indexes if tasks[i].running]
+        try:
+            status = _host_status(tasks, running, 10) if running else {}
+        except Exception as e:
+            for i in indexes:
+                errors[i] = e
+            continue
+        to_run = []
+        for i in indexes:
+            s = status.get(i)
+            if s is not None and s["alive"]:
+                errors[i] = TaskIsRunningError("cannot run a running task")
+            else:
+                to_run.append(i)
+        # 2. launch
+        cmds = [tasks[i]._run_cmd() for i in to_run]
+        if agent is not None and cmds:
+            try:
+                results = agent.call(
+                    tasks[indexes[0]], "launch", cmds, ssh_exec_timeout
+                )
+            except Exception as e:
+                results = [e] * len(cmds)
+        else:
+            results = ssh_pool.exec_many(
+                hostname, username, password, cmds, ssh_exec_timeout
+            )
+        for i, cmd, r in zip(to_run, cmds, results):
+            t = tasks[i]
+            if isinstance(r, Exception):
+                errors[i] = _ssh_error(r, hostname, username)
+            elif r[1]:
+                errors[i] = SSHExecutionError(f"ssh_execute [{cmd}] error: {r[1]}")
+            else:
+                t.reset_client()
+                t.running = True
+    return errors
+
+
+def _ssh_error(e, hostname, username):
+    if isinstance(e, socket.timeout):
+        return NetworkTimeoutError(
+            f"ssh_execute connect to {username}@{hostname} timeout"
+        )
+    return e
+
+
+def _ssh_result(cmd, r, hostname, username):
+    """
+    the last stdout line of an `SSHPool.exec_many` result or raise its error
+    """
+    if isinstance(r, Exception):
+        raise _ssh_error(r, hostname, username)
+    return _last_line(cmd, *r)
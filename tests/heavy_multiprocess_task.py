@@ -86,6 +86,16 @@ def heavy_multiprocess_task04(task_id: int, f: rpcindaemon.F, max_cpus=None):
     print(task_id, datetime.datetime.now(), "End")
 
 
+@rpcindaemon.makedaemon()
+def heavy_multiprocess_task05(task_id: int, f: rpcindaemon.F, max_cpus=2):
+    print(task_id, datetime.datetime.now(), "Start")
+    # the same processes run every batch till terminated
+    f.start_pool(max_cpus)
+    while not f.stopping:
+        f.run_parallel(simple, range(4))
+    print(task_id, datetime.datetime.now(), "End")
+
+
 if __name__ == "__main__":
     fire.Fire(
         {
@@ -93,5 +103,6 @@ if __name__ == "__main__":
             "redirect_stdout_to_file": heavy_multiprocess_task02,
             "msg_queue": heavy_multiprocess_task03,
             "lock_and_msg_queue": heavy_multiprocess_task04,
+            "persistent_pool": heavy_multiprocess_task05,
         }
     )
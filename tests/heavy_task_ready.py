@@ -0,0 +1,24 @@
+import datetime
+import time
+
+import fire
+
+import rpcindaemon
+
+
+@rpcindaemon.makedaemon()
+def heavy_task_ready(task_id: int, f: rpcindaemon.F, init_time=2, arg_live_time=20):
+    print(task_id, datetime.datetime.now(), "Start")
+    time.sleep(init_time)  # loading...
+    f.notify_ready()
+    t = 0
+    while True:
+        if t > arg_live_time:
+            break
+        time.sleep(0.5)
+        t += 0.5
+    print(task_id, datetime.datetime.now(), "End")
+
+
+if __name__ == "__main__":
+    fire.Fire(heavy_task_ready)
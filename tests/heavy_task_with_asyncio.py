@@ -0,0 +1,21 @@
+import asyncio
+import time
+
+import fire
+
+import rpcindaemon
+
+
+class AsyncServerCmd(rpcindaemon.ServerCmd):
+    async def slow_add(self, arg1, arg2, seconds=1):
+        await asyncio.sleep(seconds)
+        return arg1 + arg2
+
+
+@rpcindaemon.makedaemon(server_cmd=AsyncServerCmd, server="asyncio")
+def heavy_backgournd_task(task_id: int, f: rpcindaemon.F, arg_live_time=20):
+    time.sleep(arg_live_time)
+
+
+if __name__ == "__main__":
+    fire.Fire(heavy_backgournd_task)
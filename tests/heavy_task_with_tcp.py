@@ -24,6 +24,7 @@ def heavy_backgournd_task(task_id: int, f: rpcindaemon.F, arg_live_time=20):
             break
         time.sleep(0.5)  # will block signal term or signal int
         t += 0.5
+        f.publish("progress", t)
     print(task_id, datetime.datetime.now(), "End")
 
 
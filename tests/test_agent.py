@@ -0,0 +1,39 @@
+import pytest
+
+import rpcindaemon
+from rpcindaemon.task import _agent_terminate, _get_agent
+
+agent_port = 9100
+
+
+def test_agent(param):
+    t = rpcindaemon.Task(
+        40,
+        "python heavy_task.py --arg_live_time=30",
+        param["hostname"],
+        username=param["user"],
+        password=param["pwd"],
+        py_env_activate=param["py_env_activate"],
+        working_dir=param["working_path"],
+        agent_port=agent_port,
+    )
+    t.run()  # start the agent over ssh if not running
+    t.wait_alive(10)
+    assert t.is_alive()
+    assert t.get_pid() == rpcindaemon.batch_get_pid([t])[0]
+    assert "Start" in t.log_tail(1)
+    assert t.host_stats()["cpu_count"] > 0
+    pid = t.get_pid()
+    t.terminate()
+    assert not t.is_alive()
+    # not sent again, a remote error is raised as over ssh
+    with pytest.raises(rpcindaemon.SSHExecutionError):
+        _agent_terminate(t._agent(), t, [pid], [t.task_id])
+
+
+def test_agent_per_user():
+    agent = _get_agent("host", "alice", agent_port)
+    assert _get_agent("host", "alice", agent_port) is agent
+    assert _get_agent("host", "bob", agent_port) is not agent
+    other = _get_agent("host", "alice", agent_port, "0.0.0.0")
+    assert other is not agent and other.bind == "0.0.0.0"
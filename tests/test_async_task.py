@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+import rpcindaemon
+from rpcindaemon.aiotask import _aligned, _on_host, _per_host
+
+
+def test_async_task(param):
+    async def _test():
+        tasks = [
+            rpcindaemon.AsyncTask(
+                task_id,
+                "python heavy_task_with_tcp.py --arg-live-time=30",
+                param["hostname"],
+                username=param["user"],
+                password=param["pwd"],
+                py_env_activate=param["py_env_activate"],
+                working_dir=param["working_path"],
+                port=port,
+            )
+            for task_id, port in ((50, 9950), (51, 9951), (52, -1))
+        ]
+        await asyncio.gather(*(t.run() for t in tasks))
+        await asyncio.gather(*(t.wait_alive(10) for t in tasks))
+        assert all(await asyncio.gather(*(t.is_alive() for t in tasks)))
+        assert await asyncio.gather(
+            *(t.do_rpc("deal_with_return", 1, 23, 45) for t in tasks)
+        ) == [69, 69, None]
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            await tasks[0].do_rpc("deal_not_found")
+        pids = await asyncio.gather(*(t.get_pid() for t in tasks))
+        assert pids == await rpcindaemon.async_batch_get_pid(tasks)
+
+        await rpcindaemon.async_batch_terminate(tasks)
+        await asyncio.gather(*(t.wait_dead(10) for t in tasks))
+
+    asyncio.run(_test())
+
+
+def test_host_executors():
+    running = defaultdict(int)
+    peak = defaultdict(int)
+    lock = threading.Lock()
+
+    def op(hostname):
+        with lock:
+            running[hostname] += 1
+            peak[hostname] = max(peak[hostname], running[hostname])
+        time.sleep(0.05)
+        with lock:
+            running[hostname] -= 1
+        return threading.current_thread().name
+
+    def batch(tasks):
+        return [(threading.current_thread().name, t.task_id) for t in tasks]
+
+    async def _test():
+        names = await asyncio.gather(
+            *(_on_host(h, 2, op, h) for h in ("a", "b") for _ in range(8))
+        )
+        tasks = [SimpleNamespace(hostname="ab"[i % 2], task_id=i) for i in range(6)]
+        return names, _aligned(tasks, await _per_host(batch, tasks))
+
+    names, results = asyncio.run(_test())
+    # 2 threads per host, the hosts in parallel
+    assert dict(peak) == {"a": 2, "b": 2}
+    assert len(set(names)) == 4
+    # one call per host, aligned with the tasks
+    assert [task_id for _, task_id in results] == list(range(6))
+    assert results[0][0].startswith("ssh-a") and results[1][0].startswith("ssh-b")
@@ -0,0 +1,32 @@
+import rpcindaemon
+
+
+def test_batch_get_pid(param):
+    tasks = [
+        rpcindaemon.Task(
+            task_id,
+            "python heavy_task.py --arg_live_time=30",
+            param["hostname"],
+            username=param["user"],
+            password=param["pwd"],
+            py_env_activate=param["py_env_activate"],
+            working_dir=param["working_path"],
+        )
+        for task_id in (30, 31, 32)
+    ]
+    assert rpcindaemon.batch_get_pid(tasks) == [0, 0, 0]
+    assert rpcindaemon.batch_run(tasks) == [None, None, None]
+    for t in tasks:
+        t.wait_alive(20)
+
+    pids = rpcindaemon.batch_get_pid(tasks)
+    assert pids == [t.get_pid() for t in tasks]
+    assert all(pids)
+    errors = rpcindaemon.batch_run(tasks)
+    assert all(isinstance(e, rpcindaemon.TaskIsRunningError) for e in errors)
+
+    status = rpcindaemon.batch_get_status(tasks)
+    assert all(s["alive"] and s["mtime"] for s in status)
+
+    rpcindaemon.batch_terminate(tasks)
+    assert rpcindaemon.batch_get_pid(tasks) == [0, 0, 0]
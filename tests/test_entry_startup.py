@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import rpcindaemon
+
+# `python -m rpcindaemon.entry` runs for every control operation over ssh, these
+# must not be imported by its hot commands
+heavy_modules = {
+    "paramiko",
+    "fire",
+    "filelock",
+    "multiprocessing",
+    "rpcindaemon.daemonize",
+    "rpcindaemon.task",
+}
+if sys.platform != "win32":
+    heavy_modules.add("psutil")
+
+
+def _imported_modules(tmp_path, *argv):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(rpcindaemon.__file__))] + sys.path
+    )
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "rpcindaemon.entry", *argv],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = {line.split("|")[-1].strip() for line in p.stderr.splitlines()}
+    return p.stdout, modules
+
+
+def test_get_pid_imports(tmp_path):
+    stdout, modules = _imported_modules(tmp_path, "get-pid", "999999")
+    assert stdout.strip() == "0"
+    assert not heavy_modules & modules
+
+
+def test_get_pids_imports(tmp_path):
+    (tmp_path / "pidfile-1").write_text(f"{os.getpid()}\n")
+    stdout, modules = _imported_modules(tmp_path, "get-pids", "[1,2]")
+    assert stdout.startswith(f'{{"1":[{os.getpid()},true,')
+    assert not heavy_modules & modules
+
+
+def test_fast_main_runs_once(monkeypatch):
+    from rpcindaemon import entry
+
+    calls = []
+
+    def terminate_proc(**kwargs):
+        calls.append(kwargs)
+        raise ValueError("half done")
+
+    monkeypatch.setattr(entry, "terminate_proc", terminate_proc)
+    # an error of the command is not mistaken for unparsable args
+    with pytest.raises(ValueError):
+        entry._fast_main(["terminate-proc", "-t", "[1,2]"])
+    assert calls == [{"task_ids": [1, 2]}]
+    assert entry._fast_main(["terminate-proc", "--unknown", "1"]) is False
+    assert calls == [{"task_ids": [1, 2]}]
+
+
+def test_star_import():
+    names = {}
+    exec("from rpcindaemon import *", names)
+    assert {
+        "Task",
+        "F",
+        "makedaemon",
+        "nodaemon",
+        "ServerCmd",
+        "batch_terminate",
+    } <= set(names)
+    assert {"ParamError", "NetworkTimeoutError"} <= set(names)
+    assert not {"importlib", "sys"} & set(names)
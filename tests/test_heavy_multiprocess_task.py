@@ -59,3 +59,21 @@ def test_lock_and_msg_queue(param):
     t.run()
     time.sleep(10)
     t.wait_dead()
+
+
+def test_persistent_pool(param):
+    t = rpcindaemon.Task(
+        204,
+        "python heavy_multiprocess_task.py persistent_pool",
+        param["hostname"],
+        username=param["user"],
+        password=param["pwd"],
+        py_env_activate=param["py_env_activate"],
+        working_dir=param["working_path"],
+    )
+    t.run()
+    t.wait_alive(10)
+    time.sleep(3)
+    # the signal handlers stop the loop and the pool
+    t.terminate()
+    t.wait_dead(10)
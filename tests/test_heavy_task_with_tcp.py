@@ -23,6 +23,9 @@ def _test_port(param, task_id, port):
         t.do_rpc("deal_not_found")
     assert t.do_rpc("deal_with_return", 1, 23, 45) == 69
     assert t.do_rpc("deal_with_message", 1, 23, 45) is None
+    t.subscribe(["progress"])
+    topic, progress = t.get_event(timeout=2)
+    assert topic == "progress" and t.get_event(timeout=2)[1] > progress
     time.sleep(25)
     assert not t.is_alive()
 
@@ -75,3 +78,23 @@ def test_save_and_restore(param):
     t2.terminate()
     assert not t2.is_alive()
     assert not t.is_alive()
+
+
+def test_asyncio_server(param):
+    t = rpcindaemon.Task(
+        14,
+        "python heavy_task_with_asyncio.py",
+        param["hostname"],
+        username=param["user"],
+        password=param["pwd"],
+        py_env_activate=param["py_env_activate"],
+        working_dir=param["working_path"],
+        port=9998,
+    )
+    t.run()
+    t.wait_alive(10)
+    assert t.do_rpc("slow_add", 1, 2, seconds=0.1) == 3
+    with pytest.raises(rpcindaemon.MethodNotFound):
+        t.do_rpc("deal_not_found")
+    t.terminate()
+    assert not t.is_alive()
@@ -0,0 +1,616 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+from multiprocessing import AuthenticationError
+
+import pytest
+
+import rpcindaemon
+from rpcindaemon.aiorpcserver import AsyncRpcServer
+from rpcindaemon.aiotask import _AsyncRPCProxy
+from rpcindaemon.rpcserver import RpcServer
+from rpcindaemon.task import _RPCPool, _RPCProxy
+
+port = 9980
+
+
+class LocalServerCmd(rpcindaemon.ServerCmd):
+    def records(self, n):
+        yield from range(n)
+
+    def slow(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    def echo(self, arg):
+        return arg
+
+    def worker_pid(self):
+        return os.getpid()
+
+    def boom(self):
+        raise ValueError("boom")
+
+
+@pytest.fixture
+def address():
+    return (socket.gethostbyname(socket.gethostname()), port)
+
+
+def _server(**kwargs):
+    server = RpcServer(port, LocalServerCmd, **kwargs)
+    server.start()
+    return server
+
+
+@pytest.mark.parametrize("worker_type", ["thread", "process"])
+def test_workers(address, worker_type):
+    server = _server(workers=2, worker_type=worker_type)
+    try:
+        slow_client = _RPCProxy(address)
+        client = _RPCProxy(address)
+        t = threading.Thread(target=slow_client.do_rpc, args=("slow", 1))
+        t.start()
+        time.sleep(0.3)
+        st = time.time()
+        # not blocked by the slow call of the other connection
+        assert client.do_rpc("get_pid") == os.getpid()
+        assert client.do_rpc("echo", 1) == 1
+        assert time.time() - st < 0.5
+        stats = client.do_rpc("__pool_stats__")
+        assert stats["workers"] == 2 and stats["busy"] >= 1
+        t.join()
+        if worker_type == "process":
+            assert client.do_rpc("worker_pid") != os.getpid()
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            client.do_rpc("not_found")
+        slow_client.close()
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_serial(address):
+    server = _server()
+    try:
+        client = _RPCProxy(address)
+        assert [client.do_rpc("echo", i) for i in range(10)] == list(range(10))
+        assert client.do_rpc("__pool_stats__")["workers"] == 0
+        client.close()
+    finally:
+        server.stop()
+
+
+class AsyncServerCmd(LocalServerCmd):
+    async def async_slow(self, seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+
+def test_asyncio_server(address):
+    server = AsyncRpcServer(port, AsyncServerCmd, workers=2)
+    server.start()
+    try:
+        clients = [_RPCProxy(address) for _ in range(50)]
+        st = time.time()
+        threads = [
+            threading.Thread(target=c.do_rpc, args=("async_slow", 0.5)) for c in clients
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.1)
+        client = _RPCProxy(address)
+        assert client.do_rpc("get_pid") == os.getpid()
+        assert client.do_rpc("__pool_stats__")["busy"] >= 1
+        for t in threads:
+            t.join()
+        # awaited concurrently, not one after another
+        assert time.time() - st < 2
+        assert client.do_rpc("slow", 0.1) == 0.1
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            client.do_rpc("not_found")
+        for c in clients + [client]:
+            c.close()
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("server_cls", [RpcServer, AsyncRpcServer])
+def test_pipelining(address, server_cls):
+    server = server_cls(port, AsyncServerCmd, workers=4)
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        st = time.time()
+        slow = client.submit("slow", 1)
+        futures = [client.submit("echo", i) for i in range(20)]
+        # answered before the slow call submitted first
+        assert [f.result() for f in futures] == list(range(20))
+        assert time.time() - st < 0.9
+        assert not slow.done()
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            slow.result(timeout=0.1)
+        assert client.do_rpc("echo", "x") == "x"
+        # given up, the late result is dropped
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            slow.result()
+        time.sleep(1)
+        assert client.do_rpc("echo", "x") == "x"
+        assert not client._results and not client._forgotten
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            client.submit("not_found").result()
+        # untagged requests still work on the same connection
+        assert client.do_rpc("echo", "y") == "y"
+        client.close()
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize(
+    "server_cls,worker_type",
+    [(RpcServer, "thread"), (RpcServer, "process"), (AsyncRpcServer, "thread")],
+)
+def test_batch(address, server_cls, worker_type):
+    server = server_cls(port, AsyncServerCmd, workers=4, worker_type=worker_type)
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        calls = ["get_pid", ("echo", (1,)), ("echo", (), {"arg": 2}), ("not_found",)]
+        r = client.do_rpc_many(calls)
+        assert r[:3] == [os.getpid(), 1, 2]
+        assert isinstance(r[3], rpcindaemon.MethodNotFound)
+        st = time.time()
+        assert client.do_rpc_many([("slow", (0.5,))] * 4, parallel=True) == [0.5] * 4
+        assert time.time() - st < 1.5
+        client.close()
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("server_cls", [RpcServer, AsyncRpcServer])
+@pytest.mark.parametrize("codec", ["pickle5", "msgpack"])
+def test_codecs(address, server_cls, codec):
+    if codec == "msgpack":
+        pytest.importorskip("msgpack")
+    server = server_cls(port, AsyncServerCmd, workers=2)
+    server.start()
+    try:
+        client = _RPCProxy(address, codecs=[codec, "pickle"])
+        blob = bytearray(range(256)) * 1000
+        assert client.do_rpc("echo", blob) == blob
+        assert client._codec.name == codec
+        value = {"a": (1, [2.0, "3"]), 4: b"5", "e": None}
+        assert client.do_rpc("echo", value) == value
+        assert client.submit("echo", (1, 2)).result() == (1, 2)
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            client.do_rpc("not_found")
+        client.close()
+        # unknown codecs fall back to pickle
+        client = _RPCProxy(address, codecs=["unknown"])
+        assert client.do_rpc("echo", 1) == 1
+        assert client._codec.name == "pickle"
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_pickle5_out_of_band():
+    numpy = pytest.importorskip("numpy")
+    codec = rpcindaemon.codec.get_codec("pickle5")
+    a = numpy.arange(100000)
+    frames = codec.encode({"a": a})
+    assert len(frames) == 2 and len(frames[0]) < 1000
+    assert (codec.decode([bytes(f) for f in frames])["a"] == a).all()
+
+
+class StreamServerCmd(AsyncServerCmd):
+    def records(self, n):
+        for i in range(n):
+            yield {"id": i}
+
+    def broken(self):
+        yield 1
+        raise ValueError("broken")
+
+    def returns_generator(self, n):
+        return (i for i in range(n))
+
+    async def async_records(self, n):
+        for i in range(n):
+            await asyncio.sleep(0)
+            yield i
+
+
+@pytest.mark.parametrize(
+    "server_cls,workers", [(RpcServer, 0), (RpcServer, 4), (AsyncRpcServer, 2)]
+)
+def test_stream(address, server_cls, workers):
+    server = server_cls(port, StreamServerCmd, workers=workers)
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        records = client.do_rpc_stream("records", 1000, chunk_size=7, prefetch=4)
+        assert [r["id"] for r in records] == list(range(1000))
+        assert list(client.do_rpc_stream("records", 0)) == []
+        with pytest.raises(ValueError):
+            list(client.do_rpc_stream("broken"))
+        # closed early, the remote generator is closed too
+        it = client.do_rpc_stream("records", 1000, chunk_size=10)
+        assert next(it) == {"id": 0}
+        it.close()
+        deadline = time.time() + 1
+        while server._streams._streams and time.time() < deadline:
+            time.sleep(0.01)
+        assert not server._streams._streams
+        if server_cls is AsyncRpcServer:
+            assert list(
+                client.do_rpc_stream("async_records", 50, chunk_size=8)
+            ) == list(range(50))
+        else:
+            with pytest.raises(rpcindaemon.ParamError):
+                client.do_rpc_stream("async_records", 50)
+        assert client.do_rpc("echo", 1) == 1
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_stream_process_workers(address):
+    server = RpcServer(port, StreamServerCmd, workers=2, worker_type="process")
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        # streamed from the server process, generators cannot leave a worker
+        records = client.do_rpc_stream("records", 100, chunk_size=7)
+        assert [r["id"] for r in records] == list(range(100))
+        with pytest.raises(rpcindaemon.ParamError, match="generator function"):
+            client.do_rpc("returns_generator", 3)
+        assert client.do_rpc("worker_pid") != os.getpid()
+        client.close()
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("server_cls", [RpcServer, AsyncRpcServer])
+def test_subscribe(address, server_cls):
+    server = server_cls(port, StreamServerCmd, workers=2)
+    server.start()
+    try:
+        server.publish("progress", 0)
+        client = _RPCProxy(address)
+        client.subscribe(["progress", "state"])
+        # the last value is pushed at once
+        assert client.get_event(timeout=1) == ("progress", 0)
+        assert client.get_event(timeout=0.1) is None
+        for i in range(1, 100):
+            server.publish("progress", i)
+        server.publish("ignored", 1)
+        server.publish("state", "done")
+        time.sleep(0.2)
+        # calls still work and buffer the events meanwhile
+        assert client.do_rpc("echo", 1) == 1
+        events = []
+        while True:
+            event = client.get_event(timeout=0.2)
+            if event is None:
+                break
+            events.append(event)
+        # conflated to the last progress
+        assert events[-2:] == [("progress", 99), ("state", "done")]
+        assert len(events) < 100
+        client.unsubscribe(["progress"])
+        server.publish("progress", 100)
+        server.publish("state", "again")
+        assert client.get_event(timeout=1) == ("state", "again")
+        # subscriptions survive reconnects
+        client.close()
+        server.publish("state", "reconnected")
+        assert client.get_event(timeout=1) == ("state", "reconnected")
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_broker_max_topics():
+    from rpcindaemon.pubsub import Broker
+
+    broker = Broker(lambda key: None, max_topics=3)
+    for i in range(1000):
+        broker.publish(f"job-{i}", i)
+    broker.publish("job-997", "again")
+    assert broker.stats()["topics"] == 3
+    # the most recently published are kept for new subscribers
+    broker.subscribe("client", ["*"])
+    assert broker.take("client") == [
+        ("job-998", 998),
+        ("job-999", 999),
+        ("job-997", "again"),
+    ]
+
+
+def test_pool(address):
+    server = _server(workers=8)
+    try:
+        pool = _RPCPool(address, max_size=4, max_idle=0.2)
+        st = time.time()
+        threads = [
+            threading.Thread(target=pool.do_rpc, args=("slow", 0.5)) for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.1)
+        assert pool.stats()["in_use"] == 4
+        for t in threads:
+            t.join()
+        # 4 connections in parallel, 2 rounds
+        assert 1 <= time.time() - st < 1.5
+        assert pool.stats() == {"idle": 4, "in_use": 0, "max_size": 4}
+        # a broken connection is replaced
+        with pool.connection() as proxy:
+            proxy.do_rpc("echo", 1)
+        proxy._connection.close()
+        assert pool.do_rpc("echo", 2) == 2
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            pool.do_rpc("not_found")
+        assert list(pool.do_rpc_stream("records", 3)) == [0, 1, 2]
+        # dropped, closed or not a stream, the connection is checked back in
+        pool.checkout_timeout = 1
+        for _ in range(5):
+            pool.do_rpc_stream("records", 3)
+        it = pool.do_rpc_stream("records", 100, chunk_size=2)
+        assert next(it) == 0
+        it.close()
+        assert list(pool.do_rpc_stream("echo", [4])) == [4]
+        assert pool.stats()["in_use"] == 0
+        assert pool.do_rpc("echo", 3, timeout=1) == 3
+        time.sleep(0.3)
+        assert pool.do_rpc("echo", 3) == 3
+        # idle connections are evicted
+        assert pool.stats()["idle"] == 1
+        pool.close()
+    finally:
+        server.stop()
+
+
+def test_pool_stats_process(address):
+    server = _server(workers=1, worker_type="process")
+    try:
+        client = _RPCProxy(address)
+        client.do_rpc("echo", 0)  # the worker process is started
+        futures = [client.submit("slow", 0.5) for _ in range(3)]
+        time.sleep(0.2)
+        other = _RPCProxy(address)
+        stats = other.do_rpc("__pool_stats__")
+        # one running in the worker process, two waiting for it, and this call
+        assert (stats["queued"], stats["busy"]) == (2, 2)
+        assert [f.result() for f in futures] == [0.5] * 3
+        client.close()
+        other.close()
+    finally:
+        server.stop()
+
+
+def test_pipelining_broken(address):
+    server = _server(workers=4)
+    try:
+        client = _RPCProxy(address)
+        fast = client.submit("echo", 1)
+        slow = [client.submit("slow", 1) for _ in range(3)]
+        # reads the reply of fast meanwhile
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            slow[0].result(timeout=0.3)
+        broken = socket.socket(fileno=os.dup(client._connection.fileno()))
+        broken.shutdown(socket.SHUT_RDWR)
+        broken.close()
+        with pytest.raises(EOFError):
+            slow[1].result()
+        # the others fail, the replies already received are kept
+        assert slow[2].done()
+        with pytest.raises(ConnectionError):
+            slow[2].result()
+        assert fast.done() and fast.result() == 1
+        assert client.do_rpc("echo", 2) == 2
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_max_connections(address):
+    server = _server()
+    # as on windows, where select() takes 512 sockets
+    server._max_peers = 2
+    try:
+        clients = [_RPCProxy(address) for _ in range(3)]
+        assert [c.do_rpc("echo", 1) for c in clients[:2]] == [1, 1]
+        with pytest.raises((EOFError, OSError)):
+            clients[2].do_rpc("echo", 1)
+        clients[0].close()
+        deadline = time.time() + 1
+        while server._peers > 1 and time.time() < deadline:
+            time.sleep(0.01)
+        # still serving, room for one more
+        assert clients[2].do_rpc("echo", 2) == 2
+        assert clients[1].do_rpc("echo", 3) == 3
+        for c in clients:
+            c.close()
+    finally:
+        server.stop()
+
+
+def test_authkey(address):
+    server = _server(authkey=b"secret")
+    try:
+        client = _RPCProxy(address, authkey=b"secret")
+        assert client.do_rpc("echo", 1) == 1
+        with pytest.raises(AuthenticationError):
+            _RPCProxy(address, authkey=b"wrong").do_rpc("echo", 1)
+        # the request is no answer to the challenge
+        with pytest.raises(Exception):
+            _RPCProxy(address).do_rpc("echo", 1)
+        # one not answering does not hold up the others
+        silent = socket.create_connection(address)
+        pool = _RPCPool(address, authkey=b"secret")
+        assert pool.do_rpc("echo", 2, timeout=1) == 2
+        assert client.do_rpc("echo", 3) == 3
+        silent.close()
+        client.close()
+        pool.close()
+    finally:
+        server.stop()
+
+
+def test_pool_remote_errors(address):
+    server = _server(workers=2)
+    try:
+        pool = _RPCPool(address, max_size=1)
+        assert pool.do_rpc("echo", 1) == 1
+        ((proxy, _),) = pool._idle
+        # raised by the server, the connection is checked back in
+        with pytest.raises(ValueError, match="boom"):
+            pool.do_rpc("boom")
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            pool.do_rpc("not_found")
+        with pytest.raises(TypeError):
+            pool.do_rpc("echo", 1, 2)
+        assert pool.stats()["idle"] == 1 and pool._idle[0][0] is proxy
+        assert pool.do_rpc("echo", 2) == 2 and pool._idle[0][0] is proxy
+        # a timeout leaves a reply in flight, the connection is dropped
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            pool.do_rpc("slow", 0.5, timeout=0.1)
+        assert pool.stats()["idle"] == 0
+        assert pool.do_rpc("echo", 3) == 3
+        pool.close()
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("server_cls", [RpcServer, AsyncRpcServer])
+def test_timeout(address, server_cls):
+    server = server_cls(port, AsyncServerCmd, workers=2)
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        st = time.time()
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            client.do_rpc("slow", 1, timeout=0.2)
+        assert time.time() - st < 0.5
+        # the late reply is not taken as the next call's
+        assert client.do_rpc("echo", 1, timeout=1) == 1
+        pool = _RPCPool(address, max_size=1)
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            pool.do_rpc("slow", 1, timeout=0.2)
+        assert pool.do_rpc("echo", 2, timeout=1) == 2
+        # no time left to connect, not a non-blocking connect
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            _RPCProxy(address).do_rpc("echo", 3, timeout=0)
+        client.close()
+        pool.close()
+    finally:
+        server.stop()
+
+
+def test_async_timeout(address):
+    server = _server(workers=2)
+
+    async def main():
+        client = _AsyncRPCProxy(address)
+        with pytest.raises(rpcindaemon.NetworkTimeoutError):
+            await client.do_rpc("slow", 1, timeout=0.2)
+        assert await client.do_rpc("echo", 1, timeout=1) == 1
+        client.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.stop()
+
+
+class CounterHandler(rpcindaemon.RpcHandler):
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @rpcindaemon.rpc_method
+    def incr(self):
+        with self.lock:
+            self.count += 1
+            return self.count
+
+    @rpcindaemon.rpc_method(name="echo")
+    def _echo(self, arg):
+        return arg
+
+    @rpcindaemon.rpc_method
+    async def async_echo(self, arg):
+        return arg
+
+    def hidden(self):
+        return "not exposed"
+
+
+@pytest.mark.parametrize("server_cls", [RpcServer, AsyncRpcServer])
+def test_handler(address, server_cls):
+    server = server_cls(port, CounterHandler, workers=2)
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        # one instance keeps its state across requests and connections
+        assert [client.do_rpc("incr") for _ in range(3)] == [1, 2, 3]
+        assert _RPCProxy(address).do_rpc("incr") == 4
+        assert client.do_rpc("echo", "x") == "x"
+        assert client.do_rpc("get_pid") == os.getpid()
+        assert client.do_rpc("list_methods") == [
+            "async_echo",
+            "echo",
+            "get_pid",
+            "incr",
+            "list_methods",
+        ]
+        if server_cls is AsyncRpcServer:
+            assert client.do_rpc("async_echo", 1) == 1
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            client.do_rpc("hidden")
+        client.close()
+    finally:
+        server.stop()
+
+
+@pytest.mark.parametrize("server_cls", [RpcServer, AsyncRpcServer])
+def test_stats(address, server_cls, capsys):
+    server = server_cls(port, AsyncServerCmd, workers=2)
+    server.start()
+    try:
+        client = _RPCProxy(address)
+        for _ in range(10):
+            client.do_rpc("slow", 0.01)
+        client.do_rpc("echo", b"x" * 10000)
+        with pytest.raises(rpcindaemon.MethodNotFound):
+            client.do_rpc("not_found")
+        stats = client.do_rpc("__stats__")
+        assert stats["pool"]["workers"] == 2
+        slow = stats["methods"]["slow"]
+        assert slow["calls"] == 10 and slow["errors"] == 0
+        assert 0.01 <= slow["execute"]["p50"] <= slow["execute"]["max"] < 0.1
+        echo = stats["methods"]["echo"]
+        assert echo["bytes_in"] > 10000 and echo["bytes_out"] > 10000
+        assert stats["methods"]["not_found"]["errors"] == 1
+        client.close()
+    finally:
+        server.stop()
+    # dumped to the daemon log
+    assert "slow" in capsys.readouterr().out
+
+
+def test_histogram():
+    from rpcindaemon.stats import LatencyHistogram
+
+    h = LatencyHistogram()
+    for i in range(1, 1001):
+        h.add(i / 1e4)  # 0.1ms ~ 100ms
+    assert h.count == 1000 and h.max == 0.1
+    # at most one bucket(25%) above the truth
+    assert 0.05 <= h.percentile(0.5) <= 0.05 * 1.25
+    assert 0.099 <= h.percentile(0.99) <= 0.1
+    assert LatencyHistogram().summary()["p99"] == 0.0
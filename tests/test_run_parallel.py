@@ -0,0 +1,249 @@
+import multiprocessing
+import os
+import re
+import signal
+import time
+
+import pytest
+
+import rpcindaemon
+
+
+@pytest.fixture
+def f():
+    # run_parallel ignores SIGINT of the foreground parent process, restore it
+    handlers = {s: signal.getsignal(s) for s in (signal.SIGINT, signal.SIGTERM)}
+    yield rpcindaemon.F(None, False)
+    for s, handler in handlers.items():
+        signal.signal(s, handler)
+
+
+def square(a, is_daemon):
+    # later args finish first
+    time.sleep(0.02 * (5 - a % 5))
+    return a * a
+
+
+def fail(a, is_daemon):
+    if a == 3:
+        raise ValueError(a)
+    return a
+
+
+def report(a, is_daemon):
+    rpcindaemon.daemonize.message_queue.put(a)
+    return os.getpid()
+
+
+def test_map_parallel(f):
+    results = list(f.map_parallel(square, range(20), max_cpus=4))
+    assert results == [(a, a * a) for a in range(20)]
+    results = list(f.map_parallel(square, range(20), max_cpus=4, ordered=False))
+    assert sorted(results) == [(a, a * a) for a in range(20)]
+    assert results != sorted(results)
+    results = f.map_parallel(square, iter(range(20)), max_cpus=2, chunksize=3)
+    assert list(results) == [(a, a * a) for a in range(20)]
+
+
+def test_map_parallel_bounded(f):
+    consumed = []
+
+    def args():
+        for a in range(1000):
+            consumed.append(a)
+            yield a
+
+    results = f.map_parallel(square, args(), max_cpus=2, max_pending=4)
+    assert next(results) == (0, 0)
+    time.sleep(0.2)
+    # no more than max_pending args taken ahead of the consumer
+    assert len(consumed) <= 5
+    results.close()
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_map_parallel_error(f, ordered):
+    with pytest.raises(ValueError):
+        list(f.map_parallel(fail, range(10), max_cpus=2, ordered=ordered))
+
+
+def test_map_parallel_messages(f):
+    messages = []
+    results = f.map_parallel(
+        report,
+        range(10),
+        max_cpus=2,
+        message_queue=multiprocessing.JoinableQueue(),
+        message_handler=messages.append,
+    )
+    assert len({pid for _, pid in results} - {os.getpid()}) >= 1
+    assert sorted(messages) == list(range(10))
+    with pytest.raises(rpcindaemon.ParamError):
+        f.map_parallel(report, range(10), message_handler=messages.append)
+
+
+def record(a, is_daemon):
+    # tell the parent this arg started
+    rpcindaemon.daemonize.message_queue.put(("start", a))
+    time.sleep(0.01)
+
+
+def test_run_parallel_lazy(f, capsys):
+    consumed = []
+    messages = []
+
+    def args():
+        for a in range(40):
+            consumed.append((a, len(messages)))
+            yield a
+
+    f.run_parallel(
+        record,
+        args(),
+        max_cpus=2,
+        prefetch=4,
+        message_queue=multiprocessing.JoinableQueue(),
+        message_handler=messages.append,
+    )
+    assert sorted(a for _, a in messages) == list(range(40))
+    # taken from the generator as the children go, not all up front
+    assert consumed[-1][1] > 0
+    f.run_parallel(fail, range(6), max_cpus=2)
+    # an error is printed, the other args still run
+    assert "fail(3,) failed: ValueError(3)" in capsys.readouterr().out
+
+
+def fail_or_report(a, is_daemon):
+    if a in (3, 2500):
+        raise ValueError(a)
+    rpcindaemon.daemonize.message_queue.put(a)
+
+
+def test_run_parallel_chunk_error(f, capsys):
+    messages = []
+    f.run_parallel(
+        fail_or_report,
+        range(10),
+        max_cpus=2,
+        chunksize=5,
+        message_queue=multiprocessing.JoinableQueue(),
+        message_handler=messages.append,
+    )
+    # the rest of the chunk of 3 still runs, only 3 is blamed
+    assert sorted(messages) == [a for a in range(10) if a != 3]
+    out = capsys.readouterr().out
+    assert "fail_or_report(3,) failed: ValueError(3)" in out
+    assert out.count("failed") == 1
+    results = f.map_parallel(fail, range(10), max_cpus=2, chunksize=5)
+    assert [next(results) for _ in range(3)] == [(0, 0), (1, 1), (2, 2)]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def worker_pid(a, is_daemon):
+    time.sleep(0.03)
+    return os.getpid()
+
+
+def test_persistent_pool(f):
+    f.start_pool(2)
+    try:
+        pids = {pid for _, pid in f.map_parallel(worker_pid, range(20))}
+        f.run_parallel(worker_pid, range(20))
+        # the same processes serve every call
+        assert {pid for _, pid in f.map_parallel(worker_pid, range(20))} == pids
+        with pytest.raises(rpcindaemon.ParamError):
+            f.run_parallel(worker_pid, range(4), max_cpus=3)
+        f.resize_pool(3)
+        assert len({pid for _, pid in f.map_parallel(worker_pid, range(30))}) == 3
+        assert not f.stopping
+    finally:
+        f.close_pool()
+
+
+def load_table(n):
+    # expensive one-time setup, once per worker process
+    rpcindaemon.daemonize.message_queue.put(os.getpid())
+    return {a: a * 10 for a in range(n)}
+
+
+def lookup(a, is_daemon):
+    return rpcindaemon.worker_context()[a]
+
+
+def broken_init():
+    raise RuntimeError("no model")
+
+
+def test_worker_init(f):
+    inits = []
+    results = f.map_parallel(
+        lookup,
+        range(50),
+        max_cpus=2,
+        message_queue=multiprocessing.JoinableQueue(),
+        message_handler=inits.append,
+        worker_init=load_table,
+        worker_init_args=(50,),
+    )
+    assert list(results) == [(a, a * 10) for a in range(50)]
+    # once per process, not per arg
+    assert len(inits) == len(set(inits)) <= 2
+    with pytest.raises(RuntimeError, match="no model"):
+        list(f.map_parallel(lookup, range(4), max_cpus=2, worker_init=broken_init))
+
+
+def tiny(a, is_daemon):
+    return a + 1
+
+
+def test_auto_chunksize(f, capsys):
+    results = f.map_parallel(tiny, range(2000), max_cpus=2, chunksize="auto")
+    assert list(results) == [(a, a + 1) for a in range(2000)]
+    out = capsys.readouterr().out
+    assert "run_parallel chunksize=auto: chunksize=" in out
+    # far cheaper to run than to send, the chunks grow
+    assert "chunksize=1," not in out
+    results = f.map_parallel(
+        square, range(20), max_cpus=2, ordered=False, chunksize="auto"
+    )
+    assert sorted(results) == [(a, a * a) for a in range(20)]
+    f.run_parallel(fail, range(20), max_cpus=2, chunksize="auto")
+    assert "fail(3,) failed: ValueError(3)" in capsys.readouterr().out
+    with pytest.raises(rpcindaemon.ParamError):
+        f.map_parallel(tiny, range(4), chunksize=0)
+
+
+def pid_of(a, is_daemon):
+    return os.getpid()
+
+
+def slow_init():
+    time.sleep(0.5)
+
+
+def test_auto_chunksize_parallel(f, capsys):
+    # the start of the processes and `worker_init` are not taken for round trips
+    results = f.map_parallel(
+        pid_of, range(20000), max_cpus=2, chunksize="auto", worker_init=slow_init
+    )
+    assert len({pid for _, pid in results}) == 2
+    chunksize = int(re.search(r"chunksize=(\d+),", capsys.readouterr().out)[1])
+    assert 1 < chunksize <= 10000
+
+
+def test_auto_chunksize_error(f, capsys):
+    messages = []
+    f.run_parallel(
+        fail_or_report,
+        range(3000),
+        max_cpus=2,
+        chunksize="auto",
+        message_queue=multiprocessing.JoinableQueue(),
+        message_handler=messages.append,
+    )
+    out = capsys.readouterr().out
+    assert "chunksize=1," not in out
+    # failing in a big chunk after tuning, the rest of the chunk still runs
+    assert "fail_or_report(2500,) failed: ValueError(2500)" in out
+    assert sorted(messages) == [a for a in range(3000) if a not in (3, 2500)]
@@ -0,0 +1,168 @@
+import threading
+import time
+
+import paramiko
+import pytest
+
+from rpcindaemon import sshpool
+from rpcindaemon.sshpool import SSHPool
+
+
+class FakeChannel:
+    def __init__(self, transport):
+        self.transport = transport
+        self.out = b""
+        self.eof_received = False
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, cmd):
+        if cmd == "fail":
+            raise paramiko.SSHException("channel closed")
+        with self.transport.lock:
+            self.transport.running += 1
+            self.transport.max_running = max(
+                self.transport.max_running, self.transport.running
+            )
+        time.sleep(0.05)
+        with self.transport.lock:
+            self.transport.running -= 1
+        self.out = f"{cmd}\n".encode()
+        self.eof_received = True
+
+    def recv_ready(self):
+        return bool(self.out)
+
+    def recv(self, n):
+        out, self.out = self.out, b""
+        return out
+
+    def recv_stderr_ready(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        pass
+
+    def open_session(self, timeout=None):
+        if not self.active:
+            raise paramiko.SSHException("dead")
+        return FakeChannel(self)
+
+
+class FakeSSHClient:
+    connects = []
+
+    def __init__(self):
+        self.transport = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, username, password, timeout):
+        if password != "pwd":
+            raise paramiko.AuthenticationException()
+        self.transport = FakeTransport()
+        FakeSSHClient.connects.append(self)
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.active = False
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeSSHClient.connects = []
+    monkeypatch.setattr(sshpool.paramiko, "SSHClient", FakeSSHClient)
+    pool = SSHPool(max_idle=0.2)
+    yield pool
+    pool.close()
+
+
+def test_reuse(pool):
+    assert pool.exec_command("host", "root", "pwd", "echo 1") == ("echo 1\n", "")
+    assert pool.exec_command("host", "root", "pwd", "echo 2") == ("echo 2\n", "")
+    assert len(FakeSSHClient.connects) == 1
+    # another user, another transport
+    pool.exec_command("host", "admin", "pwd", "echo 3")
+    assert len(FakeSSHClient.connects) == 2
+    with pytest.raises(paramiko.AuthenticationException):
+        pool.exec_command("host", "root", "wrong", "echo 4")
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["connections"]) == (1, 3, 2)
+
+
+def test_reconnect(pool):
+    pool.exec_command("host", "root", "pwd", "echo 1")
+    FakeSSHClient.connects[0].transport.active = False
+    assert pool.exec_command("host", "root", "pwd", "echo 2") == ("echo 2\n", "")
+    assert len(FakeSSHClient.connects) == 2
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_evict_idle(pool):
+    pool.exec_command("host", "root", "pwd", "echo 1")
+    # closed in the background, no call needed
+    time.sleep(0.5)
+    assert pool.stats()["connections"] == 0
+    assert pool.stats()["evictions"] == 1
+    assert not FakeSSHClient.connects[0].transport.active
+
+
+def test_exec_many(pool):
+    pool.max_channels = 3
+    cmds = [f"echo {i}" for i in range(10)]
+    results = pool.exec_many("host", "root", "pwd", cmds)
+    assert results == [(f"{cmd}\n", "") for cmd in cmds]
+    (client,) = FakeSSHClient.connects
+    assert client.transport.max_running == 3
+
+
+def test_exec_many_errors(pool):
+    results = pool.exec_many("host", "root", "pwd", ["echo 1", "fail", "echo 2"])
+    # aligned with the commands, a failure does not affect the others
+    assert results[0] == ("echo 1\n", "") and results[2] == ("echo 2\n", "")
+    assert isinstance(results[1], paramiko.SSHException)
+    assert pool.exec_many("host", "root", "pwd", []) == []
+    # connects once up front, an auth failure is raised, not returned per command
+    with pytest.raises(paramiko.AuthenticationException):
+        pool.exec_many("host", "root", "wrong", ["echo 1", "echo 2"])
+
+
+def test_stats_threads(pool):
+    pool.exec_command("host", "root", "pwd", "echo 0")
+    threads = [
+        threading.Thread(
+            target=lambda: [
+                pool.exec_command("host", "root", "pwd", "echo") for _ in range(5)
+            ]
+        )
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = pool.stats()
+    assert stats["hits"] + stats["misses"] + stats["reconnects"] == 41
@@ -0,0 +1,45 @@
+import pytest
+
+import rpcindaemon
+
+
+def _task(param, task_id, cmd, **kwargs):
+    return rpcindaemon.Task(
+        task_id,
+        cmd,
+        param["hostname"],
+        username=param["user"],
+        password=param["pwd"],
+        py_env_activate=param["py_env_activate"],
+        working_dir=param["working_path"],
+        **kwargs,
+    )
+
+
+def test_wait_ready(param):
+    t = _task(param, 60, "python heavy_task_ready.py --init-time=2", port=9960)
+    t.run()
+    record = t.wait_ready(10, state="rpc-listening")
+    assert record["state"] in ("rpc-listening", "ready")
+    assert t.do_rpc("get_pid") == record["pid"]
+    record = t.wait_ready(10)
+    assert record["state"] == "ready"
+    assert record["times"]["ready"] - record["times"]["starting"] >= 2
+    t.terminate()
+    assert t.wait_ready(10, state="exiting")["state"] == "exiting"
+
+
+def test_wait_ready_timeout(param):
+    t = _task(param, 61, "python heavy_task_ready.py --init-time=10")
+    t.run()
+    with pytest.raises(rpcindaemon.TaskStartTimeout):
+        t.wait_ready(1)
+    t.terminate()
+
+
+def test_wait_ready_exited(param):
+    # never calls `F.notify_ready()`
+    t = _task(param, 62, "python heavy_task.py --arg-live-time=1")
+    t.run()
+    with pytest.raises(rpcindaemon.TaskExitedError):
+        t.wait_ready(10)